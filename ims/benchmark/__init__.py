@@ -0,0 +1,2 @@
+# Offline benchmarks of BMI with local fakes of HaaS, ceph and iscsi
+# Run with python -m ims.benchmark.run --help
@@ -0,0 +1,140 @@
+import BaseHTTPServer
+import json
+import re
+import SocketServer
+import threading
+import time
+
+
+# The part of the HaaS REST api which BMI calls, answered from memory
+# Every request takes latency seconds, like a HaaS that has to talk to its
+# database and switches. Nodes are assigned to projects with add_nodes.
+class FakeHaaS(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    routes = [('GET', r'/free_nodes$', 'free_nodes'),
+              ('GET', r'/project/([^/]+)/nodes$', 'project_nodes'),
+              ('GET', r'/node/([^/]+)$', 'show_node'),
+              ('POST', r'/project/([^/]+)/connect_node$', 'connect_node'),
+              ('POST', r'/project/([^/]+)/detach_node$', 'detach_node'),
+              ('POST', r'/node/([^/]+)/nic/([^/]+)/connect_network$',
+               'connect_network'),
+              ('POST', r'/node/([^/]+)/nic/([^/]+)/detach_network$',
+               'detach_network')]
+
+    def __init__(self, latency=0.0, address=('127.0.0.1', 0)):
+        BaseHTTPServer.HTTPServer.__init__(self, address, _Handler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.projects = {}
+        self.free = set()
+        # (node, nic) -> (channel, network)
+        self.networks = {}
+        self.requests = 0
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d/' % self.server_address
+
+    def add_nodes(self, project, nodes):
+        with self.lock:
+            self.projects.setdefault(project, set()).update(nodes)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    # Returns (status, body) for a request
+    def answer(self, method, path, body):
+        time.sleep(self.latency)
+        with self.lock:
+            self.requests += 1
+            for route_method, pattern, name in FakeHaaS.routes:
+                match = re.match(pattern, path)
+                if match and route_method == method:
+                    return getattr(self, '_' + name)(body, *match.groups())
+        return 404, {'msg': 'no such api ' + path}
+
+    def _free_nodes(self, body):
+        return 200, sorted(self.free)
+
+    def _project_nodes(self, body, project):
+        if project not in self.projects:
+            return 404, {'msg': 'project ' + project + ' not found'}
+        return 200, sorted(self.projects[project])
+
+    def _show_node(self, body, node):
+        projects = [project for project, nodes in self.projects.items()
+                    if node in nodes]
+        if not projects and node not in self.free:
+            return 404, {'msg': 'node ' + node + ' not found'}
+        nics = [{'label': nic, 'networks': {channel: network}}
+                for (name, nic), (channel, network) in
+                sorted(self.networks.items()) if name == node]
+        return 200, {'name': node,
+                     'project': projects[0] if projects else None,
+                     'nics': nics}
+
+    def _connect_node(self, body, project):
+        if body.get('node') not in self.free:
+            return 409, {'msg': 'node is not free'}
+        self.free.discard(body['node'])
+        self.projects.setdefault(project, set()).add(body['node'])
+        return 200, None
+
+    def _detach_node(self, body, project):
+        if body.get('node') not in self.projects.get(project, ()):
+            return 409, {'msg': 'node is not in project'}
+        self.projects[project].discard(body['node'])
+        self.free.add(body['node'])
+        return 200, None
+
+    def _connect_network(self, body, node, nic):
+        if (node, nic) in self.networks:
+            return 409, {'msg': 'nic is already connected'}
+        self.networks[(node, nic)] = (body.get('channel'),
+                                      body.get('network'))
+        return 200, None
+
+    def _detach_network(self, body, node, nic):
+        if self.networks.get((node, nic), (None, None))[1] != \
+                body.get('network'):
+            return 409, {'msg': 'nic is not connected to the network'}
+        del self.networks[(node, nic)]
+        return 200, None
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def __answer(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        # the HaaS client posts json bodies
+        data = json.loads(body) if body else {}
+        status, value = self.server.answer(method, self.path, data)
+        payload = json.dumps(value) if value is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.__answer('GET')
+
+    def do_POST(self):
+        self.__answer('POST')
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,92 @@
+import os
+import shutil
+import threading
+import time
+
+from ims.exception import *
+from ims.iscsi.iet_admin import parse_volumes
+
+
+# Stands in for the privileged commands of ISCSITargetManager
+# ietadm updates the volume file of a fake /proc/net/iet and writes to the
+# rbd control files make devices show up in and go away from a fake
+# /sys/bus/rbd, so the real target manager and rbd mapper code is run
+# Every command takes latency seconds
+class FakeISCSIRunner:
+    def __init__(self, proc_dir, sysfs_dir, latency=0.0):
+        self.proc_dir = proc_dir
+        self.sysfs_dir = sysfs_dir
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.commands = 0
+        for directory in (proc_dir, os.path.join(sysfs_dir, 'devices')):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        for path in (os.path.join(proc_dir, 'volume'),
+                     os.path.join(proc_dir, 'session'),
+                     os.path.join(sysfs_dir, 'add'),
+                     os.path.join(sysfs_dir, 'remove')):
+            open(path, 'a').close()
+
+    def __count(self):
+        time.sleep(self.latency)
+        with self.lock:
+            self.commands += 1
+
+    def __volumes(self):
+        with open(os.path.join(self.proc_dir, 'volume')) as f:
+            return parse_volumes(f.read())
+
+    def __write_volumes(self, volumes):
+        with open(os.path.join(self.proc_dir, 'volume'), 'w') as f:
+            for name, tid in sorted(volumes.items(), key=lambda v: v[1]):
+                f.write('tid:%d name:%s\n' % (tid, name))
+
+    # Only the ietadm calls of IETAdmin are known
+    def run(self, *args):
+        self.__count()
+        if args[0] != 'ietadm':
+            raise iscsi_exceptions.CommandFailedException(
+                ' '.join(args[:3]), 'not known to the fake iscsi')
+        options = dict(arg.split('=', 1) for arg in args if '=' in arg
+                       and arg.startswith('--'))
+        tid = int(options['--tid'])
+        with self.lock:
+            volumes = self.__volumes()
+            if args[2] == 'new' and '--lun' not in options:
+                volumes[args[-1].split('=', 1)[1]] = tid
+            elif args[2] == 'delete' and '--sid' not in options:
+                volumes = dict((name, other) for name, other in
+                               volumes.items() if other != tid)
+            self.__write_volumes(volumes)
+        return ''
+
+    def run_with_input(self, data, *args):
+        return self.run(*args)
+
+    def read_as_root(self, path):
+        self.__count()
+        with open(path) as f:
+            return f.read()
+
+    def move_as_root(self, src, dest):
+        self.__count()
+        shutil.move(src, dest)
+
+    # Does what the rbd kernel module does on writes to its control files
+    def write_as_root(self, path, data):
+        self.__count()
+        devices = os.path.join(self.sysfs_dir, 'devices')
+        with self.lock:
+            if os.path.basename(path).startswith('add'):
+                _, _, pool, name, snap = data.split()
+                ids = [int(dev_id) for dev_id in os.listdir(devices)]
+                device = os.path.join(devices,
+                                      str(max(ids) + 1 if ids else 0))
+                os.mkdir(device)
+                for attr, value in (('pool', pool), ('name', name),
+                                    ('current_snap', snap)):
+                    with open(os.path.join(device, attr), 'w') as f:
+                        f.write(value + '\n')
+            else:
+                shutil.rmtree(os.path.join(devices, data))
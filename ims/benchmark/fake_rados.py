@@ -0,0 +1,49 @@
+import time
+
+# The calls of the rados module which ceph_pool makes, on a cluster that only
+# lives in memory
+# Installed as the rados module by the benchmark, see fake_rbd for the images
+
+# seconds a connect takes, like a round trip to the monitors
+LATENCY = {'connect': 0.0}
+
+
+class Error(Exception):
+    pass
+
+
+class ObjectNotFound(Error):
+    pass
+
+
+class Ioctx(object):
+    def __init__(self, cluster, pool):
+        self.cluster = cluster
+        self.pool = pool
+
+    def close(self):
+        pass
+
+
+class Rados(object):
+    def __init__(self, rados_id=None, conffile=None, **kwargs):
+        self.rados_id = rados_id
+        self.conffile = conffile
+        self.state = 'configuring'
+
+    def connect(self, timeout=0):
+        time.sleep(LATENCY['connect'])
+        self.state = 'connected'
+
+    def get_fsid(self):
+        if self.state != 'connected':
+            raise Error('not connected')
+        return '00000000-0000-0000-0000-000000000000'
+
+    def open_ioctx(self, pool):
+        if self.state != 'connected':
+            raise Error('not connected')
+        return Ioctx(self, pool)
+
+    def shutdown(self):
+        self.state = 'shutdown'
@@ -0,0 +1,308 @@
+import threading
+import time
+
+# The calls of the rbd module which ceph_wrapper makes, on images that only
+# live in memory
+# Clones and snapshots share the data of their parent until they are written
+# to, so hundreds of nodes can be provisioned from one golden image without
+# copying it. Installed as the rbd module by the benchmark.
+
+# seconds each kind of call takes, to stand in for the round trips to the osds
+LATENCY = {'create': 0.0, 'clone': 0.0, 'remove': 0.0, 'rename': 0.0,
+           'open': 0.0, 'snap': 0.0, 'flatten': 0.0}
+
+RBD_FEATURE_LAYERING = 1
+RBD_FEATURE_STRIPINGV2 = 2
+RBD_FEATURE_EXCLUSIVE_LOCK = 4
+RBD_FEATURE_OBJECT_MAP = 8
+RBD_FEATURE_FAST_DIFF = 16
+RBD_FEATURE_DEEP_FLATTEN = 32
+RBD_FEATURE_JOURNALING = 64
+RBD_FEATURES_ALL = 127
+
+# the granularity of diff_iterate
+DIFF_BLOCK_SIZE = 4096
+
+
+class Error(Exception):
+    pass
+
+
+class ImageNotFound(Error):
+    pass
+
+
+class ImageExists(Error):
+    pass
+
+
+class ImageBusy(Error):
+    pass
+
+
+class ImageHasSnapshots(Error):
+    pass
+
+
+class FunctionNotSupported(Error):
+    pass
+
+
+class ArgumentOutOfRange(Error):
+    pass
+
+
+class InvalidArgument(Error):
+    pass
+
+
+class ReadOnlyImage(Error):
+    pass
+
+
+lock = threading.RLock()
+# pool name -> image name -> _Image
+pools = {}
+
+
+def _delay(call):
+    time.sleep(LATENCY.get(call, 0.0))
+
+
+def _pool(ioctx):
+    return pools.setdefault(ioctx.pool, {})
+
+
+# Forgets every image, between benchmark runs
+def reset():
+    with lock:
+        pools.clear()
+
+
+class _Image(object):
+    def __init__(self, base, features, parent=None):
+        # bytes shared with the parent or the last snapshot
+        self.base = base
+        # a private bytearray once the image is written to
+        self.data = None
+        self.features = features
+        self.parent = parent
+        self.snaps = {}
+        self.snap_order = []
+        self.opened = 0
+
+    def buf(self):
+        return self.data if self.data is not None else self.base
+
+    def writable(self):
+        if self.data is None:
+            self.data = bytearray(self.base)
+        return self.data
+
+
+class RBD(object):
+    def list(self, ioctx):
+        with lock:
+            return sorted(_pool(ioctx).keys())
+
+    def create(self, ioctx, name, size, order=None, old_format=False,
+               features=None, stripe_unit=None, stripe_count=None):
+        _delay('create')
+        with lock:
+            images = _pool(ioctx)
+            if name in images:
+                raise ImageExists(name)
+            images[name] = _Image('\0' * size, features or
+                                  RBD_FEATURE_LAYERING)
+
+    def clone(self, p_ioctx, p_name, p_snapshot, c_ioctx, c_name,
+              features=None, order=None, stripe_unit=None,
+              stripe_count=None):
+        _delay('clone')
+        with lock:
+            parent = _pool(p_ioctx).get(p_name)
+            if parent is None or p_snapshot not in parent.snaps:
+                raise ImageNotFound(p_name)
+            images = _pool(c_ioctx)
+            if c_name in images:
+                raise ImageExists(c_name)
+            images[c_name] = _Image(parent.snaps[p_snapshot],
+                                    features or RBD_FEATURE_LAYERING,
+                                    (p_ioctx.pool, p_name, p_snapshot))
+
+    def remove(self, ioctx, name):
+        _delay('remove')
+        with lock:
+            images = _pool(ioctx)
+            if name not in images:
+                raise ImageNotFound(name)
+            image = images[name]
+            if image.opened:
+                raise ImageBusy(name)
+            if image.snaps:
+                raise ImageHasSnapshots(name)
+            del images[name]
+
+    def rename(self, ioctx, src, dest):
+        _delay('rename')
+        with lock:
+            images = _pool(ioctx)
+            if src not in images:
+                raise ImageNotFound(src)
+            if dest in images:
+                raise ImageExists(dest)
+            images[dest] = images.pop(src)
+
+
+class Completion(object):
+    def __init__(self, ret):
+        self.ret = ret
+
+    def get_return_value(self):
+        return self.ret
+
+
+class Image(object):
+    def __init__(self, ioctx, name, snapshot=None, read_only=False):
+        _delay('open')
+        with lock:
+            image = _pool(ioctx).get(name)
+            if image is None:
+                raise ImageNotFound(name)
+            if snapshot is not None and snapshot not in image.snaps:
+                raise ImageNotFound(snapshot)
+            image.opened += 1
+        self.ioctx = ioctx
+        self.name = name
+        self.image = image
+        self.snapshot = snapshot
+        self.read_only = read_only or snapshot is not None
+        self.closed = False
+
+    def close(self):
+        with lock:
+            if not self.closed:
+                self.closed = True
+                self.image.opened -= 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __buf(self):
+        if self.snapshot is not None:
+            return self.image.snaps[self.snapshot]
+        return self.image.buf()
+
+    def __writable(self):
+        if self.read_only:
+            raise ReadOnlyImage(self.name)
+        return self.image.writable()
+
+    def size(self):
+        return len(self.__buf())
+
+    def resize(self, size):
+        with lock:
+            data = self.__writable()
+            if size > len(data):
+                data.extend(bytearray(size - len(data)))
+            else:
+                del data[size:]
+
+    def write(self, data, offset, fadvise_flags=0):
+        with lock:
+            self.__writable()[offset:offset + len(data)] = data
+        return len(data)
+
+    def read(self, offset, length, fadvise_flags=0):
+        return bytes(self.__buf()[offset:offset + length])
+
+    def aio_write(self, data, offset, oncomplete, fadvise_flags=0):
+        oncomplete(Completion(self.write(data, offset)))
+
+    def aio_read(self, offset, length, oncomplete, fadvise_flags=0):
+        data = self.read(offset, length)
+        oncomplete(Completion(len(data)), data)
+
+    def flush(self):
+        pass
+
+    def features(self):
+        return self.image.features
+
+    def list_snaps(self):
+        with lock:
+            return [{'id': i, 'name': name,
+                     'size': len(self.image.snaps[name])}
+                    for i, name in enumerate(self.image.snap_order)]
+
+    # The snapshot and the image share the data until the next write
+    def create_snap(self, name):
+        _delay('snap')
+        with lock:
+            if name in self.image.snaps:
+                raise ImageExists(name)
+            snap = bytes(self.image.buf())
+            self.image.base = snap
+            self.image.data = None
+            self.image.snaps[name] = snap
+            self.image.snap_order.append(name)
+
+    def remove_snap(self, name):
+        _delay('snap')
+        with lock:
+            if name not in self.image.snaps:
+                raise ImageNotFound(name)
+            if self.__children(name):
+                raise ImageBusy(name)
+            del self.image.snaps[name]
+            self.image.snap_order.remove(name)
+
+    def rollback_to_snap(self, name):
+        with lock:
+            if name not in self.image.snaps:
+                raise ImageNotFound(name)
+            self.image.base = self.image.snaps[name]
+            self.image.data = None
+
+    def parent_info(self):
+        if self.image.parent is None:
+            raise ImageNotFound(self.name)
+        return self.image.parent
+
+    def __children(self, snapshot):
+        return [(pool, name) for pool, images in pools.items()
+                for name, image in images.items()
+                if image.parent == (self.ioctx.pool, self.name, snapshot)]
+
+    def list_children(self):
+        with lock:
+            return self.__children(self.snapshot)
+
+    def flatten(self):
+        _delay('flatten')
+        with lock:
+            if self.image.parent is None:
+                raise InvalidArgument(self.name)
+            self.image.parent = None
+
+    # Calls iterate_cb with (offset, length, exists) for the blocks which
+    # differ from from_snapshot, or from zeros without it
+    def diff_iterate(self, offset, length, from_snapshot, iterate_cb,
+                     include_parent=True, whole_object=False):
+        with lock:
+            if from_snapshot is not None and \
+                    from_snapshot not in self.image.snaps:
+                raise ImageNotFound(from_snapshot)
+            current = bytes(self.__buf())
+            base = self.image.snaps[from_snapshot] if from_snapshot \
+                else '\0' * len(current)
+        end = min(offset + length, len(current))
+        for block in xrange(offset, end, DIFF_BLOCK_SIZE):
+            size = min(DIFF_BLOCK_SIZE, end - block)
+            data = current[block:block + size]
+            if data != base[block:block + size].ljust(size, '\0'):
+                iterate_cb(block, size, data.count('\0') != size)
@@ -0,0 +1,281 @@
+import argparse
+import importlib
+import io
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+
+from ims.benchmark import fake_rados, fake_rbd
+from ims.benchmark.fake_haas import FakeHaaS
+from ims.benchmark.fake_iscsi import FakeISCSIRunner
+
+PROJECT = 'bench'
+NETWORK = 'bench-provisioning'
+CHANNEL = 'vlan/native'
+NIC = 'eth0'
+IMAGE = 'golden'
+SNAPSHOT = 'base'
+
+# in the order they are run, detach_node removes the nodes provision made
+OPERATIONS = ('provision', 'create_snapshot', 'list_all_images',
+              'detach_node')
+
+CONFIG = """[filesystem]
+ceph = True
+
+[ceph]
+id = bench
+pool = bench
+conf_file = %(dir)s/ceph.conf
+keyring = %(dir)s/keyring
+
+[haas]
+url = %(haas_url)s
+
+[iscsi]
+password = bench
+ietd_conf = %(dir)s/ietd.conf
+proc_dir = %(dir)s/proc
+rbd_sysfs_dir = %(dir)s/sysfs
+rbd_state_file = %(dir)s/rbd_devices.json
+
+[database]
+url = sqlite:///%(dir)s/bmi.db
+"""
+
+
+# The modules of ims which use rados and rbd
+CEPH_MODULES = ('ims.ceph_pool', 'ims.ceph_wrapper')
+
+
+# Makes the fake ceph the rados and rbd modules of the process and of the
+# modules of ims which use them
+# Returns a function which puts back the modules there were before
+def install_fake_ceph():
+    fakes = {'rados': fake_rados, 'rbd': fake_rbd}
+    saved = dict((name, sys.modules.get(name)) for name in fakes)
+    sys.modules.update(fakes)
+    patched = []
+    for module_name in CEPH_MODULES:
+        module = importlib.import_module(module_name)
+        for name, fake in fakes.items():
+            patched.append((module, name, getattr(module, name)))
+            setattr(module, name, fake)
+
+    def uninstall():
+        for name, module in saved.items():
+            if module is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = module
+        for module, name, original in patched:
+            # a module first imported under the fakes gets the real one if
+            # there is one
+            if original is fakes[name]:
+                try:
+                    original = importlib.import_module(name)
+                except ImportError:
+                    pass
+            setattr(module, name, original)
+
+    return uninstall
+
+
+# Returns the value below which fraction of the sorted values are
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[max(int(math.ceil(fraction * len(values))) - 1, 0)]
+
+
+# Runs BMI operations against a fake HaaS, ceph and iscsi in a temporary
+# directory, so nothing but this process is needed
+# The fakes take the given latencies in seconds for every call, which makes
+# the numbers about the overhead and concurrency of BMI itself
+class Benchmark:
+    def __init__(self, nodes=100, concurrency=8, haas_latency=0.0,
+                 ceph_latency=0.0, iscsi_latency=0.0,
+                 image_size=1024 * 1024):
+        self.nodes = ['bench-node-%d' % i for i in range(nodes)]
+        self.concurrency = concurrency
+        self.haas_latency = haas_latency
+        self.ceph_latency = ceph_latency
+        self.iscsi_latency = iscsi_latency
+        self.image_size = image_size
+        self.directory = None
+        self.cwd = None
+        self.haas = None
+        self.bmi = None
+        self.image_id = None
+        self.uninstall_fake_ceph = None
+
+    def __enter__(self):
+        self.setup()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def setup(self):
+        self.uninstall_fake_ceph = install_fake_ceph()
+        fake_rbd.reset()
+        for call in fake_rbd.LATENCY:
+            fake_rbd.LATENCY[call] = self.ceph_latency
+        fake_rados.LATENCY['connect'] = self.ceph_latency
+
+        self.directory = tempfile.mkdtemp(prefix='bmi-benchmark-')
+        self.haas = FakeHaaS(self.haas_latency).start()
+        self.haas.add_nodes(PROJECT, self.nodes)
+        with open(os.path.join(self.directory, 'bmiconfig.cfg'), 'w') as f:
+            f.write(CONFIG % {'dir': self.directory,
+                              'haas_url': self.haas.url})
+        with open(os.path.join(self.directory, 'ceph.conf'), 'w') as f:
+            f.write('[global]\n\tmon host = 127.0.0.1\n')
+        with open(os.path.join(self.directory, 'keyring'), 'w') as f:
+            f.write('[client.bench]\n\tkey = YmVuY2g=\n')
+
+        # the bmi config is read from the working directory
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+        from ims.database import ImageRepository, ProjectRepository
+        from ims.iscsi import ISCSITargetManager
+        from ims.operations import BMI
+        self.bmi = BMI('bench', 'bench')
+        runner = FakeISCSIRunner(self.bmi.config.iscsi_proc_dir,
+                                 self.bmi.config.iscsi_rbd_sysfs_dir,
+                                 self.iscsi_latency)
+        self.bmi.iscsi = ISCSITargetManager(self.bmi.config, runner)
+
+        ProjectRepository().insert(PROJECT, NETWORK)
+        self.__check(self.bmi.import_image(
+            PROJECT, IMAGE, io.BytesIO(os.urandom(self.image_size))))
+        self.__check(self.bmi.create_snapshot(PROJECT, IMAGE, SNAPSHOT))
+        self.image_id = str(ImageRepository().fetch_id_with_name_from_project(
+            IMAGE, PROJECT))
+
+    @staticmethod
+    def __check(result):
+        if result['status_code'] != 200:
+            raise RuntimeError(result.get('msg'))
+        return result
+
+    def close(self):
+        if self.bmi is not None:
+            from ims.database import DatabaseConnection
+            # the database is removed with the directory
+            DatabaseConnection.reset()
+            self.bmi = None
+        if self.haas is not None:
+            self.haas.stop()
+            self.haas = None
+        if self.cwd is not None:
+            os.chdir(self.cwd)
+            self.cwd = None
+        if self.uninstall_fake_ceph is not None:
+            from ims import ceph_pool
+            # the fake connections are not kept by the shared pool
+            ceph_pool.connections.close_all()
+            self.uninstall_fake_ceph()
+            self.uninstall_fake_ceph = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    # Returns the calls of the operation, one for every node
+    def __calls(self, operation):
+        bmi = self.bmi
+        if operation == 'provision':
+            return [lambda node=node: bmi.provision(
+                node, self.image_id, SNAPSHOT, NETWORK, CHANNEL, NIC)
+                    for node in self.nodes]
+        if operation == 'create_snapshot':
+            return [lambda i=i: bmi.create_snapshot(PROJECT, IMAGE,
+                                                    'bench-snap-%d' % i)
+                    for i in range(len(self.nodes))]
+        if operation == 'list_all_images':
+            return [lambda: bmi.list_all_images(PROJECT)] * len(self.nodes)
+        if operation == 'detach_node':
+            return [lambda node=node: bmi.detach_node(node, NETWORK, NIC)
+                    for node in self.nodes]
+        raise ValueError('unknown operation ' + operation)
+
+    @staticmethod
+    def __timed(call):
+        start = time.time()
+        result = call()
+        return time.time() - start, result.get('status_code') == 200
+
+    # Runs every operation over all the nodes with concurrency calls in
+    # flight, one operation after the other
+    # Returns a dict from operation to its count, errors, ops per second and
+    # p50 and p99 latency in seconds
+    def run(self, operations=OPERATIONS):
+        report = {}
+        pool = ThreadPool(self.concurrency)
+        try:
+            for operation in operations:
+                calls = self.__calls(operation)
+                start = time.time()
+                outcomes = pool.map(Benchmark.__timed, calls)
+                elapsed = time.time() - start
+                latencies = sorted(latency for latency, _ in outcomes)
+                report[operation] = {
+                    'count': len(outcomes),
+                    'errors': sum(1 for _, ok in outcomes if not ok),
+                    'ops_per_second': len(outcomes) / elapsed
+                    if elapsed > 0 else 0.0,
+                    'p50': percentile(latencies, 0.5),
+                    'p99': percentile(latencies, 0.99)}
+        finally:
+            pool.close()
+            pool.join()
+        return report
+
+
+def format_report(report, operations=OPERATIONS):
+    lines = ['%-16s %8s %8s %10s %10s %10s' % (
+        'operation', 'count', 'errors', 'ops/s', 'p50 ms', 'p99 ms')]
+    for operation in operations:
+        stats = report[operation]
+        lines.append('%-16s %8d %8d %10.1f %10.2f %10.2f' % (
+            operation, stats['count'], stats['errors'],
+            stats['ops_per_second'], stats['p50'] * 1000,
+            stats['p99'] * 1000))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks BMI operations against local fakes of '
+                    'HaaS, ceph and iscsi')
+    parser.add_argument('--nodes', type=int, default=100,
+                        help='calls of every operation (default 100)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='calls in flight (default 8)')
+    parser.add_argument('--operations', default=','.join(OPERATIONS),
+                        help='comma separated operations to run in order '
+                             '(default %(default)s)')
+    parser.add_argument('--haas-latency', type=float, default=0.0,
+                        help='seconds of every HaaS request (default 0)')
+    parser.add_argument('--ceph-latency', type=float, default=0.0,
+                        help='seconds of every ceph call (default 0)')
+    parser.add_argument('--iscsi-latency', type=float, default=0.0,
+                        help='seconds of every iscsi command (default 0)')
+    parser.add_argument('--image-size', type=int, default=1024 * 1024,
+                        help='bytes of the golden image (default 1MiB)')
+    args = parser.parse_args(argv)
+
+    operations = [op for op in args.operations.split(',') if op]
+    with Benchmark(args.nodes, args.concurrency, args.haas_latency,
+                   args.ceph_latency, args.iscsi_latency,
+                   args.image_size) as benchmark:
+        report = benchmark.run(operations)
+    print(format_report(report, operations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import sys
+from unittest import TestCase
+
+from ims.benchmark import fake_rbd
+from ims.benchmark.run import Benchmark, OPERATIONS, format_report, percentile
+
+
+# Runs a small benchmark end to end on the fakes
+class TestBenchmark(TestCase):
+    def test_run(self):
+        with Benchmark(nodes=6, concurrency=3) as benchmark:
+            report = benchmark.run()
+            # every node was detached again
+            self.assertEqual(benchmark.haas.networks, {})
+            self.assertTrue(benchmark.bmi.iscsi.runner.commands > 0)
+        for operation in OPERATIONS:
+            self.assertEqual(report[operation]['count'], 6)
+            self.assertEqual(report[operation]['errors'], 0)
+            self.assertTrue(report[operation]['p50'] <=
+                            report[operation]['p99'])
+        self.assertEqual(len(format_report(report).splitlines()), 5)
+
+        # the fakes are gone from the process again, the modules imported
+        # under them only keep them when there is no real ceph
+        self.assertIsNot(sys.modules.get('rbd'), fake_rbd)
+        from ims import ceph_wrapper
+        self.assertIs(ceph_wrapper.rbd, sys.modules.get('rbd', fake_rbd))
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([], 0.5), 0.0)
@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# A thread safe, size bounded LRU cache whose entries expire after a ttl
+# The least recently used entry is evicted once max_size is reached
+# Every entry can have its own ttl so that failures can be cached for a
+# shorter time than successes
+class TTLCache:
+    def __init__(self, max_size, ttl, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Returns (True, value) if a fresh entry exists for key else (False, None)
+    # A hit makes the entry the most recently used one
+    def lookup(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return False, None
+            value, expires_at = entry
+            if expires_at <= self.clock():
+                return False, None
+            self.entries[key] = entry
+            return True, value
+
+    # Stores value for key, a ttl of 0 or less means do not cache
+    def put(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, self.clock() + ttl)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def resize(self, max_size):
+        with self.lock:
+            self.max_size = max_size
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    # Removes every entry for which predicate(key, value) is true
+    def invalidate_if(self, predicate):
+        with self.lock:
+            for key, (value, _) in list(self.entries.items()):
+                if predicate(key, value):
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,172 @@
+import struct
+import zlib
+from collections import deque
+
+from ceph_transfer import AioWindow, PendingRead, is_zero
+
+
+# The stream format of the changes between two snapshots of an image
+# It is used to replicate golden images between clusters, so only the changed
+# extents are in it and every block of data carries its own crc32.
+#
+#   header  MAGIC, image size (Q), block size (I), from snapshot, to snapshot
+#           snapshots are a length (H) followed by the name, '' for none
+#   'd'     offset (Q), length (I), crc32 (I) followed by the data
+#   'z'     offset (Q), length (Q) of a range which is zeros now
+#   'e'     number of records (Q), marks the end of a complete stream
+MAGIC = 'BMIDIFF1'
+DATA = 'd'
+ZERO = 'z'
+END = 'e'
+# a block is held in memory for every write in flight
+MAX_BLOCK_SIZE = 64 * 1024 * 1024
+
+
+class DiffFormatError(Exception):
+    pass
+
+
+def crc32(data):
+    return zlib.crc32(data) & 0xffffffff
+
+
+def write_string(dest, value):
+    value = (value or '').encode('utf-8')
+    dest.write(struct.pack('>H', len(value)) + value)
+
+
+def read_exactly(source, length):
+    data = source.read(length)
+    while len(data) < length:
+        more = source.read(length - len(data))
+        if not more:
+            raise DiffFormatError('stream ends unexpectedly')
+        data += more
+    return data
+
+
+def read_string(source):
+    (length,) = struct.unpack('>H', read_exactly(source, 2))
+    return read_exactly(source, length).decode('utf-8') or None
+
+
+def write_header(dest, size, block_size, from_snap, to_snap):
+    dest.write(MAGIC + struct.pack('>QI', size, block_size))
+    write_string(dest, from_snap)
+    write_string(dest, to_snap)
+
+
+# Returns (image size, block size, from snapshot, to snapshot)
+def read_header(source):
+    if read_exactly(source, len(MAGIC)) != MAGIC:
+        raise DiffFormatError('not a snapshot diff')
+    size, block_size = struct.unpack('>QI', read_exactly(source, 12))
+    if not 0 < block_size <= MAX_BLOCK_SIZE:
+        raise DiffFormatError('bad block size ' + str(block_size))
+    return size, block_size, read_string(source), read_string(source)
+
+
+# Writes the changed extents of the open image to dest
+# extents is a list of (offset, length, exists) as given by diff_iterate,
+# existing extents are read in blocks of block_size with up to depth reads in
+# flight and blocks of zeros are written as zero records
+# progress is called with (bytes done, total bytes of the extents)
+# Returns a dict with the bytes of data and zeros and the number of records
+def write_diff(image, extents, dest, block_size, depth, progress=None):
+    window = AioWindow(depth)
+    zeros = '\0' * block_size
+    total = sum(length for _, length, _ in extents)
+    stats = {'data': 0, 'zeros': 0, 'records': 0}
+    pending = deque()
+
+    def write_out(offset, read):
+        read.event.wait()
+        window.check()
+        if is_zero(read.data, zeros):
+            dest.write(ZERO + struct.pack('>QQ', offset, read.length))
+            stats['zeros'] += read.length
+        else:
+            dest.write(DATA + struct.pack('>QII', offset, read.length,
+                                          crc32(read.data)))
+            dest.write(read.data)
+            stats['data'] += read.length
+        stats['records'] += 1
+        if progress is not None:
+            progress(stats['data'] + stats['zeros'], total)
+
+    try:
+        for offset, length, exists in extents:
+            if not exists:
+                dest.write(ZERO + struct.pack('>QQ', offset, length))
+                stats['zeros'] += length
+                stats['records'] += 1
+                continue
+            for block in xrange(offset, offset + length, block_size):
+                read = PendingRead(min(block_size, offset + length - block))
+                pending.append((block, read))
+                window.submit(image.aio_read, (block, read.length),
+                              read.length, read.complete)
+                while pending and (pending[0][1].event.is_set() or
+                                   len(pending) >= depth):
+                    write_out(*pending.popleft())
+    finally:
+        window.wait()
+    window.check()
+    while pending:
+        write_out(*pending.popleft())
+    dest.write(END + struct.pack('>Q', stats['records']))
+    dest.flush()
+    return stats
+
+
+# Applies the records of source, positioned after the header, to the open
+# image with up to depth writes in flight
+# The records never overlap, so they can be written in any order
+# Every block is checked against its crc32 before it is written
+# progress is called with the bytes applied so far
+# Returns a dict with the bytes of data and zeros and the number of records
+def apply_diff(image, source, block_size, depth, progress=None):
+    window = AioWindow(depth)
+    zeros = '\0' * block_size
+    stats = {'data': 0, 'zeros': 0, 'records': 0}
+    try:
+        while True:
+            tag = read_exactly(source, 1)
+            if tag == END:
+                (records,) = struct.unpack('>Q', read_exactly(source, 8))
+                if records != stats['records']:
+                    raise DiffFormatError('expected ' + str(records) +
+                                          ' records but got ' +
+                                          str(stats['records']))
+                break
+            elif tag == DATA:
+                offset, length, checksum = struct.unpack(
+                    '>QII', read_exactly(source, 16))
+                # data records are never longer than a block, a longer one
+                # would be read into memory whole
+                if length > block_size:
+                    raise DiffFormatError('bad length of the block at ' +
+                                          str(offset))
+                data = read_exactly(source, length)
+                if crc32(data) != checksum:
+                    raise DiffFormatError('bad checksum of the block at ' +
+                                          str(offset))
+                window.submit(image.aio_write, (data, offset), length)
+                stats['data'] += length
+            elif tag == ZERO:
+                offset, length = struct.unpack('>QQ', read_exactly(source, 16))
+                # a discard is not guaranteed to zero parts of an object
+                for block in xrange(offset, offset + length, block_size):
+                    size = min(block_size, offset + length - block)
+                    window.submit(image.aio_write, (zeros[:size], block), size)
+                stats['zeros'] += length
+            else:
+                raise DiffFormatError('unknown record ' + repr(tag))
+            stats['records'] += 1
+            if progress is not None:
+                progress(stats['data'] + stats['zeros'])
+    finally:
+        window.wait()
+    window.check()
+    image.flush()
+    return stats
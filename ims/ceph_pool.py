@@ -0,0 +1,401 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict
+
+import constants
+import rados
+import rbd
+from exception import *
+from ims import metrics
+
+
+# A bounded LRU cache of open images on a single io context
+# Opening an image is a round trip to the osds holding its header, so images
+# are kept open between operations and shared by reference counted borrows.
+# An open image holds a watch on its header and ceph refuses to remove an
+# image with watchers, so unborrowed images are closed after idle_timeout and
+# evict has to be called before removing or renaming an image.
+class ImageHandleCache:
+    # An open image along with its book keeping
+    class Entry:
+        def __init__(self, name, image):
+            self.name = name
+            self.image = image
+            self.borrowers = 0
+            self.evicted = False
+            self.last_used = time.time()
+
+        def __repr__(self):
+            return str([self.name, self.borrowers, self.evicted])
+
+    def __init__(self, context, max_size, idle_timeout):
+        self.context = context
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Closes images that are not needed anymore
+    # Called without holding the lock as closing drops the watch
+    @staticmethod
+    def __close_all(entries):
+        for entry in entries:
+            try:
+                entry.image.close()
+            except rbd.Error:
+                pass
+
+    # Removes the entry from the cache, it is closed once nobody borrows it
+    # Should be called with the lock held
+    def __pop(self, entry, to_close):
+        if self.entries.get(entry.name) is entry:
+            del self.entries[entry.name]
+        entry.evicted = True
+        if entry.borrowers == 0:
+            to_close.append(entry)
+
+    # Removes idle entries and the least recently used ones above max_size
+    # Borrowed entries are never removed, so the cache can grow above
+    # max_size while all of them are in use
+    # Should be called with the lock held
+    def __pop_unused(self, now):
+        to_close = []
+        unused = [e for e in self.entries.values() if e.borrowers == 0]
+        excess = len(self.entries) - self.max_size
+        for entry in unused:
+            if excess > 0:
+                excess -= 1
+            elif now - entry.last_used <= self.idle_timeout:
+                continue
+            self.__pop(entry, to_close)
+        return to_close
+
+    # Borrows the open image with name, opening it if it is not cached
+    # Raises rbd.ImageNotFound if there is no such image
+    def borrow(self, name):
+        now = time.time()
+        with self.lock:
+            to_close = self.__pop_unused(now)
+            entry = self.entries.pop(name, None)
+            if entry is not None:
+                entry.borrowers += 1
+                entry.last_used = now
+                self.entries[name] = entry
+        self.__close_all(to_close)
+        if entry is not None:
+            return entry
+
+        entry = ImageHandleCache.Entry(name, rbd.Image(self.context, name))
+        entry.borrowers = 1
+        to_close = []
+        with self.lock:
+            existing = self.entries.get(name)
+            if existing is not None:
+                # Somebody else opened it while we were opening it
+                existing.borrowers += 1
+                existing.last_used = now
+                to_close.append(entry)
+                entry = existing
+            else:
+                self.entries[name] = entry
+        self.__close_all(to_close)
+        return entry
+
+    # Gives back a borrowed image
+    # broken should be set if the image turned out to be unusable, for
+    # example because it was removed, so that the next borrower reopens it
+    def release(self, entry, broken=False):
+        to_close = []
+        with self.lock:
+            entry.borrowers -= 1
+            entry.last_used = time.time()
+            if broken or entry.evicted:
+                self.__pop(entry, to_close)
+            to_close.extend(self.__pop_unused(entry.last_used))
+        self.__close_all(to_close)
+
+    # Drops the cached image with name so that it can be removed or renamed
+    # Returns False if it is still borrowed and hence still open
+    def evict(self, name):
+        to_close = []
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return True
+            self.__pop(entry, to_close)
+        self.__close_all(to_close)
+        return entry.borrowers == 0
+
+    # Closes the images which have been idle for longer than idle_timeout
+    def evict_idle(self):
+        with self.lock:
+            to_close = self.__pop_unused(time.time())
+        self.__close_all(to_close)
+
+    # Closes every image which is not borrowed and forgets the rest
+    def close_all(self):
+        to_close = []
+        with self.lock:
+            for entry in list(self.entries.values()):
+                self.__pop(entry, to_close)
+        self.__close_all(to_close)
+
+
+# An image borrowed from an ImageHandleCache which is handed out to callers
+# It is used like an rbd.Image, close gives it back to the cache instead of
+# closing it, and it should not be used once the RBD it came from is closed
+class ImageHandle:
+    def __init__(self, cache, entry):
+        self.cache = cache
+        self.entry = entry
+        self.closed = False
+
+    def __getattr__(self, name):
+        return getattr(self.entry.image, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.cache.release(self.entry)
+
+
+# A process wide pool of connected ceph clusters and their io contexts.
+# Connecting to the monitors is expensive, so RBD objects borrow an already
+# connected cluster from here instead of creating a new rados.Rados for
+# every operation. Connections are keyed by (id, conf_file, pool) and are
+# shared between all the borrowers of the same key as librados handles are
+# thread safe.
+class CephConnectionPool:
+    # A single connected cluster and io context along with book keeping
+    # required for health checks and idle eviction
+    class Connection:
+        def __init__(self, key, cluster, context, idle_timeout,
+                     health_check_interval,
+                     image_cache_size=constants.CEPH_DEFAULT_IMAGE_CACHE_SIZE,
+                     image_idle_timeout=constants.CEPH_DEFAULT_IMAGE_IDLE_TIMEOUT):
+            self.key = key
+            self.cluster = cluster
+            self.context = context
+            self.images = ImageHandleCache(context, image_cache_size,
+                                           image_idle_timeout)
+            self.idle_timeout = idle_timeout
+            self.health_check_interval = health_check_interval
+            self.borrowers = 0
+            self.retired = False
+            self.last_used = time.time()
+            self.last_checked = self.last_used
+
+        def __repr__(self):
+            return str([self.key, self.borrowers, self.retired])
+
+        # Checks the cluster handle is still usable
+        # Only talks to the cluster if the last check is older than the
+        # configured interval
+        def is_healthy(self, now):
+            if now - self.last_checked < self.health_check_interval:
+                return True
+            try:
+                if self.cluster.state != 'connected':
+                    return False
+                self.cluster.get_fsid()
+                self.last_checked = now
+                return True
+            except rados.Error:
+                return False
+
+        def is_idle(self, now):
+            return self.borrowers == 0 and \
+                   now - self.last_used > self.idle_timeout
+
+        def close(self):
+            try:
+                self.images.close_all()
+                self.context.close()
+            finally:
+                self.cluster.shutdown()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = {}
+
+    @staticmethod
+    @metrics.CEPH_SECONDS.time(operation='connect')
+    def __connect(key):
+        rid, conf_file, pool = key
+        cluster = rados.Rados(rados_id=rid, conffile=conf_file)
+        try:
+            cluster.connect()
+            return cluster, cluster.open_ioctx(pool.encode('utf-8'))
+        except rados.Error:
+            cluster.shutdown()
+            raise file_system_exceptions.ConnectionException()
+
+    # Closes connections that are not needed anymore
+    # Called without holding the lock as shutdown can take some time
+    @staticmethod
+    def __close_all(connections):
+        for connection in connections:
+            try:
+                connection.close()
+            except rados.Error:
+                pass
+
+    # Removes idle connections from the pool and returns them for closing
+    # Should be called with the lock held
+    def __pop_idle(self, now):
+        idle = [c for c in self.connections.values() if c.is_idle(now)]
+        for connection in idle:
+            del self.connections[connection.key]
+        return idle
+
+    # Borrows a connected cluster for the given key
+    # Unhealthy connections are replaced by a fresh one, the old one is
+    # closed once the last borrower gives it back
+    def acquire(self, rid, conf_file, pool,
+                idle_timeout=constants.CEPH_DEFAULT_IDLE_TIMEOUT,
+                health_check_interval=constants.CEPH_DEFAULT_HEALTH_CHECK_INTERVAL,
+                image_cache_size=constants.CEPH_DEFAULT_IMAGE_CACHE_SIZE,
+                image_idle_timeout=constants.CEPH_DEFAULT_IMAGE_IDLE_TIMEOUT):
+        key = (rid, conf_file, pool)
+        now = time.time()
+        with self.lock:
+            stale = self.__pop_idle(now)
+            connection = self.connections.get(key)
+            if connection is not None and not connection.is_healthy(now):
+                self.__retire(connection, stale)
+                connection = None
+            if connection is not None:
+                connection.borrowers += 1
+                connection.last_used = now
+        self.__close_all(stale)
+        if connection is not None:
+            return connection
+
+        cluster, context = CephConnectionPool.__connect(key)
+        connection = CephConnectionPool.Connection(key, cluster, context,
+                                                   idle_timeout,
+                                                   health_check_interval,
+                                                   image_cache_size,
+                                                   image_idle_timeout)
+        connection.borrowers = 1
+        with self.lock:
+            existing = self.connections.get(key)
+            if existing is not None and not existing.retired:
+                # Somebody else connected while we were connecting
+                existing.borrowers += 1
+                existing.last_used = now
+                extra, connection = connection, existing
+            else:
+                self.connections[key] = connection
+                extra = None
+        if extra is not None:
+            self.__close_all([extra])
+        return connection
+
+    # Gives back a borrowed connection
+    # broken should be set if the borrower saw a cluster level error so that
+    # the next borrower gets a reconnected cluster
+    def release(self, connection, broken=False):
+        to_close = []
+        with self.lock:
+            connection.borrowers -= 1
+            connection.last_used = time.time()
+            if broken and not connection.retired:
+                self.__retire(connection, to_close)
+            elif connection.retired and connection.borrowers == 0:
+                to_close.append(connection)
+            to_close.extend(self.__pop_idle(connection.last_used))
+        self.__close_all(to_close)
+
+    # Takes the connection out of the pool
+    # It is closed right away if nobody is using it
+    # Should be called with the lock held
+    def __retire(self, connection, to_close):
+        connection.retired = True
+        if self.connections.get(connection.key) is connection:
+            del self.connections[connection.key]
+        if connection.borrowers == 0:
+            to_close.append(connection)
+
+    # Closes all connections which have been idle for longer than their
+    # timeout along with the idle images of the rest, can be called
+    # periodically by long running processes
+    def evict_idle(self):
+        with self.lock:
+            idle = self.__pop_idle(time.time())
+            active = list(self.connections.values())
+        self.__close_all(idle)
+        for connection in active:
+            connection.images.evict_idle()
+
+    # Closes every connection which is not borrowed and forgets the rest
+    def close_all(self):
+        to_close = []
+        with self.lock:
+            for connection in list(self.connections.values()):
+                self.__retire(connection, to_close)
+        self.__close_all(to_close)
+
+
+# The pool shared by the whole process
+connections = CephConnectionPool()
+
+
+# Calls evict_idle on a pool every interval seconds from a daemon thread
+# Idle connections and images are otherwise only closed when the next
+# operation comes along, which may never happen
+class IdleReaper:
+    def __init__(self, pool, interval):
+        self.pool = pool
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.interval <= 0 or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.__loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.pool.evict_idle()
+            except (rados.Error, rbd.Error):
+                # tried again on the next pass
+                pass
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+_reaper = None
+_reaper_lock = threading.Lock()
+
+
+# Returns the reaper of the shared pool, creating and starting it on first
+# use with interval, there is one pool so later intervals are ignored
+# It is stopped at exit, a daemon thread would otherwise run on while the
+# modules are torn down
+def get_reaper(interval=constants.CEPH_DEFAULT_REAP_INTERVAL):
+    global _reaper
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = IdleReaper(connections, interval)
+            _reaper.start()
+            atexit.register(_reaper.stop)
+        return _reaper
@@ -0,0 +1,229 @@
+import mmap
+import os
+import stat
+import threading
+from collections import deque
+
+
+# Streaming copies between local files and rbd images
+# Data is moved in large chunks aligned to the rbd object size with several
+# asynchronous operations in flight so that many osds are busy at once.
+# Chunks which are all zeros are not written, a new image and a sparse file
+# read back as zeros there anyway.
+
+
+# Keeps at most depth asynchronous rbd operations in flight
+# The completion callbacks run on librbd threads, so they only record the
+# outcome and errors are raised in the thread which submits
+class AioWindow:
+    def __init__(self, depth):
+        self.depth = depth
+        self.slots = threading.Semaphore(depth)
+        self.lock = threading.Lock()
+        self.done = 0
+        self.error = None
+
+    # Calls operation(*args, oncomplete) once a slot is free
+    # on_data is called with the data of a completed read, also when it
+    # failed so that nobody waits for it forever
+    def submit(self, operation, args, length, on_data=None):
+        self.slots.acquire()
+        if self.error is not None:
+            self.slots.release()
+            self.check()
+
+        def oncomplete(completion, *data):
+            ret = completion.get_return_value()
+            with self.lock:
+                if ret < 0:
+                    self.error = self.error or ret
+                else:
+                    self.done += length
+            if on_data is not None:
+                on_data(*data)
+            self.slots.release()
+
+        try:
+            operation(*(args + (oncomplete,)))
+        except Exception:
+            self.slots.release()
+            raise
+
+    # Counts bytes which did not need an operation
+    def skip(self, length):
+        with self.lock:
+            self.done += length
+
+    def check(self):
+        if self.error is not None:
+            raise IOError(-self.error, os.strerror(-self.error))
+
+    # Waits for every operation in flight without raising their error, so
+    # that it can be called in a finally while another error is raised
+    # Nothing may touch the image after it is closed or removed
+    def wait(self):
+        for _ in range(self.depth):
+            self.slots.acquire()
+        for _ in range(self.depth):
+            self.slots.release()
+
+    # Waits for every operation in flight and raises the first error
+    def drain(self):
+        self.wait()
+        self.check()
+
+
+# A path or file object to import from
+# Regular files are memory mapped so that chunks are sliced out of the page
+# cache, anything else (pipes, sockets, http bodies) is read sequentially
+class Source:
+    def __init__(self, source):
+        self.owned = not hasattr(source, 'read')
+        self.file = open(source, 'rb') if self.owned else source
+        self.map = None
+        self.size = None
+        try:
+            fd = self.file.fileno()
+            info = os.fstat(fd)
+            if stat.S_ISREG(info.st_mode) and self.file.tell() == 0:
+                self.size = info.st_size
+                if self.size > 0:
+                    self.map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        except (AttributeError, IOError, OSError, ValueError):
+            # not backed by a file descriptor
+            pass
+
+    # Yields (offset, data) for consecutive chunks of chunk_size
+    def chunks(self, chunk_size):
+        if self.map is not None:
+            for offset in xrange(0, self.size, chunk_size):
+                yield offset, self.map[offset:offset + chunk_size]
+            return
+
+        offset = 0
+        while True:
+            data = self.file.read(chunk_size)
+            if not data:
+                return
+            # file objects like sockets can return short reads
+            while len(data) < chunk_size:
+                more = self.file.read(chunk_size - len(data))
+                if not more:
+                    break
+                data += more
+            yield offset, data
+            offset += len(data)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        if self.owned:
+            self.file.close()
+
+
+def is_zero(data, zeros):
+    if len(data) == len(zeros):
+        return data == zeros
+    return data.count('\0') == len(data)
+
+
+# Writes source into the open image with up to depth writes in flight
+# An image smaller than the source is grown as the data comes in, which is
+# how sources of unknown size are imported into an empty image
+# progress is called with (bytes done, total bytes or None)
+# Returns a dict with the size and the bytes written and skipped
+def write_image(image, source, chunk_size, depth, progress=None):
+    window = AioWindow(depth)
+    zeros = '\0' * chunk_size
+    size = image.size()
+    grown = False
+    skipped = 0
+    end = 0
+    try:
+        for offset, data in source.chunks(chunk_size):
+            end = offset + len(data)
+            if end > size:
+                # doubling keeps the number of resizes logarithmic
+                size = max(end, 2 * size)
+                image.resize(size)
+                grown = True
+            if is_zero(data, zeros):
+                skipped += len(data)
+                window.skip(len(data))
+            else:
+                window.submit(image.aio_write, (data, offset), len(data))
+            if progress is not None:
+                progress(window.done, source.size)
+    finally:
+        window.wait()
+    window.check()
+    if grown and size != end:
+        image.resize(end)
+    image.flush()
+    if progress is not None:
+        progress(window.done, source.size)
+    return {'size': end, 'written': end - skipped, 'skipped': skipped}
+
+
+# A read which is in flight, reads can finish in any order but have to be
+# written out in order
+class PendingRead:
+    def __init__(self, length):
+        self.length = length
+        self.data = None
+        self.event = threading.Event()
+
+    def complete(self, data):
+        self.data = data
+        self.event.set()
+
+
+# Reads the open image into dest with up to depth reads in flight
+# Zero chunks become holes if dest is a regular file, otherwise they are
+# written out
+# progress is called with (bytes done, total bytes)
+# Returns a dict with the size and the bytes written and skipped
+def read_image(image, dest, chunk_size, depth, progress=None):
+    window = AioWindow(depth)
+    zeros = '\0' * chunk_size
+    size = image.size()
+    try:
+        sparse = stat.S_ISREG(os.fstat(dest.fileno()).st_mode)
+        start = dest.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        sparse = False
+    pending = deque()
+    stats = {'size': size, 'written': 0, 'skipped': 0}
+
+    def write_out(read):
+        read.event.wait()
+        window.check()
+        if sparse and is_zero(read.data, zeros):
+            dest.seek(read.length, os.SEEK_CUR)
+            stats['skipped'] += read.length
+        else:
+            dest.write(read.data)
+            stats['written'] += read.length
+        if progress is not None:
+            progress(stats['written'] + stats['skipped'], size)
+
+    try:
+        for offset in xrange(0, size, chunk_size):
+            read = PendingRead(min(chunk_size, size - offset))
+            pending.append(read)
+            window.submit(image.aio_read, (offset, read.length), read.length,
+                          read.complete)
+            while pending and (pending[0].event.is_set() or
+                               len(pending) >= depth):
+                write_out(pending.popleft())
+    finally:
+        window.wait()
+    window.check()
+    while pending:
+        write_out(pending.popleft())
+    if sparse:
+        # a trailing hole is only kept if the file is given its full length
+        dest.truncate(start + size)
+        dest.seek(start + size)
+    dest.flush()
+    return stats
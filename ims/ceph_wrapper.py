@@ -2,20 +2,57 @@
 import os
 from contextlib import contextmanager
 
+import ceph_diff
+import ceph_pool
+import ceph_transfer
 import constants
 import rados
 import rbd
+from cache import TTLCache
 from exception import *
+from ims import metrics
 
 
 # Need to think if there is a better way to reduce boilerplate exception
 # handling code in methods
 
 class RBD:
+    # The snapshot names of recently used images, shared by every RBD object
+    # in the process since a new one is made for every request
+    # Keyed by (conf_file, pool, image) and dropped whenever BMI changes the
+    # snapshots of the image
+    snapshots = TTLCache(constants.CEPH_DEFAULT_SNAPSHOT_CACHE_SIZE,
+                         constants.CEPH_DEFAULT_SNAPSHOT_CACHE_TTL)
+
+    # The image features by the names the rbd command line uses, features
+    # the installed librbd does not know about are left out
+    feature_bits = dict(
+        (name, getattr(rbd, constant)) for name, constant in
+        [('layering', 'RBD_FEATURE_LAYERING'),
+         ('striping', 'RBD_FEATURE_STRIPINGV2'),
+         ('exclusive-lock', 'RBD_FEATURE_EXCLUSIVE_LOCK'),
+         ('object-map', 'RBD_FEATURE_OBJECT_MAP'),
+         ('fast-diff', 'RBD_FEATURE_FAST_DIFF'),
+         ('deep-flatten', 'RBD_FEATURE_DEEP_FLATTEN'),
+         ('journaling', 'RBD_FEATURE_JOURNALING')]
+        if hasattr(rbd, constant))
+
+    # (feature, the feature it needs)
+    feature_dependencies = [('object-map', 'exclusive-lock'),
+                            ('fast-diff', 'object-map'),
+                            ('journaling', 'exclusive-lock')]
+
     def __init__(self, config):
         self.__validate(config)
-        self.cluster = self.__init_cluster()
-        self.context = self.__init_context()
+        # Borrowed from the process wide pool so that we skip connecting to
+        # the monitors when a connection for this config already exists
+        self.connection = ceph_pool.connections.acquire(
+            self.rid, self.r_conf, self.pool, self.idle_timeout,
+            self.health_check_interval, self.image_cache_size,
+            self.image_idle_timeout)
+        self.cluster = self.connection.cluster
+        self.context = self.connection.context
+        self.images = self.connection.images
         self.rbd = rbd.RBD()
 
     def __enter__(self):
@@ -23,7 +60,9 @@ class RBD:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.tear_down()
+        # A rados error means the cluster connection itself might be bad
+        self.tear_down(broken=exc_type is not None and
+                              issubclass(exc_type, rados.Error))
 
     def __repr__(self):
         return str([self.rid, self.r_conf, self.pool])
@@ -49,53 +88,237 @@ class RBD:
             raise file_system_exceptions.InvalidConfigArgumentException(
                 constants.CEPH_CONFIG_FILE_KEY)
 
-    def __init_context(self):
-        return self.cluster.open_ioctx(self.pool.encode('utf-8'))
+        try:
+            self.idle_timeout = float(
+                config.get(constants.CEPH_IDLE_TIMEOUT_KEY,
+                           constants.CEPH_DEFAULT_IDLE_TIMEOUT))
+            self.health_check_interval = float(
+                config.get(constants.CEPH_HEALTH_CHECK_INTERVAL_KEY,
+                           constants.CEPH_DEFAULT_HEALTH_CHECK_INTERVAL))
+        except ValueError:
+            raise file_system_exceptions.InvalidConfigArgumentException(
+                constants.CEPH_IDLE_TIMEOUT_KEY + ' or ' +
+                constants.CEPH_HEALTH_CHECK_INTERVAL_KEY)
+
+        try:
+            self.snapshot_cache_ttl = float(
+                config.get(constants.CEPH_SNAPSHOT_CACHE_TTL_KEY,
+                           constants.CEPH_DEFAULT_SNAPSHOT_CACHE_TTL))
+            RBD.snapshots.resize(int(
+                config.get(constants.CEPH_SNAPSHOT_CACHE_SIZE_KEY,
+                           constants.CEPH_DEFAULT_SNAPSHOT_CACHE_SIZE)))
+        except ValueError:
+            raise file_system_exceptions.InvalidConfigArgumentException(
+                constants.CEPH_SNAPSHOT_CACHE_TTL_KEY + ' or ' +
+                constants.CEPH_SNAPSHOT_CACHE_SIZE_KEY)
+
+        try:
+            self.image_cache_size = int(
+                config.get(constants.CEPH_IMAGE_CACHE_SIZE_KEY,
+                           constants.CEPH_DEFAULT_IMAGE_CACHE_SIZE))
+            self.image_idle_timeout = float(
+                config.get(constants.CEPH_IMAGE_IDLE_TIMEOUT_KEY,
+                           constants.CEPH_DEFAULT_IMAGE_IDLE_TIMEOUT))
+        except ValueError:
+            raise file_system_exceptions.InvalidConfigArgumentException(
+                constants.CEPH_IMAGE_CACHE_SIZE_KEY + ' or ' +
+                constants.CEPH_IMAGE_IDLE_TIMEOUT_KEY)
+
+        try:
+            self.transfer_chunk_size = int(
+                config.get(constants.CEPH_TRANSFER_CHUNK_SIZE_KEY,
+                           constants.CEPH_DEFAULT_TRANSFER_CHUNK_SIZE))
+            self.transfer_queue_depth = int(
+                config.get(constants.CEPH_TRANSFER_QUEUE_DEPTH_KEY,
+                           constants.CEPH_DEFAULT_TRANSFER_QUEUE_DEPTH))
+            if self.transfer_chunk_size <= 0 or self.transfer_queue_depth <= 0:
+                raise ValueError()
+        except ValueError:
+            raise file_system_exceptions.InvalidConfigArgumentException(
+                constants.CEPH_TRANSFER_CHUNK_SIZE_KEY + ' or ' +
+                constants.CEPH_TRANSFER_QUEUE_DEPTH_KEY)
+
+        # None leaves the choice to librbd
+        try:
+            self.image_features = RBD.__parse_features(
+                config.get(constants.CEPH_IMAGE_FEATURES_KEY), False)
+        except file_system_exceptions.InvalidFeaturesException:
+            raise file_system_exceptions.InvalidConfigArgumentException(
+                constants.CEPH_IMAGE_FEATURES_KEY)
+        try:
+            self.clone_features = RBD.__parse_features(
+                config.get(constants.CEPH_CLONE_FEATURES_KEY,
+                           constants.CEPH_DEFAULT_CLONE_FEATURES), True)
+        except file_system_exceptions.InvalidFeaturesException:
+            raise file_system_exceptions.InvalidConfigArgumentException(
+                constants.CEPH_CLONE_FEATURES_KEY)
+        self.layout = {}
+        for key, argument in [(constants.CEPH_IMAGE_ORDER_KEY, 'order'),
+                              (constants.CEPH_STRIPE_UNIT_KEY, 'stripe_unit'),
+                              (constants.CEPH_STRIPE_COUNT_KEY,
+                               'stripe_count')]:
+            try:
+                if config.get(key) is not None:
+                    self.layout[argument] = int(config[key])
+            except ValueError:
+                raise file_system_exceptions.InvalidConfigArgumentException(
+                    key)
+
+    # Returns the feature bits of features which can be a number or a comma
+    # separated list of feature names, None is kept as None
+    # Raises InvalidFeaturesException if librbd does not support one of them,
+    # a feature is missing a feature it needs or a clone has no layering
+    @staticmethod
+    def __parse_features(features, clone):
+        if features is None:
+            return None
+        if isinstance(features, (int, long)) or features.strip().isdigit():
+            bits = int(features)
+        else:
+            bits = 0
+            for name in features.replace(',', ' ').split():
+                if name not in RBD.feature_bits:
+                    raise file_system_exceptions.InvalidFeaturesException(
+                        features, name + ' is not supported by librbd')
+                bits |= RBD.feature_bits[name]
+
+        unknown = bits & ~rbd.RBD_FEATURES_ALL
+        if unknown:
+            raise file_system_exceptions.InvalidFeaturesException(
+                str(features), str(unknown) + ' is not supported by librbd')
+        for feature, needed in RBD.feature_dependencies:
+            if bits & RBD.feature_bits.get(feature, 0) and \
+                    not bits & RBD.feature_bits[needed]:
+                raise file_system_exceptions.InvalidFeaturesException(
+                    str(features), feature + ' needs ' + needed)
+        if clone and not bits & RBD.feature_bits['layering']:
+            raise file_system_exceptions.InvalidFeaturesException(
+                str(features), 'clones need layering')
+        return bits
 
-    def __init_cluster(self):
-        cluster = rados.Rados(rados_id=self.rid, conffile=self.r_conf)
-        cluster.connect()
-        return cluster
+    # Returns the keyword arguments of rbd create and clone for the features
+    # and layout given for a call on top of the ones of the config
+    def __creation_args(self, features, default_features, clone, layout):
+        args = dict(self.layout)
+        args.update((argument, value) for argument, value in layout.items()
+                    if value is not None)
+        if features is not None:
+            features = RBD.__parse_features(features, clone)
+        else:
+            features = default_features
+        if features is not None:
+            # the features are ignored for the old image format
+            if not clone:
+                args['old_format'] = False
+            args['features'] = features
+            # anything but one stripe of the object size is fancy striping
+            object_size = 1 << args.get('order', 22)
+            striped = args.get('stripe_unit', object_size) != object_size or \
+                      args.get('stripe_count', 1) != 1
+            if striped and not features & RBD.feature_bits['striping']:
+                raise file_system_exceptions.InvalidFeaturesException(
+                    str(features), 'stripe_unit and stripe_count need striping')
+        return args
 
-    # Written to use 'with' for opening and closing images
-    # Passing context as it is outside class
-    # Need to see if it is ok to put it inside the class
+    # Written to use 'with' for borrowing images
+    # The image comes from the cache of open images of the pooled connection
+    # and stays open after the block for the next operation on it
     @contextmanager
     def __open_image(self, img_name):
-        img = None
+        entry = self.images.borrow(img_name)
+        broken = False
         try:
-            img = rbd.Image(self.context, img_name)
-            yield (img)
+            yield entry.image
+        except rbd.ImageNotFound:
+            # removed behind our back, the handle is of no use anymore
+            broken = True
+            raise
         finally:
-            if img is not None:
-                img.close()
+            self.images.release(entry, broken)
+
+    def __snapshots_key(self, img_id):
+        return self.r_conf, self.pool, img_id
 
-    def tear_down(self):
-        self.context.close()
-        self.cluster.shutdown()
+    # Gives the connection back to the pool instead of shutting it down
+    def tear_down(self, broken=False):
+        if self.connection is not None:
+            ceph_pool.connections.release(self.connection, broken)
+            self.connection = None
 
     # RBD Operations Section
     def list_images(self):
         return self.rbd.list(self.context)
 
-    def create_image(self, img_id, img_size):
+    # Yields the names of the images in the pool
+    # Uses the streaming listing of newer ceph releases when available
+    def iter_images(self):
+        if hasattr(self.rbd, 'list2'):
+            for image in self.rbd.list2(self.context):
+                yield image['name']
+        else:
+            for name in self.rbd.list(self.context):
+                yield name
+
+    # Checks for a single image without listing the whole pool
+    def image_exists(self, img_id):
         try:
-            self.rbd.create(self.context, img_id, img_size)
+            rbd.Image(self.context, img_id, read_only=True).close()
+            return True
+        except rbd.ImageNotFound:
+            return False
+
+    # Returns (parent pool, parent image, parent snapshot) of a clone
+    # or None if the image is not a clone
+    # Not cached as this is asked for images other clients may remove
+    def parent_info(self, img_id):
+        try:
+            img = rbd.Image(self.context, img_id, read_only=True)
+            try:
+                return img.parent_info()
+            finally:
+                img.close()
+        except rbd.ImageNotFound:
+            # also raised by parent_info when there is no parent
+            if not self.image_exists(img_id):
+                raise file_system_exceptions.ImageNotFoundException(img_id)
+            return None
+
+    # features, order, stripe_unit and stripe_count override the ones of the
+    # config for this image, features can be a number or feature names
+    @metrics.CEPH_SECONDS.time(operation='create')
+    def create_image(self, img_id, img_size, features=None, order=None,
+                     stripe_unit=None, stripe_count=None):
+        args = self.__creation_args(features, self.image_features, False,
+                                    {'order': order,
+                                     'stripe_unit': stripe_unit,
+                                     'stripe_count': stripe_count})
+        try:
+            self.rbd.create(self.context, img_id, img_size, **args)
             return True
         except rbd.ImageExists:
             raise file_system_exceptions.ImageExistsException(img_id)
         except rbd.FunctionNotSupported:
             raise file_system_exceptions.FunctionNotSupportedException()
+        except rbd.InvalidArgument:
+            raise file_system_exceptions.ArgumentsOutOfRangeException()
 
-    def clone(self, parent_img_name, parent_snap_name, clone_img_name):
+    # features, order, stripe_unit and stripe_count override the ones of the
+    # config for this clone, features can be a number or feature names
+    @metrics.CEPH_SECONDS.time(operation='clone')
+    def clone(self, parent_img_name, parent_snap_name, clone_img_name,
+              features=None, order=None, stripe_unit=None, stripe_count=None):
+        args = self.__creation_args(features, self.clone_features, True,
+                                    {'order': order,
+                                     'stripe_unit': stripe_unit,
+                                     'stripe_count': stripe_count})
         try:
             parent_context = child_context = self.context
             self.rbd.clone(parent_context, parent_img_name, parent_snap_name,
-                           child_context, clone_img_name, features=1)
+                           child_context, clone_img_name, **args)
             return True
         except rbd.ImageNotFound:
             # Can be raised if the img or snap is not found
-            if parent_img_name not in self.list_images():
+            if not self.image_exists(parent_img_name):
                 img_name = parent_img_name
             else:
                 img_name = parent_snap_name
@@ -106,12 +329,17 @@ class RBD:
         except rbd.FunctionNotSupported:
             raise file_system_exceptions.FunctionNotSupportedException()
         # No Clue when will this be raised so not testing
-        except rbd.ArgumentOutOfRange:
+        except (rbd.ArgumentOutOfRange, rbd.InvalidArgument):
             raise file_system_exceptions.ArgumentsOutOfRangeException()
 
+    # A cached open image would keep ceph from removing it, so it is closed
+    # first, if it is still borrowed ImageBusyException is raised
+    @metrics.CEPH_SECONDS.time(operation='remove')
     def remove(self, img_id):
         try:
+            self.images.evict(img_id)
             self.rbd.remove(self.context, img_id)
+            RBD.snapshots.invalidate(self.__snapshots_key(img_id))
             return True
         except rbd.ImageNotFound:
             raise file_system_exceptions.ImageNotFoundException(img_id)
@@ -122,6 +350,63 @@ class RBD:
         except rbd.ImageHasSnapshots:
             raise file_system_exceptions.ImageHasSnapshotException(img_id)
 
+    # Returns the size of the image in bytes
+    def image_size(self, img_id):
+        try:
+            img = rbd.Image(self.context, img_id, read_only=True)
+            try:
+                return img.size()
+            finally:
+                img.close()
+        except rbd.ImageNotFound:
+            raise file_system_exceptions.ImageNotFoundException(img_id)
+
+    # Copies the data a clone still reads from its parent into the clone so
+    # that it no longer depends on the parent snapshot
+    # Returns False if the image is not a clone
+    # Not cached as clones are images other clients may remove
+    @metrics.CEPH_SECONDS.time(operation='flatten')
+    def flatten(self, img_id):
+        try:
+            img = rbd.Image(self.context, img_id)
+            try:
+                img.flatten()
+                return True
+            finally:
+                img.close()
+        except rbd.ImageNotFound:
+            raise file_system_exceptions.ImageNotFoundException(img_id)
+        except rbd.InvalidArgument:
+            return False
+        except rbd.ImageBusy:
+            raise file_system_exceptions.ImageBusyException(img_id)
+
+    # Returns the names of the clones of the snapshot in the pool
+    def list_children(self, img_id, snap_name):
+        try:
+            img = rbd.Image(self.context, img_id, snapshot=snap_name,
+                            read_only=True)
+            try:
+                return [name for _, name in img.list_children()]
+            finally:
+                img.close()
+        except rbd.ImageNotFound:
+            raise file_system_exceptions.ImageNotFoundException(
+                img_id if not self.image_exists(img_id) else snap_name)
+
+    # Renames the image, a cached open image is closed first
+    @metrics.CEPH_SECONDS.time(operation='rename')
+    def rename(self, img_id, new_img_id):
+        try:
+            self.images.evict(img_id)
+            self.rbd.rename(self.context, img_id, new_img_id)
+            RBD.snapshots.invalidate(self.__snapshots_key(img_id))
+            return True
+        except rbd.ImageNotFound:
+            raise file_system_exceptions.ImageNotFoundException(img_id)
+        except rbd.ImageExists:
+            raise file_system_exceptions.ImageExistsException(new_img_id)
+
     def write(self, img_id, data, offset):
         try:
             with self.__open_image(img_id) as img:
@@ -129,15 +414,201 @@ class RBD:
         except rbd.ImageNotFound:
             raise file_system_exceptions.ImageNotFoundException(img_id)
 
-    def snap_image(self, img_id, name):
+    # Creates the image img_id from source, a path or a file object
+    # Regular files are memory mapped and give the image its size, other
+    # sources are read until they end with the image growing as needed
+    # The image is removed again if the import fails
+    # progress is called with (bytes done, total bytes or None)
+    # Returns a dict with the size and the bytes written and skipped
+    @metrics.CEPH_SECONDS.time(operation='import')
+    def import_image(self, img_id, source, progress=None):
         try:
-            # Work around for Ceph problem
-            snaps = self.list_snapshots(img_id)
-            if name in snaps:
-                raise file_system_exceptions.ImageExistsException(name)
+            source = ceph_transfer.Source(source)
+        except (IOError, OSError) as e:
+            raise file_system_exceptions.TransferException(img_id, str(e))
+        try:
+            self.create_image(img_id, source.size or 0)
+            try:
+                with self.__open_image(img_id) as img:
+                    return ceph_transfer.write_image(
+                        img, source, self.transfer_chunk_size,
+                        self.transfer_queue_depth, progress)
+            except (rbd.Error, IOError, OSError) as e:
+                self.remove(img_id)
+                raise file_system_exceptions.TransferException(img_id,
+                                                               str(e))
+        finally:
+            source.close()
 
+    # Writes the image img_id, or its snapshot snap_name, to dest which is a
+    # path or a file object
+    # Chunks of zeros become holes when dest is a regular file
+    # progress is called with (bytes done, total bytes)
+    # Returns a dict with the size and the bytes written and skipped
+    @metrics.CEPH_SECONDS.time(operation='export')
+    def export_image(self, img_id, dest, snap_name=None, progress=None):
+        owned = not hasattr(dest, 'write')
+        try:
+            # not borrowed from the cache as the snapshot is set on it
+            img = rbd.Image(self.context, img_id, snapshot=snap_name,
+                            read_only=True)
+        except rbd.ImageNotFound:
+            raise file_system_exceptions.ImageNotFoundException(
+                img_id if snap_name is None or not self.image_exists(img_id)
+                else snap_name)
+        try:
+            if owned:
+                dest = open(dest, 'wb')
+            return ceph_transfer.read_image(img, dest,
+                                            self.transfer_chunk_size,
+                                            self.transfer_queue_depth,
+                                            progress)
+        except (rbd.Error, IOError, OSError) as e:
+            raise file_system_exceptions.TransferException(img_id, str(e))
+        finally:
+            img.close()
+            if owned and not isinstance(dest, basestring):
+                dest.close()
+
+    # Writes the changes of the image img_id between its snapshots from_snap
+    # and snap_name to dest which is a path or a file object
+    # Without from_snap every allocated extent of snap_name is written
+    # progress is called with (bytes done, total bytes)
+    # Returns a dict with the image size, the bytes of data and zeros and the
+    # number of records
+    @metrics.CEPH_SECONDS.time(operation='export_diff')
+    def export_diff(self, img_id, snap_name, dest, from_snap=None,
+                    progress=None):
+        owned = not hasattr(dest, 'write')
+        try:
+            img = rbd.Image(self.context, img_id, snapshot=snap_name,
+                            read_only=True)
+        except rbd.ImageNotFound:
+            raise file_system_exceptions.ImageNotFoundException(
+                img_id if not self.image_exists(img_id) else snap_name)
+        try:
+            extents = []
+            size = img.size()
+            try:
+                img.diff_iterate(0, size, from_snap,
+                                 lambda offset, length, exists:
+                                 extents.append((offset, length, exists)))
+            except rbd.ImageNotFound:
+                raise file_system_exceptions.ImageNotFoundException(from_snap)
+            if owned:
+                dest = open(dest, 'wb')
+            ceph_diff.write_header(dest, size, self.transfer_chunk_size,
+                                   from_snap, snap_name)
+            stats = ceph_diff.write_diff(img, extents, dest,
+                                         self.transfer_chunk_size,
+                                         self.transfer_queue_depth, progress)
+            stats['size'] = size
+            return stats
+        except (rbd.Error, IOError, OSError) as e:
+            raise file_system_exceptions.TransferException(img_id, str(e))
+        finally:
+            img.close()
+            if owned and not isinstance(dest, basestring):
+                dest.close()
+
+    # Applies a diff written by export_diff, from a path or a file object, to
+    # the image img_id and creates the snapshot the diff ends at
+    # The image has to be at the snapshot the diff starts from, a diff
+    # without a start creates the image and is refused if it exists
+    # If applying the diff or creating the end snapshot fails the image is
+    # rolled back to the start snapshot, or removed if it was created
+    # progress is called with the bytes applied so far
+    # Returns a dict with the image size, the bytes of data and zeros and the
+    # number of records
+    @metrics.CEPH_SECONDS.time(operation='import_diff')
+    def import_diff(self, img_id, source, progress=None):
+        owned = not hasattr(source, 'read')
+        try:
+            if owned:
+                source = open(source, 'rb')
+            size, block_size, from_snap, snap_name = \
+                ceph_diff.read_header(source)
+        except (IOError, OSError, ceph_diff.DiffFormatError) as e:
+            if owned and not isinstance(source, basestring):
+                source.close()
+            raise file_system_exceptions.TransferException(img_id, str(e))
+
+        created = False
+        try:
+            if from_snap is None:
+                # never written over an image, which would keep its
+                # snapshots and the data the diff does not cover
+                created = self.create_image(img_id, size)
             with self.__open_image(img_id) as img:
+                self.__check_diff_base(img, img_id, from_snap, snap_name)
+                try:
+                    if img.size() != size:
+                        img.resize(size)
+                    stats = ceph_diff.apply_diff(img, source, block_size,
+                                                 self.transfer_queue_depth,
+                                                 progress)
+                except (rbd.Error, IOError, OSError,
+                        ceph_diff.DiffFormatError) as e:
+                    if from_snap is not None:
+                        img.rollback_to_snap(from_snap)
+                    raise file_system_exceptions.TransferException(img_id,
+                                                                   str(e))
+            try:
+                self.snap_image(img_id, snap_name)
+            except FileSystemException:
+                if from_snap is not None:
+                    with self.__open_image(img_id) as img:
+                        img.rollback_to_snap(from_snap)
+                raise
+            stats['size'] = size
+            return stats
+        except rbd.ImageNotFound:
+            raise file_system_exceptions.ImageNotFoundException(img_id)
+        except FileSystemException:
+            if created:
+                self.remove(img_id)
+            raise
+        finally:
+            if owned:
+                source.close()
+
+    # A diff only gives the right image if it is applied on top of the
+    # snapshot it starts from with nothing written since
+    @staticmethod
+    def __check_diff_base(img, img_id, from_snap, snap_name):
+        snaps = [snap['name'] for snap in img.list_snaps()]
+        if snap_name in snaps:
+            raise file_system_exceptions.ImageExistsException(snap_name)
+        if from_snap is None:
+            return
+        if from_snap not in snaps:
+            raise file_system_exceptions.ImageNotFoundException(from_snap)
+        changes = []
+        img.diff_iterate(0, img.size(), from_snap,
+                         lambda offset, length, exists:
+                         changes.append(offset))
+        if changes:
+            raise file_system_exceptions.TransferException(
+                img_id, 'image has changed since ' + from_snap)
+
+    # The check for an existing snapshot and the create are done on one open
+    # image, after which the cache gets the new list of snapshots
+    @metrics.CEPH_SECONDS.time(operation='snap')
+    def snap_image(self, img_id, name):
+        key = self.__snapshots_key(img_id)
+        try:
+            with self.__open_image(img_id) as img:
+                # Work around for Ceph problem
+                snaps = [snap['name'] for snap in img.list_snaps()]
+                if name in snaps:
+                    RBD.snapshots.put(key, tuple(snaps),
+                                      self.snapshot_cache_ttl)
+                    raise file_system_exceptions.ImageExistsException(name)
+
+                RBD.snapshots.invalidate(key)
                 img.create_snap(name)
+                RBD.snapshots.put(key, tuple(snaps) + (name,),
+                                  self.snapshot_cache_ttl)
                 return True
         # Was having issue with ceph implemented work around (stack dump issue)
         except rbd.ImageExists:
@@ -145,13 +616,22 @@ class RBD:
         except rbd.ImageNotFound:
             raise file_system_exceptions.ImageNotFoundException(img_id)
 
+    # Served from the cache while it is fresh, otherwise the image is opened
+    @metrics.CEPH_SECONDS.time(operation='list_snapshots')
     def list_snapshots(self, img_id):
+        key = self.__snapshots_key(img_id)
+        hit, snaps = RBD.snapshots.lookup(key)
+        if hit:
+            return list(snaps)
         try:
             with self.__open_image(img_id) as img:
-                return [snap['name'] for snap in img.list_snaps()]
+                snaps = [snap['name'] for snap in img.list_snaps()]
         except rbd.ImageNotFound:
             raise file_system_exceptions.ImageNotFoundException(img_id)
+        RBD.snapshots.put(key, tuple(snaps), self.snapshot_cache_ttl)
+        return snaps
 
+    @metrics.CEPH_SECONDS.time(operation='remove_snapshot')
     def remove_snapshots(self, img_id, name):
         try:
             with self.__open_image(img_id) as img:
@@ -162,9 +642,14 @@ class RBD:
         # Don't know how to raise this
         except rbd.ImageBusy:
             raise file_system_exceptions.ImageBusyException(img_id)
+        finally:
+            RBD.snapshots.invalidate(self.__snapshots_key(img_id))
 
+    # Returns a handle borrowed from the cache of open images which is used
+    # like an rbd.Image, it has to be closed before this RBD is torn down
     def get_image(self, img_id):
         try:
-            return rbd.Image(self.context, img_id)
+            return ceph_pool.ImageHandle(self.images,
+                                         self.images.borrow(img_id))
         except rbd.ImageNotFound:
             raise file_system_exceptions.ImageNotFoundException(img_id)
@@ -10,9 +10,25 @@ class BMIConfig:
     def __init__(self):
         self.configfile = 'bmiconfig.cfg'
         self.fs = {}
-        self.iscsi_update = None
+        self.db = {}
         self.iscsi_update_password = None
+        self.iscsi_config_file = constants.ISCSI_DEFAULT_CONFIG_FILE
+        self.iscsi_target_prefix = constants.ISCSI_DEFAULT_TARGET_PREFIX
+        self.iscsi_proc_dir = constants.ISCSI_DEFAULT_PROC_DIR
+        self.iscsi_rbd_sysfs_dir = constants.ISCSI_DEFAULT_RBD_SYSFS_DIR
+        self.iscsi_rbd_state_file = constants.ISCSI_DEFAULT_RBD_STATE_FILE
         self.haas_url = None
+        self.haas_pool_size = constants.HAAS_DEFAULT_POOL_SIZE
+        self.haas_timeout = constants.HAAS_DEFAULT_TIMEOUT
+        self.haas_cache_ttl = constants.HAAS_DEFAULT_CACHE_TTL
+        self.haas_negative_cache_ttl = constants.HAAS_DEFAULT_NEGATIVE_CACHE_TTL
+        self.haas_cache_size = constants.HAAS_DEFAULT_CACHE_SIZE
+        self.haas_max_concurrency = constants.HAAS_DEFAULT_MAX_CONCURRENCY
+        self.job_workers = constants.DEFAULT_JOB_WORKERS
+        self.ceph_reap_interval = constants.CEPH_DEFAULT_REAP_INTERVAL
+        self.warm_pools = {}
+        self.flatten = {}
+        self.metrics = {}
 
     # Creates a filesystem configuration object
     @staticmethod
@@ -24,21 +40,141 @@ class BMIConfig:
         except ConfigException:  # Should be logged
             raise  # Crashing it for now
 
+    # Returns the value of an option which may be left out of the config
+    @staticmethod
+    def __get_optional(config, section, option, default):
+        if config.has_option(section, option):
+            return config.get(section, option)
+        return default
+
+    # Returns the number an option which may be left out of the config holds
+    # convert is int or float
+    @staticmethod
+    def __get_number(config, section, option, default, convert):
+        value = BMIConfig.__get_optional(config, section, option, default)
+        try:
+            return convert(value)
+        except ValueError:
+            raise config_exceptions.InvalidOptionInConfigException(
+                section + ' ' + option, str(value))
+
+    # Returns {(image, snapshot) : settings} of the warm pools
+    # The [warm_pool] section holds the defaults, every pool has its own
+    # [warm_pool:<image>@<snapshot>] section
+    @staticmethod
+    def __parse_warm_pools(config):
+        defaults = {constants.WARM_POOL_SIZE_KEY:
+                        constants.WARM_POOL_DEFAULT_SIZE,
+                    constants.WARM_POOL_REFILL_WORKERS_KEY:
+                        constants.WARM_POOL_DEFAULT_REFILL_WORKERS,
+                    constants.WARM_POOL_METRICS_KEY: True}
+        pools = {}
+        sections = [constants.WARM_POOL_CONFIG_SECTION_NAME] + \
+                   [section for section in config.sections() if
+                    section.startswith(constants.WARM_POOL_SECTION_PREFIX)]
+        for section in sections:
+            if not config.has_section(section):
+                continue
+            settings = dict(defaults)
+            try:
+                if config.has_option(section, constants.WARM_POOL_SIZE_KEY):
+                    settings[constants.WARM_POOL_SIZE_KEY] = config.getint(
+                        section, constants.WARM_POOL_SIZE_KEY)
+                if config.has_option(section,
+                                     constants.WARM_POOL_REFILL_WORKERS_KEY):
+                    settings[constants.WARM_POOL_REFILL_WORKERS_KEY] = \
+                        config.getint(section,
+                                      constants.WARM_POOL_REFILL_WORKERS_KEY)
+                if config.has_option(section, constants.WARM_POOL_METRICS_KEY):
+                    settings[constants.WARM_POOL_METRICS_KEY] = \
+                        config.getboolean(section,
+                                          constants.WARM_POOL_METRICS_KEY)
+            except ValueError as e:
+                raise config_exceptions.InvalidOptionInConfigException(
+                    section, str(e))
+
+            if section == constants.WARM_POOL_CONFIG_SECTION_NAME:
+                defaults = settings
+                continue
+            name = section[len(constants.WARM_POOL_SECTION_PREFIX):]
+            if name.count('@') != 1 or \
+                    settings[constants.WARM_POOL_REFILL_WORKERS_KEY] < 1:
+                raise config_exceptions.InvalidOptionInConfigException(
+                    section, name)
+            pools[tuple(name.split('@'))] = settings
+        return pools
+
     def parse_config(self):
         config = ConfigParser.SafeConfigParser()
         try:
             if not config.read(self.configfile):
                 raise IOError('cannot load ' + self.configfile)
 
-            self.iscsi_update = config.get(constants.ISCSI_CONFIG_SECTION_NAME,
-                                           constants.ISCSI_URL_KEY)
-
             self.iscsi_update_password = config.get(
                 constants.ISCSI_CONFIG_SECTION_NAME,
                 constants.ISCSI_PASSWORD_KEY)
 
+            self.iscsi_config_file = BMIConfig.__get_optional(
+                config, constants.ISCSI_CONFIG_SECTION_NAME,
+                constants.ISCSI_CONFIG_FILE_KEY, self.iscsi_config_file)
+            self.iscsi_target_prefix = BMIConfig.__get_optional(
+                config, constants.ISCSI_CONFIG_SECTION_NAME,
+                constants.ISCSI_TARGET_PREFIX_KEY, self.iscsi_target_prefix)
+            self.iscsi_proc_dir = BMIConfig.__get_optional(
+                config, constants.ISCSI_CONFIG_SECTION_NAME,
+                constants.ISCSI_PROC_DIR_KEY, self.iscsi_proc_dir)
+            self.iscsi_rbd_sysfs_dir = BMIConfig.__get_optional(
+                config, constants.ISCSI_CONFIG_SECTION_NAME,
+                constants.ISCSI_RBD_SYSFS_DIR_KEY, self.iscsi_rbd_sysfs_dir)
+            self.iscsi_rbd_state_file = BMIConfig.__get_optional(
+                config, constants.ISCSI_CONFIG_SECTION_NAME,
+                constants.ISCSI_RBD_STATE_FILE_KEY, self.iscsi_rbd_state_file)
+
             self.haas_url = config.get(constants.HAAS_CONFIG_SECTION_NAME,
                                        constants.HAAS_URL_KEY)
+            self.haas_pool_size = BMIConfig.__get_number(
+                config, constants.HAAS_CONFIG_SECTION_NAME,
+                constants.HAAS_POOL_SIZE_KEY, self.haas_pool_size, int)
+            self.haas_timeout = BMIConfig.__get_number(
+                config, constants.HAAS_CONFIG_SECTION_NAME,
+                constants.HAAS_TIMEOUT_KEY, self.haas_timeout, float)
+            self.haas_cache_ttl = BMIConfig.__get_number(
+                config, constants.HAAS_CONFIG_SECTION_NAME,
+                constants.HAAS_CACHE_TTL_KEY, self.haas_cache_ttl, float)
+            self.haas_negative_cache_ttl = BMIConfig.__get_number(
+                config, constants.HAAS_CONFIG_SECTION_NAME,
+                constants.HAAS_NEGATIVE_CACHE_TTL_KEY,
+                self.haas_negative_cache_ttl, float)
+            self.haas_cache_size = BMIConfig.__get_number(
+                config, constants.HAAS_CONFIG_SECTION_NAME,
+                constants.HAAS_CACHE_SIZE_KEY, self.haas_cache_size, int)
+            self.haas_max_concurrency = BMIConfig.__get_number(
+                config, constants.HAAS_CONFIG_SECTION_NAME,
+                constants.HAAS_MAX_CONCURRENCY_KEY, self.haas_max_concurrency,
+                int)
+
+            self.job_workers = BMIConfig.__get_number(
+                config, constants.JOBS_CONFIG_SECTION_NAME,
+                constants.JOBS_WORKERS_KEY, self.job_workers, int)
+
+            self.ceph_reap_interval = BMIConfig.__get_number(
+                config, constants.CEPH_CONFIG_SECTION_NAME,
+                constants.CEPH_REAP_INTERVAL_KEY, self.ceph_reap_interval,
+                float)
+
+            self.warm_pools = BMIConfig.__parse_warm_pools(config)
+
+            if config.has_section(constants.FLATTEN_CONFIG_SECTION_NAME):
+                self.flatten = dict(config.items(
+                    constants.FLATTEN_CONFIG_SECTION_NAME))
+
+            if config.has_section(constants.METRICS_CONFIG_SECTION_NAME):
+                self.metrics = dict(config.items(
+                    constants.METRICS_CONFIG_SECTION_NAME))
+
+            if config.has_section(constants.DATABASE_CONFIG_SECTION_NAME):
+                self.db = dict(config.items(
+                    constants.DATABASE_CONFIG_SECTION_NAME))
 
             for k, v in config.items(constants.FILESYSTEM_CONFIG_SECTION_NAME):
                 if v == 'True':
@@ -3,23 +3,146 @@ FILESYSTEM_CONFIG_SECTION_NAME = 'filesystem'
 HAAS_CONFIG_SECTION_NAME = 'haas'
 CEPH_CONFIG_SECTION_NAME = 'ceph'
 ISCSI_CONFIG_SECTION_NAME = 'iscsi'
+JOBS_CONFIG_SECTION_NAME = 'jobs'
+DATABASE_CONFIG_SECTION_NAME = 'database'
+WARM_POOL_CONFIG_SECTION_NAME = 'warm_pool'
+FLATTEN_CONFIG_SECTION_NAME = 'flatten'
+METRICS_CONFIG_SECTION_NAME = 'metrics'
+# followed by <image>@<snapshot> for the settings of a single pool
+WARM_POOL_SECTION_PREFIX = 'warm_pool:'
 
 # Non FS Keys in Config File
 HAAS_URL_KEY = 'url'
-ISCSI_URL_KEY = 'update_shell_url'
+HAAS_POOL_SIZE_KEY = 'pool_size'
+HAAS_TIMEOUT_KEY = 'timeout'
+HAAS_CACHE_TTL_KEY = 'cache_ttl'
+HAAS_NEGATIVE_CACHE_TTL_KEY = 'negative_cache_ttl'
+HAAS_CACHE_SIZE_KEY = 'cache_size'
+HAAS_MAX_CONCURRENCY_KEY = 'max_concurrency'
 ISCSI_PASSWORD_KEY = 'password'
+ISCSI_CONFIG_FILE_KEY = 'ietd_conf'
+ISCSI_TARGET_PREFIX_KEY = 'target_prefix'
+ISCSI_PROC_DIR_KEY = 'proc_dir'
+ISCSI_RBD_SYSFS_DIR_KEY = 'rbd_sysfs_dir'
+ISCSI_RBD_STATE_FILE_KEY = 'rbd_state_file'
+JOBS_WORKERS_KEY = 'workers'
+WARM_POOL_SIZE_KEY = 'size'
+WARM_POOL_REFILL_WORKERS_KEY = 'refill_workers'
+WARM_POOL_METRICS_KEY = 'metrics'
+FLATTEN_MIN_AGE_KEY = 'min_age'
+FLATTEN_WORKERS_KEY = 'workers'
+FLATTEN_MAX_BYTES_PER_SECOND_KEY = 'max_bytes_per_second'
+FLATTEN_BATCH_SIZE_KEY = 'batch_size'
+FLATTEN_INTERVAL_KEY = 'interval'
+METRICS_PORT_KEY = 'port'
+METRICS_ADDRESS_KEY = 'address'
 
 # Ceph Keys in Config File
 CEPH_ID_KEY = 'id'
 CEPH_POOL_KEY = 'pool'
 CEPH_CONFIG_FILE_KEY = 'conf_file'
 CEPH_KEY_RING_KEY = 'keyring'
+CEPH_IDLE_TIMEOUT_KEY = 'connection_idle_timeout'
+CEPH_HEALTH_CHECK_INTERVAL_KEY = 'connection_health_check_interval'
+CEPH_SNAPSHOT_CACHE_TTL_KEY = 'snapshot_cache_ttl'
+CEPH_SNAPSHOT_CACHE_SIZE_KEY = 'snapshot_cache_size'
+CEPH_IMAGE_CACHE_SIZE_KEY = 'image_cache_size'
+CEPH_IMAGE_IDLE_TIMEOUT_KEY = 'image_idle_timeout'
+CEPH_REAP_INTERVAL_KEY = 'reap_interval'
+CEPH_TRANSFER_CHUNK_SIZE_KEY = 'transfer_chunk_size'
+CEPH_TRANSFER_QUEUE_DEPTH_KEY = 'transfer_queue_depth'
+CEPH_IMAGE_FEATURES_KEY = 'image_features'
+CEPH_CLONE_FEATURES_KEY = 'clone_features'
+CEPH_IMAGE_ORDER_KEY = 'image_order'
+CEPH_STRIPE_UNIT_KEY = 'stripe_unit'
+CEPH_STRIPE_COUNT_KEY = 'stripe_count'
+
+# Ceph Connection Pool Defaults (in seconds)
+CEPH_DEFAULT_IDLE_TIMEOUT = 300
+CEPH_DEFAULT_HEALTH_CHECK_INTERVAL = 30
+CEPH_DEFAULT_SNAPSHOT_CACHE_TTL = 30
+CEPH_DEFAULT_SNAPSHOT_CACHE_SIZE = 1024
+CEPH_DEFAULT_IMAGE_CACHE_SIZE = 64
+CEPH_DEFAULT_IMAGE_IDLE_TIMEOUT = 60
+# how often idle connections and images are looked for
+CEPH_DEFAULT_REAP_INTERVAL = 10
+# the default rbd object size
+CEPH_DEFAULT_TRANSFER_CHUNK_SIZE = 4 * 1024 * 1024
+CEPH_DEFAULT_TRANSFER_QUEUE_DEPTH = 8
+# new images get the defaults of librbd unless image_features is set
+CEPH_DEFAULT_CLONE_FEATURES = 'layering'
+
+# HaaS Client Defaults
+HAAS_DEFAULT_POOL_SIZE = 32
+HAAS_DEFAULT_TIMEOUT = 60
+HAAS_DEFAULT_CACHE_TTL = 30
+HAAS_DEFAULT_NEGATIVE_CACHE_TTL = 5
+HAAS_DEFAULT_CACHE_SIZE = 1024
+HAAS_DEFAULT_MAX_CONCURRENCY = 16
 
 # ISCSI
-ISCSI_UPDATE_SUCCESS = 'successfully'
-ISCSI_UPDATE_FAILURE = 'already'
-ISCSI_CREATE_COMMAND = 'create'
-ISCSI_DELETE_COMMAND = 'delete'
+ISCSI_DEFAULT_CONFIG_FILE = '/etc/iet/ietd.conf'
+ISCSI_DEFAULT_TARGET_PREFIX = 'iqn.2015.'
+ISCSI_DEFAULT_PROC_DIR = '/proc/net/iet'
+ISCSI_DEFAULT_RBD_SYSFS_DIR = '/sys/bus/rbd'
+# kernel mappings do not survive a reboot, neither should their index
+ISCSI_DEFAULT_RBD_STATE_FILE = '/var/run/bmi/rbd_devices.json'
+
+# Batch Operations
+DEFAULT_BATCH_WORKERS = 16
+
+# Jobs
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+DEFAULT_JOB_WORKERS = 8
+
+# Warm pool
+WARM_POOL_CLONE_PREFIX = 'bmi-warm-'
+WARM_POOL_DEFAULT_SIZE = 2
+WARM_POOL_DEFAULT_REFILL_WORKERS = 1
+
+# Flatten scheduler
+FLATTEN_DEFAULT_MIN_AGE = 7 * 24 * 3600
+FLATTEN_DEFAULT_WORKERS = 2
+FLATTEN_DEFAULT_MAX_BYTES_PER_SECOND = 100 * 1024 * 1024
+FLATTEN_DEFAULT_BATCH_SIZE = 100
+# no background passes unless configured
+FLATTEN_DEFAULT_INTERVAL = 0
+# passes a clone which keeps failing is skipped for at most
+FLATTEN_MAX_SKIPPED_PASSES = 64
+
+# Metrics, /metrics is not served unless a port is configured
+METRICS_DEFAULT_PORT = 0
+METRICS_DEFAULT_ADDRESS = '127.0.0.1'
+
+# Database Keys in Config File
+DB_URL_KEY = 'url'
+DB_POOL_CLASS_KEY = 'pool_class'
+DB_POOL_SIZE_KEY = 'pool_size'
+DB_MAX_OVERFLOW_KEY = 'max_overflow'
+DB_POOL_RECYCLE_KEY = 'pool_recycle'
+
+# Database Defaults
+DB_DEFAULT_URL = 'sqlite:///sample_bmi.db'
+DB_POOL_NULL = 'null'
+DB_POOL_QUEUE = 'queue'
+DB_POOL_STATIC = 'static'
+DB_DEFAULT_POOL_SIZE = 10
+DB_DEFAULT_MAX_OVERFLOW = 20
+DB_DEFAULT_POOL_RECYCLE = 3600
+DB_SQLITE_BUSY_TIMEOUT = 5000
+DB_DEFAULT_CHUNK_SIZE = 500
+# where the start times of running queries are kept in the info of a connection
+DB_QUERY_START_KEY = 'bmi_query_start'
+
+# Reconciliation
+RECONCILE_DEFAULT_BATCH_SIZE = 1000
+
+# Sagas, the saga of a node is its prefix followed by the node name
+PROVISION_SAGA_PREFIX = 'provision:'
+DETACH_SAGA_PREFIX = 'detach:'
 
 # Response Related Keys
 STATUS_CODE_KEY = 'status_code'
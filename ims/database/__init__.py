@@ -1,4 +1,8 @@
 # Added here so that single import can be used whenever this package is used
-from ims.database.db_connection import DatabaseConnection
+from ims.database.db_connection import DatabaseConnection, chunked
 from ims.database.image import *
 from ims.database.project import *
+from ims.database.job import *
+from ims.database.clone import *
+from ims.database.saga import *
+from ims.database.schema import current_version, ensure_schema, upgrade
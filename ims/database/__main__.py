@@ -0,0 +1,5 @@
+import sys
+
+from ims.database.schema import main
+
+sys.exit(main())
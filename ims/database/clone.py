@@ -0,0 +1,172 @@
+import datetime
+
+from ims import constants
+from ims.database import DatabaseConnection
+from ims.database.db_connection import chunked
+from ims.exception import *
+from sqlalchemy import Column, DateTime, Integer, String
+from sqlalchemy.exc import SQLAlchemyError
+
+
+# This class is responsible for doing CRUD operations on the Clone Table in DB
+# This class was written as per the Repository Model which allows us to change the DB in the future without changing
+# business code
+class CloneRepository:
+    # records that the image name was cloned from parent_name@parent_snap
+    # commits after insertion otherwise rollback occurs after which exception is bubbled up
+    def insert(self, name, parent_name, parent_snap, created_at=None):
+        with DatabaseConnection() as connection:
+            try:
+                clone = Clone()
+                clone.name = name
+                clone.parent_name = parent_name
+                clone.parent_snap = parent_snap
+                if created_at is not None:
+                    clone.created_at = created_at
+                connection.session.add(clone)
+                connection.session.commit()
+            except SQLAlchemyError as e:
+                connection.session.rollback()
+                raise db_exceptions.ORMException(e.message)
+
+    # deletes the clones with the given names
+    # returns the number of clones deleted
+    def delete_with_names(self, names, chunk_size=constants.DB_DEFAULT_CHUNK_SIZE):
+        deleted = 0
+        with DatabaseConnection() as connection:
+            try:
+                for chunk in chunked(names, chunk_size):
+                    deleted += connection.session.query(Clone).filter(
+                        Clone.name.in_(chunk)).delete(synchronize_session=False)
+                    connection.session.commit()
+            except SQLAlchemyError as e:
+                connection.session.rollback()
+                raise db_exceptions.ORMException(e.message)
+        return deleted
+
+    # fetch the clone with name
+    # returns a dict of the clone or None if there is no such clone
+    def fetch_with_name(self, name):
+        try:
+            with DatabaseConnection() as connection:
+                clone = connection.session.query(Clone).filter_by(
+                    name=name).one_or_none()
+                if clone is not None:
+                    return clone.to_dict()
+        except SQLAlchemyError as e:
+            raise db_exceptions.ORMException(e.message)
+
+    # fetch which of the given names are recorded clones
+    # returns a set of names
+    def fetch_existing_names(self, names):
+        try:
+            with DatabaseConnection() as connection:
+                return set(name for (name,) in connection.session.query(
+                    Clone.name).filter(Clone.name.in_(list(names))))
+        except SQLAlchemyError as e:
+            raise db_exceptions.ORMException(e.message)
+
+    # fetch the names of the clones of parent_name@parent_snap whose names start with prefix
+    # returns a list of names, oldest first
+    def fetch_names_with_parent(self, parent_name, parent_snap, prefix=''):
+        try:
+            with DatabaseConnection() as connection:
+                return [name for (name,) in connection.session.query(
+                    Clone.name).filter_by(parent_name=parent_name,
+                                          parent_snap=parent_snap).filter(
+                    Clone.name.startswith(prefix)).order_by(Clone.id)]
+        except SQLAlchemyError as e:
+            raise db_exceptions.ORMException(e.message)
+
+    # renames the clone with name to new_name, which counts as created now
+    # as that is when a clone taken from the warm pool is put to use
+    # returns False if there is no clone with name
+    def rename(self, name, new_name):
+        with DatabaseConnection() as connection:
+            try:
+                renamed = connection.session.query(Clone).filter_by(
+                    name=name).update({Clone.name: new_name,
+                                       Clone.created_at:
+                                           datetime.datetime.utcnow()},
+                                      synchronize_session=False)
+                connection.session.commit()
+                return renamed == 1
+            except SQLAlchemyError as e:
+                connection.session.rollback()
+                raise db_exceptions.ORMException(e.message)
+
+    # fetch the clones created before cutoff which still depend on their parent, oldest first
+    # clones whose names start with exclude_prefix are left out
+    # returns a list of dicts of the clones
+    def fetch_unflattened_before(self, cutoff, limit=None, exclude_prefix=None):
+        try:
+            with DatabaseConnection() as connection:
+                query = connection.session.query(Clone).filter(
+                    Clone.flattened_at.is_(None)).filter(
+                    Clone.created_at < cutoff)
+                if exclude_prefix is not None:
+                    query = query.filter(~Clone.name.startswith(exclude_prefix))
+                query = query.order_by(Clone.created_at)
+                if limit is not None:
+                    query = query.limit(limit)
+                return [clone.to_dict() for clone in query]
+        except SQLAlchemyError as e:
+            raise db_exceptions.ORMException(e.message)
+
+    # records that the clone with name was flattened
+    def mark_flattened(self, name, flattened_at=None):
+        with DatabaseConnection() as connection:
+            try:
+                connection.session.query(Clone).filter_by(name=name).update(
+                    {Clone.flattened_at: flattened_at or
+                                         datetime.datetime.utcnow()},
+                    synchronize_session=False)
+                connection.session.commit()
+            except SQLAlchemyError as e:
+                connection.session.rollback()
+                raise db_exceptions.ORMException(e.message)
+
+    # iterates over the names of all the clones in batches of batch_size
+    def iter_names(self, batch_size=1000):
+        last_name = None
+        while True:
+            try:
+                with DatabaseConnection() as connection:
+                    query = connection.session.query(Clone.name)
+                    if last_name is not None:
+                        query = query.filter(Clone.name > last_name)
+                    names = [name for (name,) in
+                             query.order_by(Clone.name).limit(batch_size)]
+            except SQLAlchemyError as e:
+                raise db_exceptions.ORMException(e.message)
+
+            for name in names:
+                yield name
+            if len(names) < batch_size:
+                return
+            last_name = names[-1]
+
+
+# This class represents the clone table
+# Every image cloned from a snapshot by BMI is recorded here with its parent, name is the ceph name of the clone
+# which for provisioned nodes is the node name
+class Clone(DatabaseConnection.Base):
+    __tablename__ = "clone"
+
+    # Columns in the table
+    id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
+    name = Column(String, nullable=False, unique=True)
+    parent_name = Column(String, nullable=False, index=True)
+    parent_snap = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False,
+                        default=datetime.datetime.utcnow)
+    # set once the clone no longer depends on its parent
+    flattened_at = Column(DateTime)
+
+    def to_dict(self):
+        return {'name': self.name,
+                'parent_name': self.parent_name,
+                'parent_snap': self.parent_snap,
+                'created_at': self.created_at.isoformat(),
+                'flattened_at': self.flattened_at.isoformat()
+                if self.flattened_at is not None else None}
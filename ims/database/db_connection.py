@@ -1,7 +1,15 @@
-from sqlalchemy import create_engine
+import threading
+import time
+
+from ims import constants
+from ims import metrics
+from ims.exception import *
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool
 
 
 # The class which represents the BMI database
@@ -11,18 +19,131 @@ class DatabaseConnection:
     Base = declarative_base()
 
     # the engine and session maker are made static so that only one of them needs to be created
-    # creates the engine for the database
-    # sample_bmi.db should be changed to something more realistic
-    # NullPool pool class is equivalent to no connection pool
-    # Should be adapted to postgres SQL
-    engine = create_engine('sqlite:///sample_bmi.db', poolclass=NullPool)
+    # the engine is created from the [database] section of the bmi config by configure
+    # or with the defaults (a local sqlite file) on first use if it was never configured
+    engine = None
+    settings = None
+    lock = threading.Lock()
+
+    # creates a session maker for creating sessions, bound once the engine exists
+    session_maker = sessionmaker()
+
+    pool_classes = {constants.DB_POOL_NULL: NullPool,
+                    constants.DB_POOL_QUEUE: QueuePool,
+                    constants.DB_POOL_STATIC: StaticPool}
+
+    # creates the engine from a dict of database options
+    # postgres and other servers get a QueuePool by default, sqlite gets no pool and runs in WAL mode
+    # so that readers do not block the writer
+    # calling it again with the same options keeps the existing engine
+    @staticmethod
+    def configure(config=None):
+        config = config or {}
+        try:
+            url = make_url(config.get(constants.DB_URL_KEY,
+                                      constants.DB_DEFAULT_URL))
+            is_sqlite = url.drivername.startswith('sqlite')
+            pool_name = config.get(constants.DB_POOL_CLASS_KEY,
+                                   constants.DB_POOL_NULL if is_sqlite
+                                   else constants.DB_POOL_QUEUE)
+            pool_class = DatabaseConnection.pool_classes[pool_name]
+            pool_size = int(config.get(constants.DB_POOL_SIZE_KEY,
+                                       constants.DB_DEFAULT_POOL_SIZE))
+            max_overflow = int(config.get(constants.DB_MAX_OVERFLOW_KEY,
+                                          constants.DB_DEFAULT_MAX_OVERFLOW))
+            pool_recycle = int(config.get(constants.DB_POOL_RECYCLE_KEY,
+                                          constants.DB_DEFAULT_POOL_RECYCLE))
+        except KeyError as e:
+            raise config_exceptions.InvalidOptionInConfigException(
+                constants.DB_POOL_CLASS_KEY, e.args[0])
+        except ValueError as e:
+            raise config_exceptions.InvalidOptionInConfigException(
+                constants.DATABASE_CONFIG_SECTION_NAME, str(e))
+
+        settings = (str(url), pool_name, pool_size, max_overflow, pool_recycle)
+        with DatabaseConnection.lock:
+            if DatabaseConnection.settings == settings:
+                return
+
+            kwargs = {'poolclass': pool_class, 'pool_recycle': pool_recycle}
+            if pool_class is QueuePool:
+                kwargs['pool_size'] = pool_size
+                kwargs['max_overflow'] = max_overflow
+            engine = create_engine(url, **kwargs)
+            if is_sqlite and url.database not in (None, '', ':memory:'):
+                event.listen(engine, 'connect',
+                             DatabaseConnection.__enable_sqlite_wal)
+            event.listen(engine, 'before_cursor_execute',
+                         DatabaseConnection.__start_query)
+            event.listen(engine, 'after_cursor_execute',
+                         DatabaseConnection.__end_query)
+            event.listen(engine, 'handle_error',
+                         DatabaseConnection.__fail_query)
+
+            if DatabaseConnection.engine is not None:
+                DatabaseConnection.engine.dispose()
+            DatabaseConnection.engine = engine
+            DatabaseConnection.session_maker.configure(bind=engine)
+            DatabaseConnection.settings = settings
+
+    # WAL lets readers go on while a write is in progress and the busy timeout makes concurrent writers
+    # wait for the lock instead of failing right away
+    @staticmethod
+    def __enable_sqlite_wal(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout=' +
+                       str(constants.DB_SQLITE_BUSY_TIMEOUT))
+        cursor.close()
+
+    # queries are timed in bmi_db_query_seconds by their kind
+    # the start times are kept on the connection as statements of a connection never overlap
+    @staticmethod
+    def __statement_kind(statement):
+        words = (statement or '').split(None, 1)
+        kind = words[0].lower() if words else ''
+        return kind if kind in ('select', 'insert', 'update', 'delete') else 'other'
 
-    # creates a session maker for creating sessions
-    session_maker = sessionmaker(bind=engine)
+    @staticmethod
+    def __start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault(constants.DB_QUERY_START_KEY, []).append(time.time())
 
-    # creates all tables if not present
+    @staticmethod
+    def __end_query(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info[constants.DB_QUERY_START_KEY].pop()
+        metrics.DB_QUERY_SECONDS.observe(
+            time.time() - start, statement=DatabaseConnection.__statement_kind(statement))
+
+    @staticmethod
+    def __fail_query(exception_context):
+        starts = exception_context.connection.info.get(constants.DB_QUERY_START_KEY) \
+            if exception_context.connection is not None else None
+        if not starts:
+            return
+        kind = DatabaseConnection.__statement_kind(exception_context.statement)
+        metrics.DB_QUERY_SECONDS.observe(time.time() - starts.pop(), statement=kind)
+        metrics.DB_QUERY_SECONDS.errors.inc(statement=kind)
+
+    # returns the engine, creating the default one if it was never configured
+    @staticmethod
+    def get_engine():
+        if DatabaseConnection.engine is None:
+            DatabaseConnection.configure()
+        return DatabaseConnection.engine
+
+    # closes the connections of the engine and forgets it, the next use configures it again
+    @staticmethod
+    def reset():
+        with DatabaseConnection.lock:
+            if DatabaseConnection.engine is not None:
+                DatabaseConnection.engine.dispose()
+            DatabaseConnection.engine = None
+            DatabaseConnection.settings = None
+
+    # tables are created once by ims.database.schema, so a connection only checks out a session
     def __init__(self):
-        DatabaseConnection.Base.metadata.create_all(DatabaseConnection.engine)
+        DatabaseConnection.get_engine()
 
     def __enter__(self):
         self.session = DatabaseConnection.session_maker()
@@ -30,3 +151,44 @@ class DatabaseConnection:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.session.close()
+
+    # inserts rows (dicts of column values) into table with a single executemany and commits
+    # if a row breaks a constraint the rows are retried one at a time so that only the bad ones are left out
+    # returns the rows which could not be inserted
+    def insert_rows(self, table, rows):
+        if not rows:
+            return []
+        # executemany needs every row to have the same columns
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row.keys())), []).append(row)
+        try:
+            for group in groups.values():
+                self.session.execute(table.insert(), group)
+            self.session.commit()
+            return []
+        except IntegrityError:
+            self.session.rollback()
+
+        failed = []
+        for row in rows:
+            try:
+                self.session.execute(table.insert(), row)
+                self.session.commit()
+            except IntegrityError:
+                self.session.rollback()
+                failed.append(row)
+        return failed
+
+
+# splits iterable into lists of at most size items, used by the bulk operations of the repositories
+# so that each chunk can go to the database in its own transaction
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
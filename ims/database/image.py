@@ -1,7 +1,10 @@
+from ims import constants
+from ims.database.db_connection import chunked
 from ims.database.project import *
 from ims.exception import *
 from sqlalchemy import Boolean, ForeignKey
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import Index
+from sqlalchemy import and_
 
 
 # This class is responsible for doing CRUD operations on the Image Table in DB
@@ -25,6 +28,64 @@ class ImageRepository:
                 connection.session.rollback()
                 raise db_exceptions.ORMException(e.message)
 
+    # inserts many images given as (image_name, project_id[, is_public[, id]]) tuples like the arguments of insert
+    # rows are inserted chunk_size at a time with one executemany and transaction per chunk
+    # returns the tuples which were not inserted because the project already has an image with that name
+    # (or the id is taken)
+    def insert_many(self, images, chunk_size=constants.DB_DEFAULT_CHUNK_SIZE):
+        conflicts = []
+        for chunk in chunked(images, chunk_size):
+            with DatabaseConnection() as connection:
+                try:
+                    names = set(image[0] for image in chunk)
+                    project_ids = set(image[1] for image in chunk)
+                    existing = set(connection.session.query(
+                        Image.project_id, Image.name).filter(
+                        Image.name.in_(names)).filter(
+                        Image.project_id.in_(project_ids)))
+                    rows = []
+                    for image in chunk:
+                        key = (image[1], image[0])
+                        if key in existing:
+                            conflicts.append(image)
+                            continue
+                        # later duplicates within the input are conflicts too
+                        existing.add(key)
+                        row = {'name': image[0], 'project_id': image[1],
+                               'is_public': image[2] if len(image) > 2 else False}
+                        if len(image) > 3 and image[3] is not None:
+                            row['id'] = image[3]
+                        rows.append((image, row))
+                    failed = connection.insert_rows(Image.__table__,
+                                                    [row for _, row in rows])
+                    conflicts.extend(image for image, row in rows if row in failed)
+                except SQLAlchemyError as e:
+                    connection.session.rollback()
+                    raise db_exceptions.ORMException(e.message)
+        return conflicts
+
+    # deletes the images with the given names under the given project name
+    # returns the number of images deleted
+    def delete_many_with_names_from_project(self, names, project_name,
+                                            chunk_size=constants.DB_DEFAULT_CHUNK_SIZE):
+        deleted = 0
+        with DatabaseConnection() as connection:
+            try:
+                project = connection.session.query(Project.id).filter_by(
+                    name=project_name).one_or_none()
+                if project is None:
+                    return 0
+                for chunk in chunked(names, chunk_size):
+                    deleted += connection.session.execute(
+                        Image.__table__.delete().where(
+                            Image.__table__.c.project_id == project.id).where(
+                            Image.__table__.c.name.in_(chunk))).rowcount
+                    connection.session.commit()
+            except SQLAlchemyError as e:
+                connection.session.rollback()
+                raise db_exceptions.ORMException(e.message)
+        return deleted
+
     # deletes images with name under the given project name
     # commits if deletion was successful otherwise rollback occurs and exception is bubbled up
     def delete_with_name_from_project(self, name, project_name):
@@ -43,27 +104,78 @@ class ImageRepository:
     def fetch_id_with_name_from_project(self, name, project_name):
         try:
             with DatabaseConnection() as connection:
-                image = connection.session.query(Image). \
-                    filter(Image.project.has(name=project_name)).filter_by(
-                    name=name).one_or_none()
-                if image is not None:
-                    return image.id
+                row = connection.session.query(Image.id).join(
+                    Project).filter(Project.name == project_name).filter(
+                    Image.name == name).one_or_none()
+                if row is not None:
+                    return row.id
+        except SQLAlchemyError as e:
+            raise db_exceptions.ORMException(e.message)
+
+    # fetch the id of the project with name and the id of its image with name in one query
+    # the project is outer joined with the image so that a missing image can be told apart from a missing project
+    # returns None if the project does not exist otherwise (project id, image id or None)
+    def fetch_ids_with_names(self, project_name, name):
+        try:
+            with DatabaseConnection() as connection:
+                row = connection.session.query(Project.id, Image.id).outerjoin(
+                    Image, and_(Image.project_id == Project.id,
+                                Image.name == name)).filter(
+                    Project.name == project_name).one_or_none()
+                if row is not None:
+                    return row[0], row[1]
         except SQLAlchemyError as e:
             raise db_exceptions.ORMException(e.message)
 
     # Fetch the list of images which are public
     # We are returning a dictionary of format {image_name : <img_name> , project_name : <proj_name>}
-    def fetch_names_with_public(self):
+    # Image and project names are fetched together with a join of only the needed columns
+    # limit and offset can be given for paging through a large catalog
+    def fetch_names_with_public(self, limit=None, offset=None):
         try:
             with DatabaseConnection() as connection:
-                img_list = connection.session.query(Image).filter_by(
-                    is_public=True)
-                return [{'image_name': image.name,
-                         'project_name': image.project.name}
-                        for image in img_list]
+                query = ImageRepository.__public_names_query(
+                    connection.session).order_by(Image.id)
+                if offset is not None:
+                    query = query.offset(offset)
+                if limit is not None:
+                    query = query.limit(limit)
+                return [{'image_name': row.image_name,
+                         'project_name': row.project_name}
+                        for row in query]
         except SQLAlchemyError as e:
             raise db_exceptions.ORMException(e.message)
 
+    # Iterates over the public images in the same format as fetch_names_with_public
+    # Rows are fetched in batches of batch_size by image id so that a huge catalog is never held in memory
+    # and no session is kept open between batches
+    def iter_names_with_public(self, batch_size=1000):
+        last_id = None
+        while True:
+            try:
+                with DatabaseConnection() as connection:
+                    query = ImageRepository.__public_names_query(
+                        connection.session, Image.id)
+                    if last_id is not None:
+                        query = query.filter(Image.id > last_id)
+                    rows = query.order_by(Image.id).limit(batch_size).all()
+            except SQLAlchemyError as e:
+                raise db_exceptions.ORMException(e.message)
+
+            for row in rows:
+                yield {'image_name': row.image_name,
+                       'project_name': row.project_name}
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1].id
+
+    @staticmethod
+    def __public_names_query(session, *columns):
+        return session.query(Image.name.label('image_name'),
+                             Project.name.label('project_name'),
+                             *columns).join(Project).filter(
+            Image.is_public == True)
+
     # fetch the image names which are under the given project name
     # returning a list of strings
     def fetch_names_from_project(self, project_name):
@@ -75,6 +187,51 @@ class ImageRepository:
         except SQLAlchemyError as e:
             raise db_exceptions.ORMException(e.message)
 
+    # fetch which of the given ids belong to images
+    # returns a set of ids
+    def fetch_existing_ids(self, ids):
+        try:
+            with DatabaseConnection() as connection:
+                return set(id for (id,) in connection.session.query(
+                    Image.id).filter(Image.id.in_(list(ids))))
+        except SQLAlchemyError as e:
+            raise db_exceptions.ORMException(e.message)
+
+    # iterates over (id, name) of all images in batches of batch_size by id
+    def iter_ids(self, batch_size=1000):
+        last_id = None
+        while True:
+            try:
+                with DatabaseConnection() as connection:
+                    query = connection.session.query(Image.id, Image.name)
+                    if last_id is not None:
+                        query = query.filter(Image.id > last_id)
+                    rows = query.order_by(Image.id).limit(batch_size).all()
+            except SQLAlchemyError as e:
+                raise db_exceptions.ORMException(e.message)
+
+            for row in rows:
+                yield row.id, row.name
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1].id
+
+    # deletes the images with the given ids
+    # returns the number of images deleted
+    def delete_with_ids(self, ids, chunk_size=constants.DB_DEFAULT_CHUNK_SIZE):
+        deleted = 0
+        with DatabaseConnection() as connection:
+            try:
+                for chunk in chunked(ids, chunk_size):
+                    deleted += connection.session.execute(
+                        Image.__table__.delete().where(
+                            Image.__table__.c.id.in_(chunk))).rowcount
+                    connection.session.commit()
+            except SQLAlchemyError as e:
+                connection.session.rollback()
+                raise db_exceptions.ORMException(e.message)
+        return deleted
+
     # fetch name of image with given id
     def fetch_name_with_id(self, id):
         try:
@@ -104,9 +261,9 @@ class Image(DatabaseConnection.Base):
     project = relationship("Project", back_populates="images")
 
     # Users should not be able to create images with same name in a given
-    # project. So we are creating a unique constraint.
-    UniqueConstraint("project_id", "name",
-                     "Project_id_image_name_unique_constraint")
+    # project. So we are creating a unique index, which also serves the lookups of an image by name in a project
+    __table_args__ = (Index("project_id_image_name_unique_index",
+                            "project_id", "name", unique=True),)
 
     # Removed snapshot class for now
     # snapshots = relationship("Snapshot", back_populates="image", lazy="joined", cascade="all, delete, delete-orphan")
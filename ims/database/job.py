@@ -0,0 +1,124 @@
+import datetime
+import json
+
+from ims.database import DatabaseConnection
+from ims.exception import *
+from sqlalchemy import Column, DateTime, String, Text
+from sqlalchemy.exc import SQLAlchemyError
+
+
+# This class is responsible for doing CRUD operations on the Job Table in DB
+# This class was written as per the Repository Model which allows us to change the DB in the future without changing
+# business code
+class JobRepository:
+    # inserts a new queued job
+    # owner names the process which runs the job
+    # commits after insertion otherwise rollback occurs after which exception is bubbled up
+    def insert(self, job_id, operation, status, owner=None):
+        with DatabaseConnection() as connection:
+            try:
+                job = Job()
+                job.id = job_id
+                job.operation = operation
+                job.status = status
+                job.owner = owner
+                connection.session.add(job)
+                connection.session.commit()
+            except SQLAlchemyError as e:
+                connection.session.rollback()
+                raise db_exceptions.ORMException(e.message)
+
+    # updates the status of the job and stores the result dict if given
+    # commits after update otherwise rollback occurs after which exception is bubbled up
+    def update_status(self, job_id, status, result=None):
+        with DatabaseConnection() as connection:
+            try:
+                values = {'status': status,
+                          'updated_at': datetime.datetime.utcnow()}
+                if result is not None:
+                    values['result'] = json.dumps(result)
+                connection.session.query(Job).filter_by(id=job_id).update(
+                    values, synchronize_session=False)
+                connection.session.commit()
+            except SQLAlchemyError as e:
+                connection.session.rollback()
+                raise db_exceptions.ORMException(e.message)
+
+    # fetch the job with id
+    # returns a dict of the job or None if there is no such job
+    def fetch_with_id(self, job_id):
+        try:
+            with DatabaseConnection() as connection:
+                job = connection.session.query(Job).filter_by(
+                    id=job_id).one_or_none()
+                if job is not None:
+                    return job.to_dict()
+        except SQLAlchemyError as e:
+            raise db_exceptions.ORMException(e.message)
+
+    # fetch the jobs with the given ids in a single query
+    # returns a list of job dicts, unknown ids are left out
+    def fetch_with_ids(self, job_ids):
+        try:
+            with DatabaseConnection() as connection:
+                jobs = connection.session.query(Job).filter(
+                    Job.id.in_(list(job_ids)))
+                return [job.to_dict() for job in jobs]
+        except SQLAlchemyError as e:
+            raise db_exceptions.ORMException(e.message)
+
+    # fetch the jobs which are in one of the given statuses
+    # returns a list of (job id, owner) tuples
+    def fetch_owners_with_statuses(self, statuses):
+        try:
+            with DatabaseConnection() as connection:
+                return [tuple(row) for row in connection.session.query(
+                    Job.id, Job.owner).filter(Job.status.in_(statuses))]
+        except SQLAlchemyError as e:
+            raise db_exceptions.ORMException(e.message)
+
+    # updates the status and result of all the jobs with the given ids
+    # a job which is no longer in one of statuses is left as it is
+    # returns the number of jobs updated
+    def update_status_with_ids(self, job_ids, statuses, status, result):
+        with DatabaseConnection() as connection:
+            try:
+                updated = connection.session.query(Job).filter(
+                    Job.id.in_(list(job_ids)),
+                    Job.status.in_(statuses)).update(
+                    {'status': status,
+                     'result': json.dumps(result),
+                     'updated_at': datetime.datetime.utcnow()},
+                    synchronize_session=False)
+                connection.session.commit()
+                return updated
+            except SQLAlchemyError as e:
+                connection.session.rollback()
+                raise db_exceptions.ORMException(e.message)
+
+
+# This class represents the job table
+# the Column variables are the columns in the table
+# result holds the json of the status dict returned by the BMI operation
+class Job(DatabaseConnection.Base):
+    __tablename__ = "job"
+
+    # Columns in the table
+    id = Column(String, primary_key=True, nullable=False)
+    operation = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    result = Column(Text, nullable=True)
+    # host:pid of the process running the job
+    owner = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False,
+                        default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False,
+                        default=datetime.datetime.utcnow)
+
+    def to_dict(self):
+        return {'job_id': self.id,
+                'operation': self.operation,
+                'status': self.status,
+                'result': json.loads(self.result) if self.result else None,
+                'created_at': self.created_at.isoformat(),
+                'updated_at': self.updated_at.isoformat()}
@@ -1,4 +1,6 @@
+from ims import constants
 from ims.database import DatabaseConnection
+from ims.database.db_connection import chunked
 from ims.exception import *
 from sqlalchemy import Column, Integer, String
 from sqlalchemy.exc import SQLAlchemyError
@@ -25,6 +27,61 @@ class ProjectRepository:
                 connection.session.rollback()
                 raise db_exceptions.ORMException(e.message)
 
+    # inserts many projects given as (name, provision_network) or (name, provision_network, id) tuples
+    # rows are inserted chunk_size at a time with one executemany and transaction per chunk
+    # returns the tuples which were not inserted as a project with the same name or id already exists
+    def insert_many(self, projects, chunk_size=constants.DB_DEFAULT_CHUNK_SIZE):
+        conflicts = []
+        for chunk in chunked(projects, chunk_size):
+            with DatabaseConnection() as connection:
+                try:
+                    names = [project[0] for project in chunk]
+                    existing = set(name for (name,) in connection.session.query(
+                        Project.name).filter(Project.name.in_(names)))
+                    rows = []
+                    for project in chunk:
+                        if project[0] in existing:
+                            conflicts.append(project)
+                            continue
+                        # later duplicates within the input are conflicts too
+                        existing.add(project[0])
+                        row = {'name': project[0], 'provision_network': project[1]}
+                        if len(project) > 2 and project[2] is not None:
+                            row['id'] = project[2]
+                        rows.append((project, row))
+                    failed = connection.insert_rows(Project.__table__,
+                                                    [row for _, row in rows])
+                    conflicts.extend(project for project, row in rows if row in failed)
+                except SQLAlchemyError as e:
+                    connection.session.rollback()
+                    raise db_exceptions.ORMException(e.message)
+        return conflicts
+
+    # deletes the projects with the given names along with their images
+    # the images are deleted explicitly as the bulk delete skips the ORM cascade
+    # returns the number of projects deleted
+    def delete_many_with_names(self, names, chunk_size=constants.DB_DEFAULT_CHUNK_SIZE):
+        from ims.database.image import Image
+
+        deleted = 0
+        for chunk in chunked(names, chunk_size):
+            with DatabaseConnection() as connection:
+                try:
+                    ids = [pid for (pid,) in connection.session.query(
+                        Project.id).filter(Project.name.in_(chunk))]
+                    if not ids:
+                        continue
+                    connection.session.execute(Image.__table__.delete().where(
+                        Image.__table__.c.project_id.in_(ids)))
+                    deleted += connection.session.execute(
+                        Project.__table__.delete().where(
+                            Project.__table__.c.id.in_(ids))).rowcount
+                    connection.session.commit()
+                except SQLAlchemyError as e:
+                    connection.session.rollback()
+                    raise db_exceptions.ORMException(e.message)
+        return deleted
+
     # deletes project with name
     # commits after deletion otherwise rollback occurs after which exception is bubbled up
     def delete_with_name(self, name):
@@ -0,0 +1,91 @@
+import datetime
+
+from ims import constants
+from ims.database import DatabaseConnection
+from ims.database.db_connection import chunked
+from ims.exception import *
+from sqlalchemy import Column, DateTime, Integer, String, UniqueConstraint
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+
+# This class is responsible for doing CRUD operations on the Saga Step Table in DB
+# A row records that a step of a saga, like the clone of provision:<node>, was completed
+# This class was written as per the Repository Model which allows us to change the DB in the future without changing
+# business code
+class SagaRepository:
+    # records that step of saga was completed
+    # a step which is already recorded is left as it is
+    def insert(self, saga, step):
+        with DatabaseConnection() as connection:
+            try:
+                saga_step = SagaStep()
+                saga_step.saga = saga
+                saga_step.step = step
+                connection.session.add(saga_step)
+                connection.session.commit()
+            except IntegrityError:
+                connection.session.rollback()
+            except SQLAlchemyError as e:
+                connection.session.rollback()
+                raise db_exceptions.ORMException(e.message)
+
+    # fetch the completed steps of the sagas with one query
+    # returns a dict from saga to the set of its completed steps, sagas without steps are left out
+    def fetch_steps_with_sagas(self, sagas, chunk_size=constants.DB_DEFAULT_CHUNK_SIZE):
+        steps = {}
+        try:
+            with DatabaseConnection() as connection:
+                for chunk in chunked(sagas, chunk_size):
+                    for saga, step in connection.session.query(
+                            SagaStep.saga, SagaStep.step).filter(
+                            SagaStep.saga.in_(chunk)):
+                        steps.setdefault(saga, set()).add(step)
+        except SQLAlchemyError as e:
+            raise db_exceptions.ORMException(e.message)
+        return steps
+
+    # fetch the completed steps of saga
+    # returns a set of step names
+    def fetch_steps(self, saga):
+        return self.fetch_steps_with_sagas([saga]).get(saga, set())
+
+    # deletes the record of step of saga
+    def delete_step(self, saga, step):
+        with DatabaseConnection() as connection:
+            try:
+                connection.session.query(SagaStep).filter_by(
+                    saga=saga, step=step).delete(synchronize_session=False)
+                connection.session.commit()
+            except SQLAlchemyError as e:
+                connection.session.rollback()
+                raise db_exceptions.ORMException(e.message)
+
+    # deletes the steps of the given sagas
+    # returns the number of steps deleted
+    def delete_with_sagas(self, sagas, chunk_size=constants.DB_DEFAULT_CHUNK_SIZE):
+        deleted = 0
+        with DatabaseConnection() as connection:
+            try:
+                for chunk in chunked(sagas, chunk_size):
+                    deleted += connection.session.query(SagaStep).filter(
+                        SagaStep.saga.in_(chunk)).delete(synchronize_session=False)
+                    connection.session.commit()
+            except SQLAlchemyError as e:
+                connection.session.rollback()
+                raise db_exceptions.ORMException(e.message)
+        return deleted
+
+
+# This class represents the saga step table
+# The Column variables are the columns in the table
+class SagaStep(DatabaseConnection.Base):
+    __tablename__ = "saga_step"
+    __table_args__ = (UniqueConstraint("saga", "step",
+                                       name="saga_step_unique_index"),)
+
+    # Columns in the table
+    id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
+    saga = Column(String, nullable=False, index=True)
+    step = Column(String, nullable=False)
+    completed_at = Column(DateTime, nullable=False,
+                          default=datetime.datetime.utcnow)
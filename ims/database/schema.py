@@ -0,0 +1,151 @@
+import datetime
+import threading
+
+from ims.database.clone import Clone
+from ims.database.db_connection import DatabaseConnection
+from ims.database.image import Image
+from ims.database.job import Job
+from ims.database.project import Project
+from ims.database.saga import SagaStep
+from ims.exception import *
+from sqlalchemy import Column, DateTime, Integer, func, inspect, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+
+# This class represents the schema_version table
+# Every applied migration adds a row with its version
+class SchemaVersion(DatabaseConnection.Base):
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    applied_at = Column(DateTime, nullable=False,
+                        default=datetime.datetime.utcnow)
+
+
+# Returns a migration which creates the given tables if they do not exist
+# Existing databases which were created before versioning already have them
+def create_tables(*tables):
+    def migrate(connection):
+        for table in tables:
+            table.create(connection, checkfirst=True)
+
+    return migrate
+
+
+# Returns the values of the columns which more than one row of table has
+def find_duplicates(connection, table, columns):
+    query = select(columns).group_by(*columns).having(
+        func.count() > 1).order_by(*columns)
+    return [tuple(row) for row in connection.execute(query)]
+
+
+# Returns a migration which creates the indexes of table with the given names if they do not exist
+# A unique index is checked for existing duplicates first, which are listed in the error
+def create_indexes(table, *names):
+    def migrate(connection):
+        existing = [i['name'] for i in
+                    inspect(connection).get_indexes(table.name)]
+        for index in table.indexes:
+            if index.name in names and index.name not in existing:
+                if index.unique:
+                    columns = list(index.columns)
+                    duplicates = find_duplicates(connection, table, columns)
+                    if duplicates:
+                        raise db_exceptions.DuplicateRowsException(
+                            table.name, [c.name for c in columns],
+                            duplicates)
+                index.create(connection)
+
+    return migrate
+
+
+# Returns a migration which adds the columns of table with the given names if they do not exist
+def add_columns(table, *names):
+    def migrate(connection):
+        existing = [c['name'] for c in
+                    inspect(connection).get_columns(table.name)]
+        for name in names:
+            if name not in existing:
+                column = table.c[name]
+                connection.execute(
+                    'ALTER TABLE %s ADD COLUMN %s %s' % (
+                        table.name, column.name,
+                        column.type.compile(dialect=connection.dialect)))
+
+    return migrate
+
+
+# The migrations in the order they have to be applied
+# A released migration should never be changed, add a new version instead
+MIGRATIONS = [
+    (1, create_tables(Project.__table__, Image.__table__, Job.__table__)),
+    (2, create_indexes(Image.__table__,
+                       "project_id_image_name_unique_index")),
+    (3, create_tables(Clone.__table__)),
+    (4, add_columns(Clone.__table__, "flattened_at")),
+    (5, create_tables(SagaStep.__table__)),
+    (6, add_columns(Job.__table__, "owner")),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# Returns the version of the database schema, 0 for an empty database
+def current_version():
+    try:
+        engine = DatabaseConnection.get_engine()
+        SchemaVersion.__table__.create(engine, checkfirst=True)
+        version = engine.execute(
+            func.max(SchemaVersion.__table__.c.version)).scalar()
+        return version or 0
+    except SQLAlchemyError as e:
+        raise db_exceptions.ORMException(e.message)
+
+
+# Applies all the migrations newer than the current version
+# Every migration runs in its own transaction along with its version row
+# If another process applies the same version first we just move on
+def upgrade():
+    engine = DatabaseConnection.get_engine()
+    version = current_version()
+    for migration_version, migrate in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        try:
+            with engine.begin() as connection:
+                migrate(connection)
+                connection.execute(SchemaVersion.__table__.insert(),
+                                   version=migration_version,
+                                   applied_at=datetime.datetime.utcnow())
+        except IntegrityError as e:
+            # the version row clashed because another process was faster
+            if current_version() < migration_version:
+                raise db_exceptions.ORMException(e.message)
+        except SQLAlchemyError as e:
+            raise db_exceptions.ORMException(e.message)
+    return current_version()
+
+
+_upgraded = set()
+_upgrade_lock = threading.Lock()
+
+
+# Upgrades the schema once per process for the configured database
+# Connections made afterwards only check out a session
+def ensure_schema():
+    with _upgrade_lock:
+        settings = DatabaseConnection.settings
+        if settings is None or settings not in _upgraded:
+            upgrade()
+            _upgraded.add(DatabaseConnection.settings)
+
+
+# Command line entry point for upgrading the database of a bmi install
+# Reads the [database] section of the bmi config in the current directory
+# Run as bmi-db-upgrade or python -m ims.database
+def main():
+    from ims.config import BMIConfig
+
+    config = BMIConfig.create_config()
+    DatabaseConnection.configure(config.db)
+    print("database schema is at version " + str(upgrade()))
@@ -1,7 +1,17 @@
+import datetime
+import os
+import subprocess
 from unittest import TestCase
 
+from ims.database.clone import *
 from ims.database.image import *
+from ims.database.job import *
 from ims.database.project import *
+from ims.database.saga import *
+from ims.database.schema import *
+from ims.jobs import JobEngine
+from ims.saga import Saga
+from sqlalchemy import create_engine
 
 
 # Before running make sure no .db files are present in execution directory
@@ -9,6 +19,33 @@ from ims.database.project import *
 
 # Tests for Project Class
 class TestDatabase(TestCase):
+    def setUp(self):
+        upgrade()
+
+    def test_schema(self):
+        self.assertEqual(upgrade(), LATEST_VERSION)
+        self.assertEqual(current_version(), LATEST_VERSION)
+
+    def test_unique_index_migration(self):
+        # an image table from before the unique index with a duplicate name
+        engine = create_engine("sqlite://")
+        engine.execute("CREATE TABLE image (id INTEGER PRIMARY KEY, "
+                       "name VARCHAR, project_id INTEGER, is_public BOOLEAN)")
+        for name in ["image 1", "image 1", "image 2"]:
+            engine.execute("INSERT INTO image (name, project_id) "
+                           "VALUES (?, 1)", name)
+        migrate = create_indexes(Image.__table__,
+                                 "project_id_image_name_unique_index")
+        with engine.begin() as connection:
+            with self.assertRaises(db_exceptions.DuplicateRowsException) as e:
+                migrate(connection)
+        self.assertEqual(e.exception.duplicates, [(1, "image 1")])
+        self.assertIn("(1, u'image 1')", str(e.exception))
+
+        engine.execute("DELETE FROM image WHERE id = 2")
+        with engine.begin() as connection:
+            migrate(connection)
+
     def test_database(self):
         # insert a project
         pr = ProjectRepository()
@@ -49,6 +86,17 @@ class TestDatabase(TestCase):
         self.assertIsNotNone(qimg)
         self.assertEqual(qimg, 1)
 
+        # project and image ids should be resolved together
+        self.assertEqual(imgr.fetch_ids_with_names("project 2", "image 1"),
+                         (2, 1))
+        self.assertEqual(imgr.fetch_ids_with_names("project 2", "image 3"),
+                         (2, None))
+        self.assertIsNone(imgr.fetch_ids_with_names("project 1", "image 1"))
+
+        # names are unique within a project
+        with self.assertRaises(db_exceptions.ORMException):
+            imgr.insert("image 1", 2)
+
         # check that the image is not being returned from a different project name
         qimg = imgr.fetch_id_with_name_from_project("image 1", "project 1")
         qimg_list = imgr.fetch_names_with_public()
@@ -56,6 +104,7 @@ class TestDatabase(TestCase):
         qimg_name = imgr.fetch_name_with_id("1")
         self.assertIsNotNone(qimg_list)
         self.assertEqual(qimg_list[0]['image_name'], "image2")
+        self.assertEqual(qimg_list[0]['project_name'], "project 2")
         self.assertIsNone(qimg)
         self.assertIsNotNone(qimg_names)
         self.assertEqual(qimg_names.__len__(), 3)
@@ -78,3 +127,241 @@ class TestDatabase(TestCase):
 
         qp = pr.fetch_id_with_name("project 2")
         self.assertIsNone(qp)
+
+    def test_jobs(self):
+        jobr = JobRepository()
+        jobr.insert("job 1", "provision", "queued")
+        jobr.insert("job 2", "detach_node", "queued")
+
+        job = jobr.fetch_with_id("job 1")
+        self.assertIsNotNone(job)
+        self.assertEqual(job['operation'], "provision")
+        self.assertEqual(job['status'], "queued")
+        self.assertIsNone(job['result'])
+
+        # the result dict should come back as it was stored
+        jobr.update_status("job 1", "failed",
+                           {"status_code": 404, "msg": "i12 Not Found"})
+        job = jobr.fetch_with_id("job 1")
+        self.assertEqual(job['status'], "failed")
+        self.assertEqual(job['result'],
+                         {"status_code": 404, "msg": "i12 Not Found"})
+
+        jobs = jobr.fetch_with_ids(["job 1", "job 2", "job 3"])
+        self.assertEqual(sorted(job['job_id'] for job in jobs),
+                         ["job 1", "job 2"])
+
+        self.assertIsNone(jobr.fetch_with_id("job 3"))
+
+    def test_job_recovery(self):
+        # a process of this host which has exited
+        child = subprocess.Popen(["true"])
+        child.wait()
+
+        jobr = JobRepository()
+        jobr.insert("job 4", "provision", "running", "testhost:%d" % child.pid)
+        jobr.insert("job 5", "provision", "queued", "testhost:%d" % os.getpid())
+        jobr.insert("job 6", "provision", "running", "otherhost:1")
+        jobr.insert("job 7", "provision", "running")
+        jobr.insert("job 8", "provision", "succeeded",
+                    "testhost:%d" % child.pid)
+
+        engine = JobEngine(1, "testhost:%d" % os.getppid())
+        engine.close()
+        statuses = dict((job['job_id'], job['status']) for job in
+                        jobr.fetch_with_ids(["job 4", "job 5", "job 6",
+                                             "job 7", "job 8"]))
+        self.assertEqual(statuses, {"job 4": "failed", "job 5": "queued",
+                                    "job 6": "running", "job 7": "failed",
+                                    "job 8": "succeeded"})
+        self.assertEqual(jobr.fetch_with_id("job 4")["result"]["status_code"],
+                         500)
+        self.assertEqual(engine.recover(), 0)
+
+    def test_unrecorded_result(self):
+        engine = JobEngine(1, "testhost:%d" % os.getppid())
+        # a result which can not be stored still ends the job
+        job_id = engine.submit("provision", lambda: {"status_code": 200,
+                                                     "retval": set()})
+        engine.close()
+        job = JobRepository().fetch_with_id(job_id)
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["result"]["status_code"], 500)
+
+    def test_public_catalog(self):
+        pr = ProjectRepository()
+        pr.insert("catalog", "network 1")
+        pid = pr.fetch_id_with_name("catalog")
+
+        imgr = ImageRepository()
+        for i in range(5):
+            imgr.insert("public " + str(i), pid, True)
+        imgr.insert("private", pid)
+
+        names = [image['image_name']
+                 for image in imgr.fetch_names_with_public()]
+        self.assertEqual(names, ["public " + str(i) for i in range(5)])
+
+        page = imgr.fetch_names_with_public(limit=2, offset=2)
+        self.assertEqual([image['image_name'] for image in page],
+                         ["public 2", "public 3"])
+
+        # batches smaller than the catalog should still yield everything once
+        streamed = list(imgr.iter_names_with_public(batch_size=2))
+        self.assertEqual([image['image_name'] for image in streamed], names)
+        self.assertEqual(streamed[0]['project_name'], "catalog")
+
+        pr.delete_with_name("catalog")
+        self.assertEqual(imgr.fetch_names_with_public(), [])
+
+    def test_bulk(self):
+        pr = ProjectRepository()
+        conflicts = pr.insert_many([("bulk 1", "network 1"),
+                                    ("bulk 2", "network 2"),
+                                    ("bulk 1", "network 3")], chunk_size=2)
+        self.assertEqual(conflicts, [("bulk 1", "network 3")])
+        pid = pr.fetch_id_with_name("bulk 1")
+        self.assertIsNotNone(pid)
+
+        # a taken id is only found by the database, the other rows still go in
+        conflicts = pr.insert_many([("bulk 3", "network 1", pid),
+                                    ("bulk 4", "network 1")])
+        self.assertEqual(conflicts, [("bulk 3", "network 1", pid)])
+        self.assertIsNotNone(pr.fetch_id_with_name("bulk 4"))
+        pr.delete_with_name("bulk 4")
+
+        imgr = ImageRepository()
+        images = [("bulk image " + str(i), pid) for i in range(7)]
+        self.assertEqual(imgr.insert_many(images, chunk_size=3), [])
+
+        # existing names and duplicates within the input are reported
+        conflicts = imgr.insert_many([("bulk image 0", pid),
+                                      ("bulk image 7", pid, True),
+                                      ("bulk image 7", pid)], chunk_size=2)
+        self.assertEqual(conflicts, [("bulk image 0", pid),
+                                     ("bulk image 7", pid)])
+        self.assertEqual(len(imgr.fetch_names_from_project("bulk 1")), 8)
+        self.assertIsNotNone(
+            imgr.fetch_id_with_name_from_project("bulk image 7", "bulk 1"))
+
+        deleted = imgr.delete_many_with_names_from_project(
+            ["bulk image 0", "bulk image 1", "missing"], "bulk 1",
+            chunk_size=2)
+        self.assertEqual(deleted, 2)
+        self.assertIsNone(
+            imgr.fetch_id_with_name_from_project("bulk image 0", "bulk 1"))
+
+        self.assertEqual(pr.delete_many_with_names(["bulk 1", "bulk 2"]), 2)
+        self.assertIsNone(pr.fetch_id_with_name("bulk 1"))
+        self.assertEqual(imgr.fetch_names_from_project("bulk 1"), [])
+
+    def test_reconcile_queries(self):
+        pr = ProjectRepository()
+        pr.insert("reconcile 1", "network 1")
+        pid = pr.fetch_id_with_name("reconcile 1")
+
+        imgr = ImageRepository()
+        imgr.insert_many([("reconcile image " + str(i), pid) for i in range(5)])
+        ids = [img_id for img_id, name in imgr.iter_ids(batch_size=2)
+               if name.startswith("reconcile image")]
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(imgr.fetch_existing_ids(ids + [-1]), set(ids))
+        self.assertEqual(imgr.delete_with_ids(ids[:2]), 2)
+        self.assertEqual(imgr.fetch_existing_ids(ids), set(ids[2:]))
+
+        cloner = CloneRepository()
+        cloner.insert("cisco-27", "reconcile image 2", "snap")
+        cloner.insert("cisco-28", "reconcile image 2", "snap")
+        self.assertEqual(cloner.fetch_with_name("cisco-27")["parent_snap"],
+                         "snap")
+        self.assertIsNone(cloner.fetch_with_name("cisco-29"))
+        self.assertEqual(cloner.fetch_existing_names(["cisco-27", "cisco-29"]),
+                         {"cisco-27"})
+        self.assertEqual(list(cloner.iter_names(batch_size=1)),
+                         ["cisco-27", "cisco-28"])
+
+        cloner.insert("bmi-warm-1", "reconcile image 2", "snap")
+        self.assertEqual(cloner.fetch_names_with_parent(
+            "reconcile image 2", "snap", "bmi-warm-"), ["bmi-warm-1"])
+        self.assertTrue(cloner.rename("bmi-warm-1", "cisco-29"))
+        self.assertFalse(cloner.rename("bmi-warm-1", "cisco-30"))
+        self.assertEqual(cloner.fetch_names_with_parent(
+            "reconcile image 2", "snap"), ["cisco-27", "cisco-28", "cisco-29"])
+        cloner.delete_with_names(["cisco-29"])
+
+        # clones older than a cutoff are flattened once
+        week_ago = datetime.datetime.utcnow() - datetime.timedelta(days=7)
+        cloner.insert("bmi-warm-2", "reconcile image 2", "snap", week_ago)
+        cloner.insert("cisco-31", "reconcile image 2", "snap", week_ago)
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        old = cloner.fetch_unflattened_before(cutoff,
+                                              exclude_prefix="bmi-warm-")
+        self.assertEqual([clone["name"] for clone in old], ["cisco-31"])
+        cloner.mark_flattened("cisco-31")
+        self.assertIsNotNone(cloner.fetch_with_name("cisco-31")["flattened_at"])
+        self.assertEqual(cloner.fetch_unflattened_before(
+            cutoff, exclude_prefix="bmi-warm-"), [])
+        # a claimed warm clone counts as created when it is claimed
+        self.assertTrue(cloner.rename("bmi-warm-2", "cisco-32"))
+        self.assertEqual(cloner.fetch_unflattened_before(cutoff), [])
+        cloner.delete_with_names(["cisco-32", "cisco-31"])
+
+        self.assertEqual(cloner.delete_with_names(["cisco-27", "cisco-28"]), 2)
+
+        pr.delete_with_name("reconcile 1")
+
+    def test_saga_steps(self):
+        sr = SagaRepository()
+        sr.insert("provision:cisco-40", "attach_network")
+        sr.insert("provision:cisco-40", "clone")
+        # a step recorded twice is kept once
+        sr.insert("provision:cisco-40", "clone")
+        sr.insert("provision:cisco-41", "attach_network")
+        self.assertEqual(sr.fetch_steps("provision:cisco-40"),
+                         {"attach_network", "clone"})
+        self.assertEqual(sr.fetch_steps_with_sagas(
+            ["provision:cisco-40", "provision:cisco-41",
+             "provision:cisco-42"], chunk_size=2),
+            {"provision:cisco-40": {"attach_network", "clone"},
+             "provision:cisco-41": {"attach_network"}})
+        sr.delete_step("provision:cisco-40", "clone")
+        self.assertEqual(sr.fetch_steps("provision:cisco-40"),
+                         {"attach_network"})
+
+        # a retry skips the steps which are done and undoes them all
+        calls = []
+        saga = Saga("provision:cisco-40")
+        saga.step("attach_network", lambda: calls.append("attach"),
+                  lambda: calls.append("detach"))
+        saga.step("clone", lambda: calls.append("clone"),
+                  lambda: calls.append("remove"))
+        self.assertEqual(calls, ["clone"])
+        self.assertIsNone(saga.compensate())
+        self.assertEqual(calls, ["clone", "remove", "detach"])
+        self.assertEqual(sr.fetch_steps("provision:cisco-40"), set())
+
+        # a failed compensation keeps its step and the ones before it
+        def fail():
+            raise db_exceptions.ORMException("down")
+
+        saga = Saga("provision:cisco-41", {"attach_network"})
+        saga.step("attach_network", lambda: None)
+        saga.step("clone", lambda: None, fail)
+        self.assertIsInstance(saga.compensate(), db_exceptions.ORMException)
+        self.assertEqual(sr.fetch_steps("provision:cisco-41"),
+                         {"attach_network", "clone", "clone:started"})
+
+        # only a step an earlier attempt started may be adopted
+        def interrupt():
+            raise db_exceptions.ORMException("cut off")
+
+        saga = Saga("provision:cisco-41")
+        self.assertTrue(saga.started_before("clone"))
+        self.assertFalse(saga.started_before("add_target"))
+        self.assertRaises(db_exceptions.ORMException, saga.step,
+                          "add_target", interrupt)
+        self.assertFalse(saga.started_before("add_target"))
+        self.assertTrue(Saga("provision:cisco-41").started_before(
+            "add_target"))
+        saga.finish()
+        self.assertEqual(sr.delete_with_sagas(["provision:cisco-41"]), 0)
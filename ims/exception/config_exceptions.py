@@ -11,3 +11,17 @@ class MissingOptionInConfigException(ConfigException):
 
     def __str__(self):
         return "Missing " + self.option + " option in bmi config file"
+
+
+class InvalidOptionInConfigException(ConfigException):
+    @property
+    def status_code(self):
+        return 500
+
+    def __init__(self, option, value):
+        self.option = option
+        self.value = value
+
+    def __str__(self):
+        return "Invalid value " + self.value + " for " + self.option + \
+               " in bmi config file"
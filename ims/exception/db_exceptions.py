@@ -27,6 +27,53 @@ class ImageNotFoundException(DBException):
         return self.name + " not found"
 
 
+# this exception should be raised when a job is not found in the db
+class JobNotFoundException(DBException):
+    @property
+    def status_code(self):
+        return 404
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def __str__(self):
+        return "Job " + self.job_id + " not found"
+
+
+# this exception should be raised when a unique index can not be created
+# because rows of the table already share its columns
+# duplicates is a list of the values of the columns which are taken twice
+class DuplicateRowsException(DBException):
+    @property
+    def status_code(self):
+        return 500
+
+    def __init__(self, table, columns, duplicates):
+        self.table = table
+        self.columns = columns
+        self.duplicates = duplicates
+
+    def __str__(self):
+        return "Rows of " + self.table + " share (" + \
+               ", ".join(self.columns) + "), remove the duplicates " + \
+               ", ".join(str(tuple(d)) for d in self.duplicates) + \
+               " and upgrade again"
+
+
+# this exception should be raised when an operation on a node has to wait for
+# the saga of another operation on it, which did not finish, to be retried
+class UnfinishedSagaException(DBException):
+    @property
+    def status_code(self):
+        return 409
+
+    def __init__(self, saga):
+        self.saga = saga
+
+    def __str__(self):
+        return self.saga + " did not finish, retry it first"
+
+
 # this class is a wrapper for any orm specific exception like sqlalchemy
 class ORMException(DBException):
     @property
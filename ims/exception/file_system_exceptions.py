@@ -98,6 +98,20 @@ class ArgumentsOutOfRangeException(FileSystemException):
         return "Arguments are Out of Range"
 
 
+# this exception should be raised when the image features asked for can not be used
+class InvalidFeaturesException(FileSystemException):
+    @property
+    def status_code(self):
+        return 478
+
+    def __init__(self, features, reason):
+        self.features = features
+        self.reason = reason
+
+    def __str__(self):
+        return "Invalid image features " + self.features + ": " + self.reason
+
+
 # this exception should be raised when the config file passed is invalid
 class InvalidConfigArgumentException(FileSystemException):
     @property
@@ -124,6 +138,20 @@ class MissingConfigArgumentException(FileSystemException):
         return self.arg + " is incorrect in config file"
 
 
+# this exception should be raised when copying data between an image and a local file fails
+class TransferException(FileSystemException):
+    @property
+    def status_code(self):
+        return 500
+
+    def __init__(self, name, reason):
+        self.name = name
+        self.reason = reason
+
+    def __str__(self):
+        return "Transfer of " + self.name + " failed: " + self.reason
+
+
 # this exception class is the abstract class for any ceph specific exceptions
 class CephFileSystemException(FileSystemException):
     __metaclass__ = ABCMeta
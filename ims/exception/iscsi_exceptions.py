@@ -1,7 +1,7 @@
 from exception import ISCSIException
 
 
-# this exception should be raised when the shell script is called on a node that is already in use
+# this exception should be raised when the iscsi target manager is used for a node that is already in use
 class NodeAlreadyInUseException(ISCSIException):
     @property
     def status_code(self):
@@ -11,7 +11,7 @@ class NodeAlreadyInUseException(ISCSIException):
         return "Node Already in Use"
 
 
-# this exception should be raised when the shell script is called on a node that is already unmapped
+# this exception should be raised when the iscsi target manager is used for a node that is already unmapped
 class NodeAlreadyUnmappedException(ISCSIException):
     @property
     def status_code(self):
@@ -19,3 +19,44 @@ class NodeAlreadyUnmappedException(ISCSIException):
 
     def __str__(self):
         return "Node Already Unmapped"
+
+
+
+# this exception should be raised when a command run for updating iscsi fails
+class CommandFailedException(ISCSIException):
+    @property
+    def status_code(self):
+        return 500
+
+    def __init__(self, command, output):
+        self.command = command
+        self.output = output
+
+    def __str__(self):
+        return self.command + " failed with : " + self.output
+
+
+# this exception should be raised when the iscsi target config could not be read
+class ConfigReadException(ISCSIException):
+    @property
+    def status_code(self):
+        return 500
+
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return "Not able to read " + self.path
+
+
+# this exception should be raised when the iscsi target config could not be written
+class ConfigWriteException(ISCSIException):
+    @property
+    def status_code(self):
+        return 500
+
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return "Not able to write " + self.path
@@ -0,0 +1,197 @@
+import datetime
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import constants
+from ceph_wrapper import RBD
+from database import CloneRepository
+from exception import *
+
+
+# Paces work to at most rate units per second on average, 0 means no limit
+# Every caller reserves the time its work takes at the rate and waits until
+# the reservations before it are over
+class Throttle:
+    def __init__(self, rate, clock=time.time, sleep=time.sleep):
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.next_free = clock()
+
+    def acquire(self, amount):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = self.clock()
+            start = max(now, self.next_free)
+            self.next_free = start + float(amount) / self.rate
+        if start > now:
+            self.sleep(start - now)
+
+
+# Flattens clones which are older than min_age
+# A clone reads every block it has not written from its parent snapshot, so
+# long lived nodes keep hammering the objects of the golden image and the
+# snapshot can never be removed. Flattening copies those blocks into the
+# clone. It is heavy on the cluster, so only workers clones are flattened at a
+# time and the copying is paced to max_bytes_per_second.
+# Clones of the warm pool are left alone, they count as created when they are
+# claimed. A clone which fails is skipped for the next pass, twice as many
+# after every failure in a row, so that clones which can not be flattened,
+# like a record whose image is gone, do not take up every batch.
+class FlattenScheduler:
+    def __init__(self, fs_config, settings=None):
+        settings = settings or {}
+        try:
+            self.min_age = float(settings.get(
+                constants.FLATTEN_MIN_AGE_KEY,
+                constants.FLATTEN_DEFAULT_MIN_AGE))
+            self.workers = int(settings.get(
+                constants.FLATTEN_WORKERS_KEY,
+                constants.FLATTEN_DEFAULT_WORKERS))
+            self.batch_size = int(settings.get(
+                constants.FLATTEN_BATCH_SIZE_KEY,
+                constants.FLATTEN_DEFAULT_BATCH_SIZE))
+            self.interval = float(settings.get(
+                constants.FLATTEN_INTERVAL_KEY,
+                constants.FLATTEN_DEFAULT_INTERVAL))
+            max_bytes_per_second = float(settings.get(
+                constants.FLATTEN_MAX_BYTES_PER_SECOND_KEY,
+                constants.FLATTEN_DEFAULT_MAX_BYTES_PER_SECOND))
+        except ValueError as e:
+            raise config_exceptions.InvalidOptionInConfigException(
+                constants.FLATTEN_CONFIG_SECTION_NAME, str(e))
+        if self.workers < 1 or self.batch_size < 1:
+            raise config_exceptions.InvalidOptionInConfigException(
+                constants.FLATTEN_CONFIG_SECTION_NAME,
+                str(self.workers) + ' workers and batch size ' +
+                str(self.batch_size))
+
+        self.fs_config = fs_config
+        self.throttle = Throttle(max_bytes_per_second)
+        self.run_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.last_report = None
+        # name -> [failures in a row, passes left to skip it]
+        self.failures = {}
+
+    # Flattens up to batch_size of the oldest clones older than min_age
+    # Returns the names of the flattened clones, the failures and the
+    # snapshots which have no clones left and can be removed now
+    def run(self):
+        with self.run_lock:
+            cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+                seconds=self.min_age)
+            skipped = set(name for name, (_, passes) in self.failures.items()
+                          if passes > 0)
+            clones = CloneRepository().fetch_unflattened_before(
+                cutoff, self.batch_size + len(skipped),
+                exclude_prefix=constants.WARM_POOL_CLONE_PREFIX)
+            self.__skip(skipped, clones)
+            clones = [clone for clone in clones
+                      if clone['name'] not in skipped][:self.batch_size]
+            report = {'flattened': [], 'failed': {},
+                      'removable_snapshots': []}
+            if clones:
+                pool = ThreadPool(min(self.workers, len(clones)))
+                try:
+                    outcomes = pool.map(self.__flatten, clones)
+                finally:
+                    pool.close()
+                    pool.join()
+                for clone, error in zip(clones, outcomes):
+                    if error is None:
+                        report['flattened'].append(clone['name'])
+                        self.failures.pop(clone['name'], None)
+                    else:
+                        report['failed'][clone['name']] = error
+                        failures = self.failures.get(clone['name'],
+                                                     [0, 0])[0] + 1
+                        self.failures[clone['name']] = [
+                            failures,
+                            min(2 ** (failures - 1),
+                                constants.FLATTEN_MAX_SKIPPED_PASSES)]
+                report['removable_snapshots'] = self.__removable(
+                    [clone for clone, error in zip(clones, outcomes)
+                     if error is None])
+            self.last_report = report
+            return report
+
+    # Counts a pass for the skipped clones and forgets the failures of clones
+    # which are not up for flattening anymore, like removed ones
+    def __skip(self, skipped, clones):
+        names = set(clone['name'] for clone in clones)
+        for name in self.failures.keys():
+            if name in skipped:
+                self.failures[name][1] -= 1
+            elif name not in names:
+                del self.failures[name]
+
+    # Returns None or the message of the failure
+    def __flatten(self, clone):
+        try:
+            with RBD(self.fs_config) as fs:
+                self.throttle.acquire(fs.image_size(clone['name']))
+                fs.flatten(clone['name'])
+            CloneRepository().mark_flattened(clone['name'])
+        except (FileSystemException, DBException) as e:
+            return str(e)
+
+    # Returns <image>@<snapshot> of the parents of the flattened clones which
+    # have no clones left
+    def __removable(self, flattened):
+        parents = sorted(set((clone['parent_name'], clone['parent_snap'])
+                             for clone in flattened))
+        removable = []
+        with RBD(self.fs_config) as fs:
+            for img_name, snap_name in parents:
+                try:
+                    if not fs.list_children(img_name, snap_name):
+                        removable.append(img_name + '@' + snap_name)
+                except file_system_exceptions.ImageNotFoundException:
+                    # removed already
+                    pass
+        return removable
+
+    # Runs a pass every interval seconds on a background thread
+    def start(self):
+        if self.interval <= 0 or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.__loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.run()
+            except (FileSystemException, DBException):
+                # tried again on the next pass
+                pass
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+# Returns the flatten scheduler of this process for the ceph config and the
+# settings, creating and starting it on first use, every config gets its own
+def get_scheduler(fs_config, settings):
+    key = (tuple(sorted(fs_config.items())),
+           tuple(sorted((settings or {}).items())))
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = FlattenScheduler(fs_config, settings)
+            scheduler.start()
+            _schedulers[key] = scheduler
+        return scheduler
@@ -1,10 +1,15 @@
+import hashlib
 import json
+import threading
 import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
 
 import constants
+from cache import TTLCache
 from exception import *
+from ims import metrics
 
 
 class HaaS:
@@ -22,19 +27,23 @@ class HaaS:
                  "auth": self.auth})
 
     class Communicator:
-        def __init__(self, url, request):
+        def __init__(self, url, request, session, timeout=None):
             self.url = url
             self.request = request
+            self.session = session
+            self.timeout = timeout
 
         def send_request(self):
             try:
                 if self.request.method == "get":
                     return self.resp_parse(
-                        requests.get(self.url, auth=self.request.auth))
+                        self.session.get(self.url, auth=self.request.auth,
+                                         timeout=self.timeout))
                 if self.request.method == "post":
                     return self.resp_parse(
-                        requests.post(self.url, data=self.request.data,
-                                      auth=self.request.auth))
+                        self.session.post(self.url, data=self.request.data,
+                                          auth=self.request.auth,
+                                          timeout=self.timeout))
             except requests.RequestException:
                 raise haas_exceptions.ConnectionException()
 
@@ -56,33 +65,163 @@ class HaaS:
                                                        obj.json()[
                                                            constants.MESSAGE_KEY])
 
-    def __init__(self, base_url, usr, passwd):
+    # Sessions are shared by all the HaaS objects of the process so that
+    # connections to HaaS are kept alive and reused between requests
+    sessions = {}
+    sessions_lock = threading.Lock()
+
+    # Requests in flight to a HaaS are limited for the whole process, bulk
+    # operations would otherwise send one per node at once
+    # Keyed by (base_url, max_concurrency) like the sessions
+    limits = {}
+    limits_lock = threading.Lock()
+
+    # Project node lookups shared by all the HaaS objects of the process
+    # Keyed by (base_url, usr, password digest, project) so that a wrong
+    # password never gets the cached answer of the right one
+    # Failed lookups are cached as the exception they raised
+    project_cache = TTLCache(constants.HAAS_DEFAULT_CACHE_SIZE,
+                             constants.HAAS_DEFAULT_CACHE_TTL)
+
+    def __init__(self, base_url, usr, passwd,
+                 pool_size=constants.HAAS_DEFAULT_POOL_SIZE, timeout=None,
+                 cache_ttl=constants.HAAS_DEFAULT_CACHE_TTL,
+                 negative_cache_ttl=constants.HAAS_DEFAULT_NEGATIVE_CACHE_TTL,
+                 cache_size=constants.HAAS_DEFAULT_CACHE_SIZE,
+                 max_concurrency=constants.HAAS_DEFAULT_MAX_CONCURRENCY):
         self.base_url = base_url
         self.usr = usr
         self.passwd = passwd
+        self.timeout = timeout
+        self.session = HaaS.__get_session(base_url, pool_size)
+        self.limit = HaaS.__get_limit(base_url, max_concurrency)
+        self.cache_ttl = cache_ttl
+        self.negative_cache_ttl = negative_cache_ttl
+        self.credentials = hashlib.sha256(passwd or '').hexdigest()
+        HaaS.project_cache.resize(cache_size)
+
+    @staticmethod
+    def __get_session(base_url, pool_size):
+        key = (base_url, pool_size)
+        with HaaS.sessions_lock:
+            session = HaaS.sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                HaaS.sessions[key] = session
+            return session
+
+    # Returns the semaphore limiting the requests to base_url, None for no
+    # limit
+    @staticmethod
+    def __get_limit(base_url, max_concurrency):
+        if max_concurrency <= 0:
+            return None
+        key = (base_url, max_concurrency)
+        with HaaS.limits_lock:
+            limit = HaaS.limits.get(key)
+            if limit is None:
+                limit = threading.BoundedSemaphore(max_concurrency)
+                HaaS.limits[key] = limit
+            return limit
 
-    def __call_rest_api(self, api):
-        link = urlparse.urljoin(self.base_url, api)
+    # Returns the url of api under base_url, with or without a leading /
+    # urljoin would put an absolute path in place of the path of base_url
+    @staticmethod
+    def __link(base_url, api):
+        if not base_url.endswith('/'):
+            base_url += '/'
+        return urlparse.urljoin(base_url, api.lstrip('/'))
+
+    # endpoint is the name of the api the request is timed under, the path
+    # has node and project names in it
+    def __call_rest_api(self, api, endpoint):
         request = HaaS.Request('get', None, auth=(self.usr, self.passwd))
-        return HaaS.Communicator(link, request).send_request()
+        return self.__send(api, request, endpoint)
 
-    def __call_rest_api_with_body(self, api, body):
-        link = urlparse.urljoin(self.base_url, api)
+    def __call_rest_api_with_body(self, api, body, endpoint):
         request = HaaS.Request('post', body, auth=(self.usr, self.passwd))
-        return HaaS.Communicator(link, request).send_request()
+        return self.__send(api, request, endpoint)
+
+    # The time waiting for a free slot is not part of the request time
+    def __send(self, api, request, endpoint):
+        communicator = HaaS.Communicator(HaaS.__link(self.base_url, api),
+                                         request, self.session, self.timeout)
+        if self.limit is None:
+            with metrics.HAAS_REQUEST_SECONDS.time(endpoint=endpoint):
+                return communicator.send_request()
+        with self.limit:
+            with metrics.HAAS_REQUEST_SECONDS.time(endpoint=endpoint):
+                return communicator.send_request()
+
+    # Returns the nodes of the project from the cache if possible
+    # Authentication, authorization and not found failures are cached for
+    # negative_cache_ttl, other failures are not cached
+    def __cached_project_nodes(self, project):
+        key = (self.base_url, self.usr, self.credentials, project)
+        hit, value = HaaS.project_cache.lookup(key)
+        if hit:
+            if isinstance(value, HaaSException):
+                raise value
+            return value
+
+        api = '/project/' + project + '/nodes'
+        try:
+            value = self.__call_rest_api(api=api, endpoint='project_nodes')
+        except (haas_exceptions.AuthenticationFailedException,
+                haas_exceptions.AuthorizationFailedException) as e:
+            HaaS.project_cache.put(key, e, self.negative_cache_ttl)
+            raise
+        except haas_exceptions.UnknownException as e:
+            if e.haas_status_code == 404:
+                HaaS.project_cache.put(key, e, self.negative_cache_ttl)
+            raise
+        HaaS.project_cache.put(key, value, self.cache_ttl)
+        return value
+
+    # Forgets the cached lookups of the project for every user
+    def invalidate_project(self, project):
+        HaaS.project_cache.invalidate_if(
+            lambda key, value: key[0] == self.base_url and key[3] == project)
+
+    # Forgets the cached lookups of every project the node was seen in
+    def invalidate_node(self, node):
+        def has_node(key, value):
+            return key[0] == self.base_url and isinstance(value, dict) and \
+                   node in value.get(constants.RETURN_VALUE_KEY, [])
+
+        HaaS.project_cache.invalidate_if(has_node)
 
     def list_free_nodes(self):
         api = 'free_nodes'
-        return self.__call_rest_api(api=api)
+        return self.__call_rest_api(api=api, endpoint='free_nodes')
 
     def query_project_nodes(self, project):
-        api = '/project/' + project + '/nodes'
-        return self.__call_rest_api(api=api)
+        return self.__cached_project_nodes(project)
+
+    def show_node(self, node):
+        api = 'node/' + node
+        return self.__call_rest_api(api=api, endpoint='show_node')
+
+    # Returns whether the nic of node is connected to network, on any channel
+    def is_node_on_network(self, node, network, nic):
+        info = self.show_node(node).get(constants.RETURN_VALUE_KEY) or {}
+        for node_nic in info.get('nics', []):
+            if node_nic.get('label') == nic:
+                return network in node_nic.get('networks', {}).values()
+        return False
 
     def detach_node_from_project(self, project, node):
         api = 'project/' + project + '/detach_node'
         body = {"node": node}
-        return self.__call_rest_api_with_body(api=api, body=body)
+        try:
+            return self.__call_rest_api_with_body(
+                api=api, body=body, endpoint='detach_node')
+        finally:
+            self.invalidate_project(project)
 
     def attach_node_to_project_network(self, node,
                                        network,
@@ -90,19 +229,30 @@ class HaaS:
                                        nic):
         api = '/node/' + node + '/nic/' + nic + '/connect_network'
         body = {"network": network, "channel": channel}
-        return self.__call_rest_api_with_body(api=api, body=body)
+        try:
+            return self.__call_rest_api_with_body(
+                api=api, body=body, endpoint='connect_network')
+        finally:
+            self.invalidate_node(node)
 
     def attach_node_haas_project(self, project, node):
         api = 'project/' + project + '/connect_node'
         body = {"node": node}
-        return self.__call_rest_api_with_body(api=api, body=body)
+        try:
+            return self.__call_rest_api_with_body(
+                api=api, body=body, endpoint='connect_node')
+        finally:
+            self.invalidate_project(project)
 
     def detach_node_from_project_network(self, node,
                                          network, nic):
         api = '/node/' + node + '/nic/' + nic + '/detach_network'
         body = {"network": network}
-        return self.__call_rest_api_with_body(api=api, body=body)
+        try:
+            return self.__call_rest_api_with_body(
+                api=api, body=body, endpoint='detach_network')
+        finally:
+            self.invalidate_node(node)
 
     def validate_project(self, project):
-        api = '/project/' + project + '/nodes'
-        return self.__call_rest_api(api=api)
+        return self.__cached_project_nodes(project)
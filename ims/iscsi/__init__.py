@@ -0,0 +1,5 @@
+# Added here so that single import can be used whenever this package is used
+from ims.iscsi.iet_admin import CommandRunner, IETAdmin
+from ims.iscsi.ietd_config import IETDConfig, Target
+from ims.iscsi.rbd_mapper import RBDMapper
+from ims.iscsi.target_manager import ISCSITargetManager, TargetUpdate
@@ -0,0 +1,153 @@
+import os
+import subprocess
+
+from ims.exception import *
+
+
+# Runs privileged commands
+# If we are not root the command is run through sudo with the password
+# given in the bmi config passed on stdin
+class CommandRunner:
+    def __init__(self, password=None):
+        self.password = password
+
+    def run(self, *args):
+        return self.__run(args)
+
+    # Runs the command with data on its stdin
+    # sudo is made to always ask for the password so that it never ends up
+    # in the data
+    def run_with_input(self, data, *args):
+        return self.__run(args, data)
+
+    def __run(self, args, data=None):
+        arglist = list(args)
+        stdin = data
+        if os.geteuid() != 0:
+            arglist = ['sudo', '-S', '-p', ''] + arglist
+            if self.password is not None:
+                if data is not None:
+                    arglist.insert(1, '-k')
+                stdin = self.password + '\n' + (data or '')
+        try:
+            proc = subprocess.Popen(arglist, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+        except OSError as e:
+            raise iscsi_exceptions.CommandFailedException(arglist[0],
+                                                          e.strerror)
+        out, err = proc.communicate(stdin)
+        if proc.returncode != 0:
+            raise iscsi_exceptions.CommandFailedException(
+                ' '.join(args[:3]), err.strip() or out.strip())
+        return out
+
+    # Writes data to a root owned file like the control files in sysfs
+    def write_as_root(self, path, data):
+        if os.geteuid() != 0:
+            self.run_with_input(data, 'tee', path)
+            return
+        try:
+            with open(path, 'w') as f:
+                f.write(data)
+        except IOError as e:
+            raise iscsi_exceptions.CommandFailedException('write ' + path,
+                                                          e.strerror)
+
+    # Returns the contents of a root owned file like ietd.conf
+    def read_as_root(self, path):
+        if os.geteuid() != 0:
+            return self.run('cat', path)
+        try:
+            with open(path) as f:
+                return f.read()
+        except IOError as e:
+            raise iscsi_exceptions.CommandFailedException('read ' + path,
+                                                          e.strerror)
+
+    # Moves src over dest as root, used for writing root owned files
+    def move_as_root(self, src, dest):
+        tmp_dest = dest + '.bmi-new'
+        self.run('install', '-m', '600', '-o', 'root', '-g', 'root', src,
+                 tmp_dest)
+        self.run('mv', '-f', tmp_dest, dest)
+
+
+# This class talks to the running IET target daemon through ietadm and the
+# /proc/net/iet interface so that single targets can be added and removed
+# without restarting the iscsitarget service
+class IETAdmin:
+    def __init__(self, runner, proc_dir='/proc/net/iet'):
+        self.runner = runner
+        self.proc_dir = proc_dir
+
+    def __read_proc(self, name):
+        path = os.path.join(self.proc_dir, name)
+        try:
+            with open(path) as f:
+                return f.read()
+        except IOError:
+            raise iscsi_exceptions.CommandFailedException(
+                'read ' + path, 'IET is not running')
+
+    # Parses /proc/net/iet/volume
+    # Returns a dict from target name to tid
+    def list_targets(self):
+        return parse_volumes(self.__read_proc('volume'))
+
+    # Parses /proc/net/iet/session
+    # Returns a list of (sid, cid) for the sessions of the given tid
+    def list_connections(self, tid):
+        return parse_sessions(self.__read_proc('session')).get(tid, [])
+
+    def next_tid(self, reserved=()):
+        tids = set(self.list_targets().values()) | set(reserved)
+        return max(tids) + 1 if tids else 1
+
+    def add_target(self, tid, name, path):
+        self.runner.run('ietadm', '--op', 'new', '--tid=' + str(tid),
+                        '--params', 'Name=' + name)
+        try:
+            self.runner.run('ietadm', '--op', 'new', '--tid=' + str(tid),
+                            '--lun=0', '--params',
+                            'Path=' + path +
+                            ',Type=blockio,ScsiId=lun0,ScsiSN=lun0')
+        except ISCSIException:
+            self.delete_target(tid)
+            raise
+
+    # Closes the connections to the target before deleting it
+    # IET refuses to delete a target which still has sessions
+    def delete_target(self, tid):
+        for sid, cid in self.list_connections(tid):
+            self.runner.run('ietadm', '--op', 'delete', '--tid=' + str(tid),
+                            '--sid=' + sid, '--cid=' + cid)
+        self.runner.run('ietadm', '--op', 'delete', '--tid=' + str(tid))
+
+
+# Returns a dict from target name to tid for the contents of
+# /proc/net/iet/volume, target lines look like 'tid:1 name:iqn.2015.node'
+def parse_volumes(text):
+    targets = {}
+    for line in text.splitlines():
+        fields = dict(f.split(':', 1) for f in line.split() if ':' in f)
+        if 'tid' in fields and 'name' in fields:
+            targets[fields['name']] = int(fields['tid'])
+    return targets
+
+
+# Returns a dict from tid to a list of (sid, cid) for the contents of
+# /proc/net/iet/session
+def parse_sessions(text):
+    sessions = {}
+    tid = sid = None
+    for line in text.splitlines():
+        fields = dict(f.split(':', 1) for f in line.split() if ':' in f)
+        if 'tid' in fields:
+            tid = int(fields['tid'])
+            sessions.setdefault(tid, [])
+        elif 'sid' in fields:
+            sid = fields['sid']
+        elif 'cid' in fields and tid is not None and sid is not None:
+            sessions[tid].append((sid, fields['cid']))
+    return sessions
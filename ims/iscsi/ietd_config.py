@@ -0,0 +1,127 @@
+import os
+import tempfile
+from collections import OrderedDict
+
+from ims.exception import *
+
+
+# This class represents a single target section of ietd.conf
+# lines are the raw lines of the section after the Target line
+class Target:
+    def __init__(self, name, lines=None):
+        self.name = name
+        self.lines = lines if lines is not None else []
+
+    def __repr__(self):
+        return str([self.name, self.lines])
+
+    # Creates a target exporting the given block device as lun 0
+    @staticmethod
+    def with_block_device(name, path):
+        return Target(name, ['        Lun 0 Path=' + path +
+                             ',Type=blockio,ScsiId=lun0,ScsiSN=lun0'])
+
+    # Returns the Path of every lun of this target
+    def lun_paths(self):
+        paths = []
+        for line in self.lines:
+            parts = line.split()
+            if len(parts) < 3 or parts[0] != 'Lun':
+                continue
+            for param in parts[2].split(','):
+                if param.startswith('Path='):
+                    paths.append(param[len('Path='):])
+        return paths
+
+    def to_lines(self):
+        return ['Target ' + self.name] + self.lines
+
+
+# This class models ietd.conf in memory
+# Global lines before the first target are kept as they are and targets are
+# kept in the order they appear so that the file is rewritten faithfully
+class IETDConfig:
+    def __init__(self, path):
+        self.path = path
+        self.header = []
+        self.targets = OrderedDict()
+
+    # save writes the file readable by root only, read_privileged is used
+    # when we are not allowed to read it ourselves, it is called with path
+    # and must return its contents
+    @staticmethod
+    def load(path, read_privileged=None):
+        config = IETDConfig(path)
+        if not os.path.exists(path):
+            return config
+        try:
+            if read_privileged is not None and not os.access(path, os.R_OK):
+                config.parse(read_privileged(path))
+            else:
+                with open(path) as f:
+                    config.parse(f.read())
+        except EnvironmentError:
+            raise iscsi_exceptions.ConfigReadException(path)
+        return config
+
+    def parse(self, text):
+        self.header = []
+        self.targets = OrderedDict()
+        current = None
+        for line in text.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[0] == 'Target':
+                current = Target(parts[1])
+                self.targets[current.name] = current
+            elif current is None:
+                self.header.append(line)
+            else:
+                current.lines.append(line)
+
+    def serialize(self):
+        lines = list(self.header)
+        for target in self.targets.values():
+            lines.extend(target.to_lines())
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def has_target(self, name):
+        return name in self.targets
+
+    def get_target(self, name):
+        return self.targets.get(name)
+
+    def add_target(self, target):
+        if target.name in self.targets:
+            raise iscsi_exceptions.NodeAlreadyInUseException()
+        self.targets[target.name] = target
+
+    def remove_target(self, name):
+        if name not in self.targets:
+            raise iscsi_exceptions.NodeAlreadyUnmappedException()
+        return self.targets.pop(name)
+
+    # Writes the config to a temporary file in the same directory and renames
+    # it over the old one so that readers never see a half written file
+    # write_privileged is used when we are not allowed to write the directory
+    # ourselves, it is called with (tmp_path, path) and must move tmp_path
+    # over path
+    def save(self, write_privileged=None):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        in_place = os.access(directory, os.W_OK)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=directory if in_place else None, prefix='.ietd.conf.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.serialize())
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o600)
+            if in_place:
+                os.rename(tmp_path, self.path)
+            elif write_privileged is not None:
+                write_privileged(tmp_path, self.path)
+            else:
+                raise iscsi_exceptions.ConfigWriteException(self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
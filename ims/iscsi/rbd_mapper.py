@@ -0,0 +1,271 @@
+import json
+import os
+import re
+import socket
+import threading
+
+from ims import constants
+from ims import metrics
+from ims.exception import *
+
+# the port of the messenger the kernel client speaks
+MON_DEFAULT_PORT = 6789
+# current_snap of a device which maps the image itself
+NO_SNAP = '-'
+
+
+# Maps rbd images to kernel block devices through the rbd sysfs interface,
+# so no rbd cli process is spawned for a node
+# The device of every mapped image is kept in an index keyed by
+# <pool>/<image>, a lookup never matches cisco-2 against cisco-27. The index is
+# rebuilt from sysfs when the mapper is created and is saved to state_file for
+# the other BMI processes of the host. Every entry is checked against sysfs
+# before it is used, so a stale or foreign state file can not make us unmap
+# the wrong device.
+class RBDMapper:
+    def __init__(self, runner, ceph_config, sysfs_dir, state_file):
+        self.runner = runner
+        self.ceph_config = ceph_config
+        self.sysfs_dir = sysfs_dir
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.index = {}
+        self.options = None
+        self.mon_addrs = None
+        with self.lock:
+            self.__rebuild()
+
+    def __key(self, image):
+        return self.ceph_config[constants.CEPH_POOL_KEY] + '/' + image
+
+    @staticmethod
+    def device_path(dev_id):
+        return '/dev/rbd' + dev_id
+
+    def __devices_dir(self):
+        return os.path.join(self.sysfs_dir, 'devices')
+
+    def __read_attr(self, dev_id, attr):
+        try:
+            with open(os.path.join(self.__devices_dir(), dev_id, attr)) as f:
+                return f.read().strip()
+        except IOError:
+            return None
+
+    def __list_devices(self):
+        try:
+            return set(os.listdir(self.__devices_dir()))
+        except OSError:
+            return set()
+
+    # Returns <pool>/<image> of the device or None if it does not map the
+    # image itself
+    def __mapped_key(self, dev_id):
+        pool = self.__read_attr(dev_id, 'pool')
+        name = self.__read_attr(dev_id, 'name')
+        if pool is None or name is None or \
+                self.__read_attr(dev_id, 'current_snap') not in (None,
+                                                                 NO_SNAP):
+            return None
+        return pool + '/' + name
+
+    def __rebuild(self):
+        index = {}
+        for dev_id in sorted(self.__list_devices(), key=int):
+            key = self.__mapped_key(dev_id)
+            if key is not None:
+                index.setdefault(key, dev_id)
+        self.index = index
+        self.__save()
+
+    def __load(self):
+        try:
+            with open(self.state_file) as f:
+                self.index.update(json.load(f))
+        except (IOError, ValueError):
+            pass
+
+    # The index can always be rebuilt from sysfs, so it is fine to not have
+    # a state file
+    def __save(self):
+        tmp = self.state_file + '.' + str(os.getpid())
+        try:
+            directory = os.path.dirname(self.state_file)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(tmp, 'w') as f:
+                json.dump(self.index, f)
+            os.rename(tmp, self.state_file)
+        except (IOError, OSError):
+            pass
+
+    def __find(self, key):
+        dev_id = self.index.get(key)
+        if isinstance(dev_id, basestring) and \
+                self.__mapped_key(dev_id) == key:
+            return dev_id
+        return None
+
+    # Returns the id of the device of the image, trying our index, the one
+    # of the other processes and sysfs in turn
+    # sysfs is left out unless rebuild is set
+    def __lookup(self, key, rebuild=True):
+        refreshes = [lambda: None, self.__load]
+        if rebuild:
+            refreshes.append(self.__rebuild)
+        for refresh in refreshes:
+            refresh()
+            dev_id = self.__find(key)
+            if dev_id is not None:
+                return dev_id
+        return None
+
+    # Returns the device the image is mapped to or None
+    def lookup(self, image):
+        with self.lock:
+            dev_id = self.__lookup(self.__key(image))
+        return self.device_path(dev_id) if dev_id is not None else None
+
+    # Maps the image and returns its device, an image which is mapped already
+    # keeps its device
+    # Images are mapped through BMI, so one which neither index knows is new
+    # and sysfs is not scanned for it
+    @metrics.ISCSI_SECONDS.time(operation='map')
+    def map(self, image):
+        key = self.__key(image)
+        with self.lock:
+            dev_id = self.__lookup(key, rebuild=False)
+            if dev_id is None:
+                before = self.__list_devices()
+                self.runner.write_as_root(
+                    self.__control_file('add'),
+                    ' '.join([self.__mon_addrs(), self.__options(),
+                              self.ceph_config[constants.CEPH_POOL_KEY],
+                              image, NO_SNAP]))
+                # another process may have mapped something at the same time
+                for new_id in self.__list_devices() - before:
+                    if self.__mapped_key(new_id) == key:
+                        dev_id = new_id
+                        break
+                if dev_id is None:
+                    raise iscsi_exceptions.CommandFailedException(
+                        'rbd map ' + key, 'no device showed up in ' +
+                                          self.__devices_dir())
+                self.index[key] = dev_id
+                self.__save()
+        return self.device_path(dev_id)
+
+    # Unmaps the image and returns the device it had, None if it was not
+    # mapped
+    @metrics.ISCSI_SECONDS.time(operation='unmap')
+    def unmap(self, image):
+        key = self.__key(image)
+        with self.lock:
+            dev_id = self.__lookup(key)
+            if dev_id is None:
+                return None
+            self.runner.write_as_root(self.__control_file('remove'), dev_id)
+            del self.index[key]
+            self.__save()
+        return self.device_path(dev_id)
+
+    # The single major interface is used when the rbd module offers it
+    def __control_file(self, operation):
+        path = os.path.join(self.sysfs_dir, operation + '_single_major')
+        if os.path.exists(path):
+            return path
+        path = os.path.join(self.sysfs_dir, operation)
+        if not os.path.exists(path):
+            raise iscsi_exceptions.CommandFailedException(
+                'rbd ' + operation, 'the rbd kernel module is not loaded')
+        return path
+
+    # The kernel wants the addresses of the monitors and the secret itself
+    # rather than the ceph config and keyring files
+    def __options(self):
+        if self.options is None:
+            rid = self.ceph_config[constants.CEPH_ID_KEY]
+            self.options = 'name=' + rid + ',secret=' + read_key(
+                self.ceph_config[constants.CEPH_KEY_RING_KEY], rid)
+        return self.options
+
+    def __mon_addrs(self):
+        if self.mon_addrs is None:
+            self.mon_addrs = ','.join(parse_mon_hosts(read_mon_hosts(
+                self.ceph_config[constants.CEPH_CONFIG_FILE_KEY])))
+        return self.mon_addrs
+
+
+# Returns the key of client.<rid> in the keyring file
+def read_key(keyring, rid):
+    section = None
+    try:
+        with open(keyring) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('['):
+                    section = line.strip('[]').strip()
+                elif section == 'client.' + rid and '=' in line:
+                    name, value = line.split('=', 1)
+                    if name.strip() == 'key':
+                        return value.strip()
+    except IOError as e:
+        raise iscsi_exceptions.CommandFailedException('read ' + keyring,
+                                                      e.strerror)
+    raise iscsi_exceptions.CommandFailedException(
+        'read ' + keyring, 'no key for client.' + rid)
+
+
+# Returns the value of mon host in the ceph config file
+# ceph.conf is not read with ConfigParser as its keys are usually indented
+def read_mon_hosts(conf_file):
+    try:
+        with open(conf_file) as f:
+            for line in f:
+                match = re.match(r'\s*mon[ _]host\s*=\s*(.*?)\s*$', line)
+                if match:
+                    return match.group(1)
+    except IOError as e:
+        raise iscsi_exceptions.CommandFailedException('read ' + conf_file,
+                                                      e.strerror)
+    raise iscsi_exceptions.CommandFailedException(
+        'read ' + conf_file, 'no mon host')
+
+
+# Returns ip:port of every monitor in a mon host value
+# Monitors are given as host, host:port or [v2:ip:port/nonce,v1:ip:port/nonce]
+# the kernel only speaks v1
+def parse_mon_hosts(value):
+    addrs = []
+    for entry in re.findall(r'\[[^\]]*\]|[^\s,;]+', value):
+        if entry.startswith('['):
+            versions = dict(addr.split(':', 1)
+                            for addr in entry.strip('[]').split(','))
+            if 'v1' not in versions:
+                continue
+            entry = versions['v1'].split('/')[0]
+        host, _, port = entry.rpartition(':')
+        if not host or not port.isdigit():
+            host, port = entry, str(MON_DEFAULT_PORT)
+        try:
+            addrs.append(socket.gethostbyname(host) + ':' + port)
+        except socket.error:
+            raise iscsi_exceptions.CommandFailedException(
+                'resolve ' + host, 'unknown monitor')
+    return addrs
+
+
+_mappers = {}
+_mappers_lock = threading.Lock()
+
+
+# Returns the mapper of this process for the sysfs_dir and state_file, the
+# index is rebuilt from sysfs when it is first used
+def get_mapper(runner, ceph_config, sysfs_dir, state_file):
+    key = (sysfs_dir, state_file, ceph_config[constants.CEPH_POOL_KEY])
+    with _mappers_lock:
+        mapper = _mappers.get(key)
+        if mapper is None:
+            mapper = RBDMapper(runner, ceph_config, sysfs_dir, state_file)
+            _mappers[key] = mapper
+        return mapper
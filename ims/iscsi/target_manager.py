@@ -0,0 +1,199 @@
+import threading
+from multiprocessing.pool import ThreadPool
+
+from ims import constants
+from ims import metrics
+from ims.exception import *
+from ims.iscsi.iet_admin import CommandRunner, IETAdmin
+from ims.iscsi.ietd_config import IETDConfig, Target
+from ims.iscsi.rbd_mapper import RBDMapper, get_mapper
+
+
+# The outcome of adding or removing the iscsi target of a single node
+# error is the ISCSIException which made the update fail, if any
+class TargetUpdate:
+    ADDED = 'added'
+    REMOVED = 'removed'
+    FAILED = 'failed'
+
+    def __init__(self, node_name, status, device=None, error=None):
+        self.node_name = node_name
+        self.status = status
+        self.device = device
+        self.error = error
+
+    def __repr__(self):
+        return str([self.node_name, self.status, self.device, self.error])
+
+    # Raises the error of a failed update, returns the update otherwise
+    def check(self):
+        if self.error is not None:
+            raise self.error
+        return self
+
+
+# This class manages the iscsi targets which export the rbd images of nodes
+# Targets are added and removed live through the IET control interface and
+# ietd.conf is updated with an atomic write so that the targets survive a
+# restart. Nothing here restarts the iscsitarget service, so the other
+# targets on the host are never dropped.
+class ISCSITargetManager:
+    # ietd.conf and the tids of the running daemon are shared by the whole
+    # host, so only one update is done at a time in this process
+    lock = threading.Lock()
+
+    # runner runs the privileged commands, a manager given its own runner
+    # gets its own rbd mapper instead of the one of the process
+    def __init__(self, config, runner=None):
+        self.config = config
+        ceph_config = config.fs[constants.CEPH_CONFIG_SECTION_NAME]
+        if runner is None:
+            self.runner = CommandRunner(config.iscsi_update_password)
+            self.mapper = get_mapper(self.runner, ceph_config,
+                                     config.iscsi_rbd_sysfs_dir,
+                                     config.iscsi_rbd_state_file)
+        else:
+            self.runner = runner
+            self.mapper = RBDMapper(runner, ceph_config,
+                                    config.iscsi_rbd_sysfs_dir,
+                                    config.iscsi_rbd_state_file)
+        self.admin = IETAdmin(self.runner, config.iscsi_proc_dir)
+
+    def target_name(self, node_name):
+        return self.config.iscsi_target_prefix + node_name
+
+    def __load(self):
+        return IETDConfig.load(self.config.iscsi_config_file,
+                               self.runner.read_as_root)
+
+    # Returns which of the nodes have a target in ietd.conf
+    def fetch_targeted(self, node_names):
+        ietd = self.__load()
+        return set(node_name for node_name in node_names
+                   if ietd.has_target(self.target_name(node_name)))
+
+    def add_target(self, node_name):
+        return self.add_targets([node_name])[node_name]
+
+    def remove_target(self, node_name):
+        return self.remove_targets([node_name])[node_name]
+
+    # Maps the rbd image of every node and exports it as a new target
+    # ietd.conf is written once for the whole batch
+    # Returns a dict from node name to TargetUpdate
+    @metrics.ISCSI_SECONDS.time(operation='add')
+    def add_targets(self, node_names):
+        results = {}
+        with ISCSITargetManager.lock:
+            ietd = self.__load()
+            added = []
+            # tids given out in this batch, in case the daemon is slow to
+            # show them in /proc
+            tids = []
+            for node_name in node_names:
+                name = self.target_name(node_name)
+                if ietd.has_target(name):
+                    results[node_name] = TargetUpdate(
+                        node_name, TargetUpdate.FAILED,
+                        error=iscsi_exceptions.NodeAlreadyInUseException())
+                    continue
+                try:
+                    device = self.mapper.map(node_name)
+                    try:
+                        tid = self.admin.next_tid(tids)
+                        self.admin.add_target(tid, name, device)
+                        tids.append(tid)
+                    except ISCSIException:
+                        self.mapper.unmap(node_name)
+                        raise
+                    ietd.add_target(Target.with_block_device(name, device))
+                    added.append((node_name, tid))
+                    results[node_name] = TargetUpdate(
+                        node_name, TargetUpdate.ADDED, device=device)
+                except ISCSIException as e:
+                    results[node_name] = TargetUpdate(
+                        node_name, TargetUpdate.FAILED, error=e)
+            if added:
+                try:
+                    ietd.save(self.runner.move_as_root)
+                except (ISCSIException, EnvironmentError) as e:
+                    # Targets missing from ietd.conf would be lost on a
+                    # restart, so the batch is taken down again
+                    self.__remove_live(added)
+                    if isinstance(e, ISCSIException):
+                        raise
+                    raise iscsi_exceptions.ConfigWriteException(
+                        self.config.iscsi_config_file)
+        return results
+
+    # Deletes the live targets with the given (node name, tid) and unmaps
+    # their images, as far as that goes
+    def __remove_live(self, targets):
+        for node_name, tid in targets:
+            try:
+                self.admin.delete_target(tid)
+                self.mapper.unmap(node_name)
+            except ISCSIException:
+                pass
+
+    # Removes the target of every node and unmaps its rbd image
+    # ietd.conf is written once for the whole batch and the images are
+    # unmapped by up to max_workers at a time
+    # If ietd.conf can not be written the nodes of the batch fail and their
+    # images stay mapped, as it still lists their targets a retry removes
+    # them from there
+    # Returns a dict from node name to TargetUpdate
+    @metrics.ISCSI_SECONDS.time(operation='remove')
+    def remove_targets(self, node_names, max_workers=1):
+        results = {}
+        with ISCSITargetManager.lock:
+            ietd = self.__load()
+            live = self.admin.list_targets()
+            removed = []
+            for node_name in node_names:
+                name = self.target_name(node_name)
+                target = ietd.get_target(name)
+                if target is None:
+                    results[node_name] = TargetUpdate(
+                        node_name, TargetUpdate.FAILED,
+                        error=iscsi_exceptions.NodeAlreadyUnmappedException())
+                    continue
+                try:
+                    if name in live:
+                        self.admin.delete_target(live[name])
+                    ietd.remove_target(name)
+                    removed.append(node_name)
+                except ISCSIException as e:
+                    results[node_name] = TargetUpdate(
+                        node_name, TargetUpdate.FAILED, error=e)
+            if removed:
+                try:
+                    ietd.save(self.runner.move_as_root)
+                except (ISCSIException, EnvironmentError) as e:
+                    if not isinstance(e, ISCSIException):
+                        e = iscsi_exceptions.ConfigWriteException(
+                            self.config.iscsi_config_file)
+                    results.update(
+                        (node_name, TargetUpdate(node_name,
+                                                 TargetUpdate.FAILED,
+                                                 error=e))
+                        for node_name in removed)
+                    removed = []
+
+        # Devices are released only after the targets using them are gone
+        if removed:
+            pool = ThreadPool(max(1, min(max_workers, len(removed))))
+            try:
+                updates = pool.map(metrics.bind(self.__unmap), removed)
+            finally:
+                pool.close()
+                pool.join()
+            results.update((update.node_name, update) for update in updates)
+        return results
+
+    def __unmap(self, node_name):
+        try:
+            return TargetUpdate(node_name, TargetUpdate.REMOVED,
+                                device=self.mapper.unmap(node_name))
+        except ISCSIException as e:
+            return TargetUpdate(node_name, TargetUpdate.FAILED, error=e)
@@ -0,0 +1,269 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ims.benchmark.fake_iscsi import FakeISCSIRunner
+from ims.config import BMIConfig
+from ims.exception import *
+from ims.iscsi.iet_admin import parse_sessions, parse_volumes
+from ims.iscsi.ietd_config import IETDConfig, Target
+from ims.iscsi.rbd_mapper import RBDMapper, parse_mon_hosts
+from ims.iscsi.target_manager import ISCSITargetManager, TargetUpdate
+
+IETD_CONF = """# global settings
+IncomingUser bmi secret
+Target iqn.2015.cisco-2
+        Lun 0 Path=/dev/rbd0,Type=blockio,ScsiId=lun0,ScsiSN=lun0
+Target iqn.2015.cisco-27
+        Lun 0 Path=/dev/rbd1,Type=blockio,ScsiId=lun0,ScsiSN=lun0
+        MaxConnections 1
+"""
+
+VOLUME = """tid:1 name:iqn.2015.cisco-2
+\tlun:0 state:0 iotype:blockio iomode:wt blocks:2097152 blocksize:512 path:/dev/rbd0
+tid:3 name:iqn.2015.cisco-27
+\tlun:0 state:0 iotype:blockio iomode:wt blocks:2097152 blocksize:512 path:/dev/rbd1
+"""
+
+SESSION = """tid:1 name:iqn.2015.cisco-2
+\tsid:562949974196736 initiator:iqn.1993-08.org.debian:01:cisco-2
+\t\tcid:0 ip:10.0.0.2 state:active hd:none dd:none
+tid:3 name:iqn.2015.cisco-27
+"""
+
+
+# Does what the rbd kernel module does on writes to its sysfs control files
+class FakeKernel:
+    def __init__(self, sysfs_dir):
+        self.sysfs_dir = sysfs_dir
+        self.writes = []
+        os.makedirs(os.path.join(sysfs_dir, 'devices'))
+        open(os.path.join(sysfs_dir, 'add'), 'w').close()
+        open(os.path.join(sysfs_dir, 'remove'), 'w').close()
+
+    def add_device(self, dev_id, pool, name, snap='-'):
+        path = os.path.join(self.sysfs_dir, 'devices', dev_id)
+        os.mkdir(path)
+        for attr, value in (('pool', pool), ('name', name),
+                            ('current_snap', snap)):
+            with open(os.path.join(path, attr), 'w') as f:
+                f.write(value + '\n')
+
+    def write_as_root(self, path, data):
+        self.writes.append((os.path.basename(path), data))
+        devices = os.path.join(self.sysfs_dir, 'devices')
+        if path.endswith('add'):
+            _, _, pool, name, snap = data.split()
+            ids = [int(dev_id) for dev_id in os.listdir(devices)]
+            self.add_device(str(max(ids) + 1 if ids else 0), pool, name, snap)
+        else:
+            shutil.rmtree(os.path.join(devices, data))
+
+
+# Tests for the in memory model of ietd.conf, the IET proc parsers, the
+# rbd device index and the target manager on a fake IET and rbd module
+class TestISCSI(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ietd.conf')
+        with open(self.path, 'w') as f:
+            f.write(IETD_CONF)
+        # the ceph files are kept out of the directory of ietd.conf
+        self.ceph_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.ceph_dir, 'ceph.conf'), 'w') as f:
+            f.write('[global]\n\tmon host = 127.0.0.1:6790, localhost\n')
+        with open(os.path.join(self.ceph_dir, 'keyring'), 'w') as f:
+            f.write('[client.bmi]\n\tkey = c2VjcmV0\n')
+        self.ceph_config = {
+            'id': 'bmi', 'pool': 'bmi',
+            'conf_file': os.path.join(self.ceph_dir, 'ceph.conf'),
+            'keyring': os.path.join(self.ceph_dir, 'keyring')}
+
+    # Returns a target manager on a fake IET and rbd module with an empty
+    # ietd.conf at config_file
+    def __manager(self, config_file):
+        config = BMIConfig()
+        config.fs['ceph'] = self.ceph_config
+        config.iscsi_config_file = config_file
+        config.iscsi_proc_dir = os.path.join(self.directory, 'proc')
+        config.iscsi_rbd_sysfs_dir = os.path.join(self.directory, 'sysfs')
+        config.iscsi_rbd_state_file = os.path.join(self.directory,
+                                                   'rbd.json')
+        runner = FakeISCSIRunner(config.iscsi_proc_dir,
+                                 config.iscsi_rbd_sysfs_dir)
+        return ISCSITargetManager(config, runner)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        shutil.rmtree(self.ceph_dir)
+
+    def test_ietd_config(self):
+        config = IETDConfig.load(self.path)
+        self.assertEqual(config.serialize(), IETD_CONF)
+        self.assertEqual(config.header,
+                         ['# global settings', 'IncomingUser bmi secret'])
+
+        # cisco-2 should not be matched by cisco-27
+        self.assertTrue(config.has_target('iqn.2015.cisco-2'))
+        self.assertFalse(config.has_target('iqn.2015.cisco'))
+        self.assertEqual(config.get_target('iqn.2015.cisco-27').lun_paths(),
+                         ['/dev/rbd1'])
+
+        with self.assertRaises(iscsi_exceptions.NodeAlreadyInUseException):
+            config.add_target(Target('iqn.2015.cisco-2'))
+
+        config.remove_target('iqn.2015.cisco-2')
+        with self.assertRaises(
+                iscsi_exceptions.NodeAlreadyUnmappedException):
+            config.remove_target('iqn.2015.cisco-2')
+
+        config.add_target(
+            Target.with_block_device('iqn.2015.cisco-3', '/dev/rbd2'))
+        config.save()
+
+        # the file should be replaced and no temporary files left behind
+        self.assertEqual(os.listdir(self.directory), ['ietd.conf'])
+        config = IETDConfig.load(self.path)
+        self.assertEqual(list(config.targets.keys()),
+                         ['iqn.2015.cisco-27', 'iqn.2015.cisco-3'])
+        self.assertEqual(config.get_target('iqn.2015.cisco-3').lun_paths(),
+                         ['/dev/rbd2'])
+        self.assertEqual(
+            config.get_target('iqn.2015.cisco-27').lines[-1].strip(),
+            'MaxConnections 1')
+
+    def test_proc_parsers(self):
+        self.assertEqual(parse_volumes(VOLUME), {'iqn.2015.cisco-2': 1,
+                                                 'iqn.2015.cisco-27': 3})
+        self.assertEqual(parse_sessions(SESSION),
+                         {1: [('562949974196736', '0')], 3: []})
+
+    def test_rbd_mapper(self):
+        kernel = FakeKernel(os.path.join(self.directory, 'rbd'))
+        kernel.add_device('0', 'bmi', 'cisco-27')
+        kernel.add_device('1', 'bmi', 'cisco-2', snap='golden')
+        kernel.add_device('2', 'other', 'cisco-2')
+        ceph_config = self.ceph_config
+        state_file = os.path.join(self.directory, 'state', 'rbd.json')
+        mapper = RBDMapper(kernel, ceph_config, kernel.sysfs_dir, state_file)
+
+        # the index is built from sysfs, snapshots and other pools left out
+        self.assertEqual(mapper.lookup('cisco-27'), '/dev/rbd0')
+        self.assertIsNone(mapper.lookup('cisco-2'))
+        self.assertEqual(mapper.map('cisco-2'), '/dev/rbd3')
+        self.assertEqual(kernel.writes, [
+            ('add', '127.0.0.1:6790,127.0.0.1:6789 name=bmi,secret=c2VjcmV0 '
+                    'bmi cisco-2 -')])
+        self.assertEqual(mapper.map('cisco-2'), '/dev/rbd3')
+        self.assertEqual(len(kernel.writes), 1)
+
+        # the monitors are resolved once
+        with open(self.ceph_config['conf_file'], 'w') as f:
+            f.write('[global]\n\tmon host = 127.0.0.2\n')
+        self.assertEqual(mapper.map('cisco-5'), '/dev/rbd4')
+        self.assertTrue(kernel.writes[-1][1].startswith('127.0.0.1:6790,'))
+        self.assertEqual(mapper.unmap('cisco-5'), '/dev/rbd4')
+
+        # a mapping made by another process is found through the state file
+        other = RBDMapper(kernel, ceph_config, kernel.sysfs_dir, state_file)
+        self.assertEqual(other.map('cisco-3'), '/dev/rbd4')
+        self.assertEqual(mapper.unmap('cisco-3'), '/dev/rbd4')
+        self.assertEqual(kernel.writes[-1], ('remove', '4'))
+        self.assertIsNone(mapper.unmap('cisco-3'))
+        self.assertEqual(mapper.unmap('cisco-2'), '/dev/rbd3')
+        self.assertEqual(sorted(os.listdir(os.path.join(kernel.sysfs_dir,
+                                                        'devices'))),
+                         ['0', '1', '2'])
+
+        self.assertEqual(parse_mon_hosts(
+            '[v2:10.0.0.1:3300/0,v1:10.0.0.1:6789/0] [v2:10.0.0.2:3300/0]'),
+            ['10.0.0.1:6789'])
+
+    def test_target_manager(self):
+        manager = self.__manager(os.path.join(self.directory, 'iet',
+                                              'ietd.conf'))
+        os.mkdir(os.path.join(self.directory, 'iet'))
+        updates = manager.add_targets(['cisco-27', 'cisco-28'])
+        self.assertEqual([updates[node].status for node in
+                          ('cisco-27', 'cisco-28')], [TargetUpdate.ADDED] * 2)
+        self.assertEqual(manager.admin.list_targets(),
+                         {'iqn.2015.cisco-27': 1, 'iqn.2015.cisco-28': 2})
+        with self.assertRaises(iscsi_exceptions.NodeAlreadyInUseException):
+            manager.add_target('cisco-27').check()
+
+        # a node without a target does not keep the others from going and
+        # the devices are unmapped concurrently
+        updates = manager.remove_targets(['cisco-27', 'cisco-28', 'cisco-29'],
+                                         max_workers=2)
+        self.assertEqual([updates[node].status for node in
+                          ('cisco-27', 'cisco-28', 'cisco-29')],
+                         [TargetUpdate.REMOVED, TargetUpdate.REMOVED,
+                          TargetUpdate.FAILED])
+        self.assertIsInstance(updates['cisco-29'].error,
+                              iscsi_exceptions.NodeAlreadyUnmappedException)
+        self.assertEqual(sorted(update.device for update in updates.values()
+                                if update.device is not None),
+                         ['/dev/rbd0', '/dev/rbd1'])
+        self.assertEqual(manager.admin.list_targets(), {})
+        self.assertEqual(manager.fetch_targeted(['cisco-27', 'cisco-28']),
+                         set())
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'sysfs',
+                                                 'devices')), [])
+
+    def test_failed_save(self):
+        # ietd.conf can not be written, the directory is missing
+        manager = self.__manager(os.path.join(self.directory, 'missing',
+                                              'ietd.conf'))
+        with self.assertRaises(iscsi_exceptions.ConfigWriteException):
+            manager.add_targets(['cisco-27', 'cisco-28'])
+        # the live targets and the devices of the batch are gone again
+        self.assertEqual(manager.admin.list_targets(), {})
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'sysfs',
+                                                 'devices')), [])
+        self.assertIsNone(manager.mapper.lookup('cisco-27'))
+
+    def test_failed_remove_save(self):
+        manager = self.__manager(os.path.join(self.directory, 'iet',
+                                              'ietd.conf'))
+        os.mkdir(os.path.join(self.directory, 'iet'))
+        manager.add_targets(['cisco-27', 'cisco-28'])
+
+        def fail(config, write_privileged=None):
+            raise OSError(28, 'No space left on device')
+
+        save = IETDConfig.save
+        IETDConfig.save = fail
+        try:
+            updates = manager.remove_targets(['cisco-27', 'cisco-28'])
+        finally:
+            IETDConfig.save = save
+        for node in ('cisco-27', 'cisco-28'):
+            self.assertEqual(updates[node].status, TargetUpdate.FAILED)
+            self.assertIsInstance(updates[node].error,
+                                  iscsi_exceptions.ConfigWriteException)
+        # ietd.conf still lists the targets, so their devices stay mapped
+        self.assertEqual(manager.admin.list_targets(), {})
+        self.assertEqual(manager.fetch_targeted(['cisco-27', 'cisco-28']),
+                         set(['cisco-27', 'cisco-28']))
+        self.assertEqual(len(os.listdir(os.path.join(
+            self.directory, 'sysfs', 'devices'))), 2)
+
+        # and a retry finishes the removal
+        updates = manager.remove_targets(['cisco-27', 'cisco-28'])
+        self.assertEqual([updates[node].status for node in
+                          ('cisco-27', 'cisco-28')],
+                         [TargetUpdate.REMOVED] * 2)
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'sysfs',
+                                                 'devices')), [])
+
+    def test_failed_load(self):
+        # ietd.conf can not be read, it is a directory
+        path = os.path.join(self.directory, 'iet')
+        os.mkdir(path)
+        manager = self.__manager(path)
+        with self.assertRaises(iscsi_exceptions.ConfigReadException):
+            manager.fetch_targeted(['cisco-27'])
+        with self.assertRaises(iscsi_exceptions.ConfigReadException):
+            manager.add_targets(['cisco-27'])
+        self.assertEqual(manager.admin.list_targets(), {})
@@ -0,0 +1,133 @@
+import errno
+import logging
+import os
+import socket
+import threading
+import uuid
+from multiprocessing.pool import ThreadPool
+
+import constants
+from database import JobRepository
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+# Returns whether a process with pid is running on this host
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+# Runs long running BMI operations in the background
+# Every submitted operation gets a job id right away and its state is kept
+# in the job table so that any API worker can answer status queries
+# Jobs are owned by host:pid of the process running them. On creation the
+# engine fails the jobs which a process of this host that is gone left
+# queued or running, they would never finish otherwise
+class JobEngine:
+    def __init__(self, workers, owner=None):
+        self.owner = owner or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.recover()
+        self.pool = ThreadPool(workers)
+
+    # Returns whether the owner of a job is gone, a job without an owner
+    # was queued before owners were recorded
+    def __is_orphan(self, owner):
+        if owner is None or owner == self.owner:
+            return True
+        host, _, pid = owner.rpartition(':')
+        return host == self.owner.rpartition(':')[0] and pid.isdigit() and \
+               not is_alive(int(pid))
+
+    # Fails the jobs whose process is gone
+    # Returns the number of jobs failed
+    def recover(self):
+        jobr = JobRepository()
+        unfinished = [constants.JOB_QUEUED, constants.JOB_RUNNING]
+        orphans = [job_id for job_id, owner in
+                   jobr.fetch_owners_with_statuses(unfinished)
+                   if self.__is_orphan(owner)]
+        if not orphans:
+            return 0
+        return jobr.update_status_with_ids(
+            orphans, unfinished, constants.JOB_FAILED,
+            {constants.STATUS_CODE_KEY: 500,
+             constants.MESSAGE_KEY: 'the BMI process running the job exited'})
+
+    # Queues func(*args) and returns the job id
+    # func should return the status dict built by BMI for the operation
+    def submit(self, operation, func, *args):
+        job_id = uuid.uuid4().hex
+        JobRepository().insert(job_id, operation, constants.JOB_QUEUED,
+                               self.owner)
+        self.pool.apply_async(JobEngine.__run, (job_id, func, args))
+        return job_id
+
+    @staticmethod
+    def __run(job_id, func, args):
+        jobr = JobRepository()
+        try:
+            jobr.update_status(job_id, constants.JOB_RUNNING)
+            result = func(*args)
+        # Operations return errors as dicts, anything raised is unexpected
+        # but should still end up in the job instead of being lost
+        except Exception as e:
+            result = {constants.STATUS_CODE_KEY: 500,
+                      constants.MESSAGE_KEY: str(e)}
+
+        if result[constants.STATUS_CODE_KEY] == 200:
+            status = constants.JOB_SUCCEEDED
+        else:
+            status = constants.JOB_FAILED
+        JobEngine.__finish(jobr, job_id, status, result)
+
+    # Records how the job ended, trying once more as the database may have
+    # been away for a moment
+    # A result which can not be recorded fails the job with the error
+    # instead, a job which can not be updated at all stays running until the
+    # process is gone and a new engine fails it
+    @staticmethod
+    def __finish(jobr, job_id, status, result):
+        error = None
+        for _ in range(2):
+            try:
+                jobr.update_status(job_id, status, result)
+                return
+            # nothing above the pool would see it
+            except Exception as e:
+                error = e
+                logger.warning('not able to record the result of job %s: %s',
+                               job_id, e)
+        try:
+            jobr.update_status(job_id, constants.JOB_FAILED,
+                               {constants.STATUS_CODE_KEY: 500,
+                                constants.MESSAGE_KEY:
+                                    'not able to record the result: ' +
+                                    str(error)})
+        except Exception as e:
+            logger.error('not able to record the end of job %s: %s',
+                         job_id, e)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+# Returns the job engine of this process, creating it with workers threads
+# on first use, later worker counts are ignored
+# There is one engine per process as an engine fails the unfinished jobs of
+# its owner when it is created
+def get_engine(workers=constants.DEFAULT_JOB_WORKERS):
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = JobEngine(workers)
+        return _engine
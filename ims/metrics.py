@@ -0,0 +1,331 @@
+import BaseHTTPServer
+import functools
+import json
+import logging
+import socket
+import threading
+import time
+
+import constants
+from exception import *
+
+# Upper bounds of the histogram buckets in seconds, a provision spans from
+# milliseconds of database queries to minutes of clones on a busy cluster
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0, 120.0, float('inf'))
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(
+        name + '="' + str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in zip(names, values)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+# A monotonically increasing count for every combination of label values
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def __key(self, labels):
+        return tuple(labels[name] for name in self.label_names)
+
+    def inc(self, amount=1, **labels):
+        key = self.__key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(self.__key(labels), 0)
+
+    def render(self):
+        lines = ['# HELP ' + self.name + ' ' + self.documentation,
+                 '# TYPE ' + self.name + ' counter']
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            lines.append(self.name + format_labels(self.label_names, key) +
+                         ' ' + format_value(value))
+        return lines
+
+
+# Counts observations into cumulative buckets for every combination of label
+# values, along with their sum
+# phase names the step of an operation the observations are of in the
+# operation logs, the first label value is added to it
+# Failures of the timed calls are counted in <name>_errors_total
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), phase=None,
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.phase = phase
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.values = {}
+        base = name[:-len('_seconds')] if name.endswith('_seconds') else name
+        self.errors = Counter(base + '_errors_total',
+                              'Failures of ' + documentation[0].lower() +
+                              documentation[1:], label_names)
+
+    def __key(self, labels):
+        return tuple(labels[name] for name in self.label_names)
+
+    def observe(self, value, **labels):
+        key = self.__key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets),
+                                                  0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+        operation = _current.operation
+        if operation is not None and self.phase is not None:
+            phase = self.phase
+            if self.label_names:
+                phase += ':' + str(labels[self.label_names[0]])
+            operation.add_phase(phase, value)
+
+    # Returns (count, sum) of the observations with the labels
+    def summary(self, **labels):
+        with self.lock:
+            counts, total = self.values.get(self.__key(labels),
+                                            ([0] * len(self.buckets), 0.0))
+            return counts[-1], total
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def render(self):
+        lines = ['# HELP ' + self.name + ' ' + self.documentation,
+                 '# TYPE ' + self.name + ' histogram']
+        with self.lock:
+            values = sorted((key, (list(counts), total))
+                            for key, (counts, total) in self.values.items())
+        names = self.label_names + ('le',)
+        for key, (counts, total) in values:
+            for bound, count in zip(self.buckets, counts):
+                lines.append(self.name + '_bucket' + format_labels(
+                    names, key + (format_value(bound),)) + ' ' + str(count))
+            labels = format_labels(self.label_names, key)
+            lines.append(self.name + '_sum' + labels + ' ' + repr(total))
+            lines.append(self.name + '_count' + labels + ' ' +
+                         str(counts[-1]))
+        return lines + self.errors.render()
+
+
+# Observes the time a block or a function call takes
+# Works as a context manager and as a decorator
+class Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time.time() - self.start, **self.labels)
+        if exc_type is not None:
+            self.histogram.errors.inc(**self.labels)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with Timer(self.histogram, self.labels):
+                return func(*args, **kwargs)
+
+        return timed
+
+
+# The metrics of the process, rendered in the Prometheus text format
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+OPERATION_SECONDS = REGISTRY.register(Histogram(
+    'bmi_operation_seconds', 'Latency of BMI operations',
+    ('operation', 'status')))
+HAAS_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'bmi_haas_request_seconds', 'Latency of HaaS requests', ('endpoint',),
+    phase='haas'))
+CEPH_SECONDS = REGISTRY.register(Histogram(
+    'bmi_ceph_seconds', 'Latency of ceph calls', ('operation',),
+    phase='ceph'))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    'bmi_db_query_seconds', 'Latency of database queries', ('statement',),
+    phase='db'))
+ISCSI_SECONDS = REGISTRY.register(Histogram(
+    'bmi_iscsi_seconds', 'Latency of iscsi target updates', ('operation',),
+    phase='iscsi'))
+
+
+def render():
+    return REGISTRY.render()
+
+
+# The operation running on a thread, the phases timed on the thread are added
+# to it
+class _Current(threading.local):
+    operation = None
+
+
+_current = _Current()
+
+
+class Operation:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.phases = {}
+
+    # Phases which run more than once, like database queries, are summed up
+    def add_phase(self, phase, seconds):
+        with self.lock:
+            count, total = self.phases.get(phase, (0, 0.0))
+            self.phases[phase] = (count + 1, total + seconds)
+
+    def record(self, status, seconds):
+        with self.lock:
+            phases = dict((phase, {'count': count, 'seconds': round(total, 6)})
+                          for phase, (count, total) in self.phases.items())
+        return {'operation': self.name, 'status': status,
+                'seconds': round(seconds, 6), 'phases': phases}
+
+
+# Decorates a BMI method returning a status dict
+# The call is observed in bmi_operation_seconds by its status code and a
+# structured record with the time spent in every phase is logged
+# Operations run inside other operations are only counted in the outer one
+def operation(name):
+    def decorate(func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            if _current.operation is not None:
+                return func(*args, **kwargs)
+            current = _current.operation = Operation(name)
+            start = time.time()
+            status = 'exception'
+            try:
+                result = func(*args, **kwargs)
+                if isinstance(result, dict):
+                    status = str(result.get(constants.STATUS_CODE_KEY, 200))
+                else:
+                    status = '200'
+                return result
+            finally:
+                _current.operation = None
+                seconds = time.time() - start
+                OPERATION_SECONDS.observe(seconds, operation=name,
+                                          status=status)
+                record = current.record(status, seconds)
+                logger.info(json.dumps(record, sort_keys=True),
+                            extra={'bmi_operation': record})
+
+        return run
+
+    return decorate
+
+
+# Wraps func so that the phases it runs on other threads, like those of a
+# ThreadPool, are added to the operation of the calling thread
+def bind(func):
+    parent = _current.operation
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        previous = _current.operation
+        _current.operation = parent
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.operation = previous
+
+    return run
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+# Serves /metrics on a background thread if a port is configured in the
+# [metrics] section, once per process
+# Only one process of a host can have the port, the others log a warning
+# Returns the server or None
+def start_server(settings=None):
+    global _server
+    settings = settings or {}
+    try:
+        port = int(settings.get(constants.METRICS_PORT_KEY,
+                                constants.METRICS_DEFAULT_PORT))
+    except ValueError as e:
+        raise config_exceptions.InvalidOptionInConfigException(
+            constants.METRICS_PORT_KEY, str(e))
+    address = settings.get(constants.METRICS_ADDRESS_KEY,
+                           constants.METRICS_DEFAULT_ADDRESS)
+    with _server_lock:
+        if _server is None and port > 0:
+            try:
+                _server = BaseHTTPServer.HTTPServer((address, port), _Handler)
+            except socket.error as e:
+                # another BMI process of the host serves the port
+                logger.warning('not serving metrics on port %d: %s', port, e)
+                return None
+            thread = threading.Thread(target=_server.serve_forever)
+            thread.daemon = True
+            thread.start()
+        return _server
@@ -1,18 +1,45 @@
 #!/usr/bin/python
-import subprocess
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
+from ceph_pool import get_reaper
 from ceph_wrapper import *
 from config import BMIConfig
 from database import *
+from flatten import get_scheduler
 from haas_wrapper import *
+from ims import metrics
+from iscsi import ISCSITargetManager
+from jobs import get_engine
+from reconcile import Reconciler
+from saga import Saga
+from warm_pool import get_warm_pool
 
 
-# logging will be submitted later
-
 class BMI:
     def __init__(self, usr, passwd):
         self.config = BMIConfig.create_config()
-        self.haas = HaaS(base_url=self.config.haas_url, usr=usr, passwd=passwd)
+        DatabaseConnection.configure(self.config.db)
+        ensure_schema()
+        self.haas = HaaS(base_url=self.config.haas_url, usr=usr, passwd=passwd,
+                         pool_size=self.config.haas_pool_size,
+                         timeout=self.config.haas_timeout,
+                         cache_ttl=self.config.haas_cache_ttl,
+                         negative_cache_ttl=self.config.haas_negative_cache_ttl,
+                         cache_size=self.config.haas_cache_size,
+                         max_concurrency=self.config.haas_max_concurrency)
+        self.iscsi = ISCSITargetManager(self.config)
+        self.warm_pool = get_warm_pool(
+            self.config.fs[constants.CEPH_CONFIG_SECTION_NAME],
+            self.config.warm_pools)
+        self.flattener = get_scheduler(
+            self.config.fs[constants.CEPH_CONFIG_SECTION_NAME],
+            self.config.flatten)
+        # closes the ceph connections and images nobody used for a while
+        get_reaper(self.config.ceph_reap_interval)
+        metrics.start_server(self.config.metrics)
+        # fails the jobs a process which exited left behind
+        get_engine(self.config.job_workers)
 
     def __does_project_exist(self, name):
         pr = ProjectRepository()
@@ -21,21 +48,17 @@ class BMI:
         if pid is None:
             raise db_exceptions.ProjectNotFoundException(name)
 
+    # Returns the id of the image with name in project
+    # The project and image are resolved with a single indexed query
     def __get_image_id(self, project, name):
         imgr = ImageRepository()
-        img_id = imgr.fetch_id_with_name_from_project(name, project)
-        if img_id is None:
+        ids = imgr.fetch_ids_with_names(project, name)
+        # None as a query result implies that the project does not exist.
+        if ids is None:
+            raise db_exceptions.ProjectNotFoundException(project)
+        if ids[1] is None:
             raise db_exceptions.ImageNotFoundException(name)
-        return str(img_id)
-
-    # Calling shell script which executes a iscsi update as we don't have
-    # rbd map in documentation.
-    @staticmethod
-    def __call_shellscript(*args):
-        arglist = list(args)
-        proc = subprocess.Popen(arglist, stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-        return proc.communicate()
+        return str(ids[1])
 
     # A custom function which is wrapper around only success code that
     # we are creating.
@@ -46,94 +69,444 @@ class BMI:
     # Parses the Exception and returns the dict that should be returned to user
     @staticmethod
     def __return_error(ex):
-
-        # Replaces the image name with id in error string
-        def swap_id_with_name(err_str):
-            parts = err_str.split(" ")
-            imgr = ImageRepository()
-            name = imgr.fetch_name_with_id(parts[0].strip())
-            if name is not None:
-                parts[0] = name
-            return " ".join(parts)
-
-        if FileSystemException in ex.__class__.__bases__:
-            return {constants.STATUS_CODE_KEY: ex.status_code,
-                    constants.MESSAGE_KEY: swap_id_with_name(str(ex))}
         return {constants.STATUS_CODE_KEY: ex.status_code,
                 constants.MESSAGE_KEY: str(ex)}
 
-    # Provisions from HaaS and Boots the given node with given image
-    def provision(self, node_name, img_name, snap_name, network, channel, nic):
+    # Ceph only knows images by their id, so file system exceptions raised
+    # inside this block get the image name the user knows put back in place
+    # of the id. The name is already resolved, so no query is needed.
+    @staticmethod
+    @contextmanager
+    def __image_names(img_id, img_name):
+        try:
+            yield
+        except FileSystemException as e:
+            if getattr(e, 'name', None) == img_id:
+                e.name = img_name
+            raise
+
+    # Gives the node its own clone of img_name@snap_name, a ready one from the
+    # warm pool if there is one
+    def __clone(self, img_name, snap_name, node_name):
+        if self.warm_pool.claim(img_name, snap_name, node_name):
+            return
+        with RBD(self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]) as fs:
+            fs.clone(img_name, snap_name, node_name)
+        CloneRepository().insert(node_name, img_name, snap_name)
+
+    # Clones like __clone, but if adopt is set a clone of the same snapshot
+    # which is there already is taken as it is, recording it if that was not
+    # done. adopt is only set when this saga made the clone in an attempt
+    # which was cut off, any other clone could hold the data of another user
+    def __clone_once(self, img_name, snap_name, node_name, adopt):
+        try:
+            self.__clone(img_name, snap_name, node_name)
+        except file_system_exceptions.ImageExistsException:
+            if not adopt:
+                raise
+            clone = CloneRepository().fetch_with_name(node_name)
+            if clone is not None:
+                if (clone['parent_name'], clone['parent_snap']) != \
+                        (img_name, snap_name):
+                    raise
+                return
+            with RBD(self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]) as fs:
+                parent = fs.parent_info(node_name)
+            if parent is None or tuple(parent[1:]) != (img_name, snap_name):
+                raise
+            CloneRepository().insert(node_name, img_name, snap_name)
+
+    # Removes the clone of the node, which a retry may find removed already
+    def __remove_image(self, node_name):
+        try:
+            with RBD(self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]) as fs:
+                fs.remove(node_name.encode("utf-8"))
+        except file_system_exceptions.ImageNotFoundException:
+            pass
+
+    # Removes the clone of the node and its record
+    def __remove_clone(self, node_name):
+        self.__remove_image(node_name)
+        CloneRepository().delete_with_names([node_name])
+
+    # Adds the target of the node, if adopt is set a target which is there
+    # already is taken as it is, like a clone in __clone_once
+    def __add_target(self, node_name, adopt):
+        try:
+            self.iscsi.add_target(node_name).check()
+        except iscsi_exceptions.NodeAlreadyInUseException:
+            if not adopt:
+                raise
+
+    # Removes the target of the node, which a retry may find removed already
+    def __remove_target(self, node_name):
+        try:
+            self.iscsi.remove_target(node_name).check()
+        except iscsi_exceptions.NodeAlreadyUnmappedException:
+            pass
+
+    # Attaches the nic of the node to network, if adopt is set HaaS refusing
+    # because it is attached already is taken as done
+    def __attach_network(self, node_name, network, channel, nic, adopt):
         try:
             self.haas.attach_node_to_project_network(node_name, network,
                                                      channel, nic)
+        except haas_exceptions.UnknownException:
+            if not (adopt and self.haas.is_node_on_network(node_name,
+                                                           network, nic)):
+                raise
 
-            with RBD(self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]) as fs:
-                fs.clone(img_name.encode('utf-8'), snap_name.encode('utf-8'),
-                         node_name.encode("utf-8"))
-
-                ceph_config = self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]
-                # Should be changed to python script
-                iscsi_output = BMI.__call_shellscript(self.config.iscsi_update,
-                                                      ceph_config[
-                                                          constants.CEPH_KEY_RING_KEY],
-                                                      ceph_config[
-                                                          constants.CEPH_ID_KEY],
-                                                      ceph_config[
-                                                          constants.CEPH_POOL_KEY],
-                                                      node_name,
-                                                      constants.ISCSI_CREATE_COMMAND,
-                                                      self.config.iscsi_update_password)
-                if constants.ISCSI_UPDATE_SUCCESS in iscsi_output[0]:
-                    return BMI.__return_success(True)
-                elif constants.ISCSI_UPDATE_FAILURE in iscsi_output[0]:
-                    # Was not able to test this exception in test cases as the haas
-                    # call was blocking this exception
-                    # But it was raised during preparation of tests
-                    # Rare exception
-                    raise iscsi_exceptions.NodeAlreadyInUseException()
-
-        except (HaaSException, ISCSIException, FileSystemException) as e:
+    # Detaches the nic of the node from network, if adopt is set HaaS
+    # refusing because it is detached already is taken as done
+    def __detach_network(self, node_name, network, nic, adopt):
+        try:
+            self.haas.detach_node_from_project_network(node_name, network,
+                                                       nic)
+        except haas_exceptions.UnknownException:
+            if not adopt or self.haas.is_node_on_network(node_name, network,
+                                                         nic):
+                raise
+
+    # Returns the provision sagas of the nodes with the steps they did, which
+    # are fetched with one query, and the nodes which still have detach steps
+    # recorded. Those are left out, provisioning them could hand out what
+    # is left of their last use before their detach is retried.
+    @staticmethod
+    def __provision_sagas(node_names):
+        completed = SagaRepository().fetch_steps_with_sagas(
+            [prefix + node_name for node_name in node_names
+             for prefix in (constants.PROVISION_SAGA_PREFIX,
+                            constants.DETACH_SAGA_PREFIX)])
+        sagas = {}
+        detaching = []
+        for node_name in node_names:
+            if constants.DETACH_SAGA_PREFIX + node_name in completed:
+                detaching.append(node_name)
+                continue
+            name = constants.PROVISION_SAGA_PREFIX + node_name
+            sagas[node_name] = Saga(name, completed.get(name, ()))
+        return sagas, detaching
+
+    # Returns the detach sagas of the nodes with the steps they did, which
+    # are fetched with one query
+    @staticmethod
+    def __detach_sagas(node_names):
+        completed = SagaRepository().fetch_steps_with_sagas(
+            [constants.DETACH_SAGA_PREFIX + node_name
+             for node_name in node_names])
+        return dict((node_name, Saga(
+            constants.DETACH_SAGA_PREFIX + node_name,
+            completed.get(constants.DETACH_SAGA_PREFIX + node_name, ())))
+                    for node_name in node_names)
+
+    # Forgets the sagas of detached nodes, the steps of a provision which
+    # could not be undone included as nothing is left of it
+    @staticmethod
+    def __finish_detach(node_names):
+        SagaRepository().delete_with_sagas(
+            [prefix + node_name for node_name in node_names
+             for prefix in (constants.DETACH_SAGA_PREFIX,
+                            constants.PROVISION_SAGA_PREFIX)])
+
+    # The steps of provisioning a node up to its iscsi target
+    # The clone step is named after the snapshot, so a retry with another
+    # snapshot does not skip it
+    def __attach_and_clone(self, saga, node_name, img_name, snap_name,
+                           network, channel, nic):
+        saga.step('attach_network',
+                  lambda: self.__attach_network(
+                      node_name, network, channel, nic,
+                      saga.started_before('attach_network')),
+                  lambda: self.haas.detach_node_from_project_network(
+                      node_name, network, nic))
+        step = 'clone:' + img_name + '@' + snap_name
+        saga.step(step,
+                  lambda: self.__clone_once(img_name.encode('utf-8'),
+                                            snap_name.encode('utf-8'),
+                                            node_name.encode('utf-8'),
+                                            saga.started_before(step)),
+                  lambda: self.__remove_clone(node_name))
+
+    # Provisions from HaaS and Boots the given node with given image
+    # The steps are recorded in the provision saga of the node, so a retry
+    # skips the ones which are done. A step which fails undoes the ones
+    # before it. If undoing fails as well they stay recorded and a retry
+    # carries on from there. A node whose detach did not finish is refused
+    # until the detach is retried.
+    @metrics.operation('provision')
+    def provision(self, node_name, img_name, snap_name, network, channel, nic):
+        try:
+            sagas, detaching = BMI.__provision_sagas([node_name])
+            if detaching:
+                raise db_exceptions.UnfinishedSagaException(
+                    constants.DETACH_SAGA_PREFIX + node_name)
+            saga = sagas[node_name]
+            try:
+                self.__attach_and_clone(saga, node_name, img_name, snap_name,
+                                        network, channel, nic)
+                saga.step('add_target',
+                          lambda: self.__add_target(
+                              node_name, saga.started_before('add_target')),
+                          lambda: self.__remove_target(node_name))
+            except (HaaSException, ISCSIException, FileSystemException,
+                    DBException):
+                saga.compensate()
+                raise
+            saga.finish()
+            return BMI.__return_success(True)
+
+        except (HaaSException, ISCSIException, FileSystemException,
+                DBException) as e:
             return BMI.__return_error(e)
 
+    # Provisions many nodes from the same image snapshot in a single call
+    # nodes is a list of (node_name, nic) tuples
+    # The HaaS attaches and clones are run concurrently on a bounded pool of
+    # workers and all the iscsi targets are added with one config update
+    # Every node has its saga as in provision, the steps of all of them are
+    # fetched with one query, so retrying the nodes of a batch which was cut
+    # off only runs the steps which are left. Nodes whose detach did not
+    # finish are refused like in provision.
+    # Returns a dict with the same status dict provision returns for every node
+    @metrics.operation('provision_many')
+    def provision_many(self, nodes, img_name, snap_name, network, channel,
+                       max_workers=constants.DEFAULT_BATCH_WORKERS):
+        if not nodes:
+            return {}
+        node_names = [node_name for node_name, _ in nodes]
+        try:
+            sagas, detaching = BMI.__provision_sagas(node_names)
+        except DBException as e:
+            error = BMI.__return_error(e)
+            return dict((node_name, error) for node_name in node_names)
+        refused = dict(
+            (node_name, BMI.__return_error(
+                db_exceptions.UnfinishedSagaException(
+                    constants.DETACH_SAGA_PREFIX + node_name)))
+            for node_name in detaching)
+        nodes = [node for node in nodes if node[0] not in refused]
+        if not nodes:
+            return refused
+
+        def attach_and_clone(node):
+            node_name, nic = node
+            saga = sagas[node_name]
+            try:
+                self.__attach_and_clone(saga, node_name, img_name, snap_name,
+                                        network, channel, nic)
+                return node_name, None
+            except (HaaSException, FileSystemException, DBException) as e:
+                saga.compensate()
+                return node_name, BMI.__return_error(e)
+
+        def compensate(node_name):
+            sagas[node_name].compensate()
+
+        pool = ThreadPool(min(max_workers, len(nodes)))
+        try:
+            outcomes = pool.map(metrics.bind(attach_and_clone), nodes)
+            results = dict(outcomes)
+            results.update(refused)
+            cloned = [node_name for node_name, error in outcomes
+                      if error is None]
+
+            # The targets are the last step, only its start is recorded as
+            # the sagas are finished right after
+            failed = []
+            if cloned:
+                try:
+                    adopt = set(node_name for node_name in cloned
+                                if sagas[node_name].started_before(
+                                    'add_target'))
+                    for node_name in cloned:
+                        sagas[node_name].start('add_target')
+                    # All the targets are added with a single config write
+                    updates = self.iscsi.add_targets(cloned)
+                except (ISCSIException, DBException) as e:
+                    error = BMI.__return_error(e)
+                    updates = {}
+                    results.update((node_name, error) for node_name in cloned)
+                    failed.extend(cloned)
+                in_use = iscsi_exceptions.NodeAlreadyInUseException
+                for node_name, update in updates.items():
+                    if update.error is None or node_name in adopt and \
+                            isinstance(update.error, in_use):
+                        results[node_name] = BMI.__return_success(True)
+                    else:
+                        results[node_name] = BMI.__return_error(update.error)
+                        failed.append(node_name)
+            pool.map(metrics.bind(compensate), failed)
+        finally:
+            pool.close()
+            pool.join()
+
+        failed = set(failed)
+        provisioned = [node_name for node_name in cloned
+                       if node_name not in failed]
+        if provisioned:
+            try:
+                SagaRepository().delete_with_sagas(
+                    [constants.PROVISION_SAGA_PREFIX + node_name
+                     for node_name in provisioned])
+            except DBException as e:
+                error = BMI.__return_error(e)
+                results.update((node_name, error)
+                               for node_name in provisioned)
+        return results
+
     # This is for detach a node and removing it from iscsi
     # and destroying its image
+    # The steps are recorded in the detach saga of the node. A step which
+    # fails leaves the ones before it done, so a retry carries on with it
+    # Once it is through the provision saga of the node is forgotten as well
+    @metrics.operation('detach_node')
     def detach_node(self, node_name, network, nic):
         try:
+            saga = BMI.__detach_sagas([node_name])[node_name]
+            saga.step('detach_network',
+                      lambda: self.__detach_network(
+                          node_name, network, nic,
+                          saga.started_before('detach_network')))
+            saga.step('remove_target',
+                      lambda: self.__remove_target(node_name))
+            saga.step('remove_image', lambda: self.__remove_image(node_name))
+            CloneRepository().delete_with_names([node_name])
+            BMI.__finish_detach([node_name])
+            return BMI.__return_success(True)
+        except (HaaSException, ISCSIException, FileSystemException,
+                DBException) as e:
+            return BMI.__return_error(e)
 
-            self.haas.detach_node_from_project_network(node_name,
-                                                       network, nic)
+    # Detaches many nodes in a single call
+    # nodes is a list of (node_name, nic) tuples
+    # Every node goes through the same steps as in detach_node, one step for
+    # all the nodes at a time: the HaaS detaches run concurrently, the iscsi
+    # targets are removed with one config update and their devices unmapped
+    # concurrently, then the clones are removed concurrently
+    # A node which fails a step is left out of the steps after it, the steps
+    # it did are recorded in its saga like in detach_node
+    # Returns a dict with the same status dict detach_node returns for every
+    # node
+    @metrics.operation('detach_many')
+    def detach_many(self, nodes, network,
+                    max_workers=constants.DEFAULT_BATCH_WORKERS):
+        if not nodes:
+            return {}
+        node_names = [node_name for node_name, _ in nodes]
+        try:
+            sagas = BMI.__detach_sagas(node_names)
+        except DBException as e:
+            error = BMI.__return_error(e)
+            return dict((node_name, error) for node_name in node_names)
 
-            with RBD(self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]) as fs:
-                ceph_config = self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]
-
-                iscsi_output = BMI.__call_shellscript(self.config.iscsi_update,
-                                                      ceph_config[
-                                                          constants.CEPH_KEY_RING_KEY],
-                                                      ceph_config[
-                                                          constants.CEPH_ID_KEY],
-                                                      ceph_config[
-                                                          constants.CEPH_POOL_KEY],
-                                                      node_name,
-                                                      constants.ISCSI_DELETE_COMMAND,
-                                                      self.config.iscsi_update_password)
-                if constants.ISCSI_UPDATE_SUCCESS in iscsi_output[0]:
-                    return BMI.__return_success(
-                        fs.remove(node_name.encode("utf-8")))
-                elif constants.ISCSI_UPDATE_FAILURE in iscsi_output[0]:
-                    raise iscsi_exceptions.NodeAlreadyUnmappedException()
-        except (HaaSException, ISCSIException, FileSystemException) as e:
+        def detach(node):
+            node_name, nic = node
+            saga = sagas[node_name]
+            try:
+                saga.step('detach_network',
+                          lambda: self.__detach_network(
+                              node_name, network, nic,
+                              saga.started_before('detach_network')))
+                return node_name, None
+            except (HaaSException, DBException) as e:
+                return node_name, BMI.__return_error(e)
+
+        def remove(node_name):
+            saga = sagas[node_name]
+            try:
+                saga.complete('remove_target')
+                saga.step('remove_image',
+                          lambda: self.__remove_image(node_name))
+                return node_name, None
+            except (FileSystemException, DBException) as e:
+                return node_name, BMI.__return_error(e)
+
+        pool = ThreadPool(min(max_workers, len(nodes)))
+        try:
+            outcomes = pool.map(metrics.bind(detach), nodes)
+            results = dict(outcomes)
+            detached = [node_name for node_name, error in outcomes
+                        if error is None]
+
+            unmapped = [node_name for node_name in detached
+                        if sagas[node_name].is_done('remove_target')]
+            pending = [node_name for node_name in detached
+                       if not sagas[node_name].is_done('remove_target')]
+            if pending:
+                try:
+                    updates = self.iscsi.remove_targets(pending, max_workers)
+                except ISCSIException as e:
+                    error = BMI.__return_error(e)
+                    updates = {}
+                    results.update((node_name, error)
+                                   for node_name in pending)
+                for node_name, update in updates.items():
+                    if update.error is None or isinstance(
+                            update.error,
+                            iscsi_exceptions.NodeAlreadyUnmappedException):
+                        unmapped.append(node_name)
+                    else:
+                        results[node_name] = BMI.__return_error(update.error)
+
+            removed = []
+            for node_name, error in pool.map(metrics.bind(remove), unmapped):
+                if error is None:
+                    results[node_name] = BMI.__return_success(True)
+                    removed.append(node_name)
+                else:
+                    results[node_name] = error
+        finally:
+            pool.close()
+            pool.join()
+
+        if removed:
+            try:
+                CloneRepository().delete_with_names(removed)
+                BMI.__finish_detach(removed)
+            except DBException as e:
+                error = BMI.__return_error(e)
+                results.update((node_name, error) for node_name in removed)
+        return results
+
+    # Detaches every node of the project which was provisioned by BMI
+    # The nodes are looked up in HaaS and all use the same nic
+    # A node was provisioned by BMI if it has a clone or, when it was
+    # provisioned before clones were recorded, an iscsi target
+    # Returns the same dict as detach_many, the other nodes of the project
+    # are in it with a NodeAlreadyUnmapped error as they were left as they
+    # are. Returns an error status dict if the nodes of the project can not
+    # be found
+    @metrics.operation('detach_project')
+    def detach_project(self, project, network, nic,
+                       max_workers=constants.DEFAULT_BATCH_WORKERS):
+        try:
+            nodes = self.haas.query_project_nodes(project).get(
+                constants.RETURN_VALUE_KEY, [])
+            provisioned = CloneRepository().fetch_existing_names(nodes)
+            provisioned |= self.iscsi.fetch_targeted(
+                [node_name for node_name in nodes
+                 if node_name not in provisioned])
+        except (HaaSException, ISCSIException, DBException) as e:
             return BMI.__return_error(e)
+        results = self.detach_many(
+            [(node_name, nic) for node_name in nodes
+             if node_name in provisioned], network, max_workers)
+        error = BMI.__return_error(
+            iscsi_exceptions.NodeAlreadyUnmappedException())
+        results.update((node_name, error) for node_name in nodes
+                       if node_name not in provisioned)
+        return results
 
     # Creates snapshot for the given image with snap_name as given name
     # fs_obj will be populated by decorator
+    @metrics.operation('create_snapshot')
     def create_snapshot(self, project, img_name, snap_name):
         try:
             self.haas.validate_project(project)
-            self.__does_project_exist(project)
             img_id = self.__get_image_id(project, img_name)
 
-            with RBD(self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]) as fs:
+            with RBD(self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]) as fs, \
+                    BMI.__image_names(img_id, img_name):
                 return BMI.__return_success(fs.snap_image(img_id, snap_name))
 
         except (HaaSException, DBException, FileSystemException) as e:
@@ -142,13 +515,14 @@ class BMI:
     # Lists snapshot for the given image img_name
     # URL's have to be read from BMI config file
     # fs_obj will be populated by decorator
+    @metrics.operation('list_snaps')
     def list_snaps(self, project, img_name):
         try:
             self.haas.validate_project(project)
-            self.__does_project_exist(project)
             img_id = self.__get_image_id(project, img_name)
 
-            with RBD(self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]) as fs:
+            with RBD(self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]) as fs, \
+                    BMI.__image_names(img_id, img_name):
                 return BMI.__return_success(fs.list_snapshots(img_id))
 
         except (HaaSException, DBException, FileSystemException) as e:
@@ -156,20 +530,117 @@ class BMI:
 
     # Removes snapshot snap_name for the given image img_name
     # fs_obj will be populated by decorator
+    @metrics.operation('remove_snaps')
     def remove_snaps(self, project, img_name, snap_name):
         try:
             self.haas.validate_project(project)
-            self.__does_project_exist(project)
             img_id = self.__get_image_id(project, img_name)
 
-            with RBD(self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]) as fs:
+            with RBD(self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]) as fs, \
+                    BMI.__image_names(img_id, img_name):
                 return BMI.__return_success(
                     fs.remove_snapshots(img_id, snap_name))
 
         except (HaaSException, DBException, FileSystemException) as e:
             return BMI.__return_error(e)
 
+    # Imports a golden image into project from source, a local path or file
+    # object, the image is registered first as ceph stores it under its id
+    # The registration is undone if the import fails
+    # progress is called with (bytes done, total bytes or None)
+    @metrics.operation('import_image')
+    def import_image(self, project, img_name, source, is_public=False,
+                     progress=None):
+        try:
+            self.haas.validate_project(project)
+            imgr = ImageRepository()
+            ids = imgr.fetch_ids_with_names(project, img_name)
+            if ids is None:
+                raise db_exceptions.ProjectNotFoundException(project)
+            imgr.insert(img_name, ids[0], is_public)
+            img_id = str(imgr.fetch_id_with_name_from_project(img_name,
+                                                              project))
+            try:
+                with RBD(self.config.fs[
+                             constants.CEPH_CONFIG_SECTION_NAME]) as fs, \
+                        BMI.__image_names(img_id, img_name):
+                    return BMI.__return_success(
+                        fs.import_image(img_id, source, progress))
+            except FileSystemException:
+                imgr.delete_with_name_from_project(img_name, project)
+                raise
+        except (HaaSException, DBException, FileSystemException) as e:
+            return BMI.__return_error(e)
+
+    # Exports the image img_name, or its snapshot snap_name, to dest which is
+    # a local path or file object
+    @metrics.operation('export_image')
+    def export_image(self, project, img_name, dest, snap_name=None,
+                     progress=None):
+        try:
+            self.haas.validate_project(project)
+            img_id = self.__get_image_id(project, img_name)
+
+            with RBD(self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]) as fs, \
+                    BMI.__image_names(img_id, img_name):
+                return BMI.__return_success(
+                    fs.export_image(img_id, dest, snap_name, progress))
+        except (HaaSException, DBException, FileSystemException) as e:
+            return BMI.__return_error(e)
+
+    # Writes the changes of img_name between the snapshots from_snap and
+    # snap_name to dest, a local path or file object, for import_snapshot_diff
+    # on another site
+    # Without from_snap the whole snapshot is written
+    @metrics.operation('export_snapshot_diff')
+    def export_snapshot_diff(self, project, img_name, snap_name, dest,
+                             from_snap=None, progress=None):
+        try:
+            self.haas.validate_project(project)
+            img_id = self.__get_image_id(project, img_name)
+
+            with RBD(self.config.fs[constants.CEPH_CONFIG_SECTION_NAME]) as fs, \
+                    BMI.__image_names(img_id, img_name):
+                return BMI.__return_success(
+                    fs.export_diff(img_id, snap_name, dest, from_snap,
+                                   progress))
+        except (HaaSException, DBException, FileSystemException) as e:
+            return BMI.__return_error(e)
+
+    # Applies a diff from export_snapshot_diff, read from source which is a
+    # local path or file object, to img_name and creates its end snapshot
+    # A diff of a whole snapshot registers img_name, it is refused if img_name
+    # exists already as it would be written over
+    @metrics.operation('import_snapshot_diff')
+    def import_snapshot_diff(self, project, img_name, source, progress=None):
+        try:
+            self.haas.validate_project(project)
+            imgr = ImageRepository()
+            ids = imgr.fetch_ids_with_names(project, img_name)
+            if ids is None:
+                raise db_exceptions.ProjectNotFoundException(project)
+            registered = ids[1] is None
+            if registered:
+                imgr.insert(img_name, ids[0])
+                img_id = str(imgr.fetch_id_with_name_from_project(img_name,
+                                                                  project))
+            else:
+                img_id = str(ids[1])
+            try:
+                with RBD(self.config.fs[
+                             constants.CEPH_CONFIG_SECTION_NAME]) as fs, \
+                        BMI.__image_names(img_id, img_name):
+                    return BMI.__return_success(
+                        fs.import_diff(img_id, source, progress))
+            except FileSystemException:
+                if registered:
+                    imgr.delete_with_name_from_project(img_name, project)
+                raise
+        except (HaaSException, DBException, FileSystemException) as e:
+            return BMI.__return_error(e)
+
     # Lists the images for the project which includes the snapshot
+    @metrics.operation('list_all_images')
     def list_all_images(self, project):
         try:
             self.haas.validate_project(project)
@@ -178,3 +649,87 @@ class BMI:
             return BMI.__return_success(imgr.fetch_names_from_project(project))
         except (HaaSException, DBException) as e:
             return BMI.__return_error(e)
+
+    # Compares the images in ceph with the image and clone tables and returns
+    # the report of the Reconciler
+    # repair_db drops the rows of missing images and records untracked clones
+    # repair_ceph removes the images which are not registered in the database
+    @metrics.operation('reconcile')
+    def reconcile(self, repair_db=False, repair_ceph=False):
+        try:
+            reconciler = Reconciler(
+                self.config.fs[constants.CEPH_CONFIG_SECTION_NAME])
+            return BMI.__return_success(
+                reconciler.run(repair_db=repair_db, repair_ceph=repair_ceph))
+        except (DBException, FileSystemException) as e:
+            return BMI.__return_error(e)
+
+    # Flattens the oldest clones which are older than the configured age
+    # right away instead of waiting for the next background pass
+    # Returns the flattened clones, the failures and the snapshots which can
+    # be removed now
+    @metrics.operation('flatten_clones')
+    def flatten_clones(self):
+        try:
+            return BMI.__return_success(self.flattener.run())
+        except (DBException, FileSystemException) as e:
+            return BMI.__return_error(e)
+
+    # Starts filling the warm pools in the background, a pool is otherwise
+    # filled after the first provision from its snapshot
+    def fill_warm_pools(self):
+        self.warm_pool.refill_all()
+        return BMI.__return_success(True)
+
+    # Returns the hit and miss counts and the ready clones of the warm pools
+    def warm_pool_stats(self):
+        try:
+            return BMI.__return_success(self.warm_pool.stats())
+        except DBException as e:
+            return BMI.__return_error(e)
+
+    # Returns the latency histograms of this process in the Prometheus text
+    # format, for the API to serve on /metrics
+    def get_metrics(self):
+        return BMI.__return_success(metrics.render())
+
+    # The following submit the long running operations as background jobs
+    # They return the job id right away, the status dict the operation
+    # returns is stored in the job once it finishes
+    def submit_provision(self, node_name, img_name, snap_name, network,
+                         channel, nic):
+        return self.__submit_job('provision', self.provision, node_name,
+                                 img_name, snap_name, network, channel, nic)
+
+    def submit_detach_node(self, node_name, network, nic):
+        return self.__submit_job('detach_node', self.detach_node, node_name,
+                                 network, nic)
+
+    def submit_create_snapshot(self, project, img_name, snap_name):
+        return self.__submit_job('create_snapshot', self.create_snapshot,
+                                 project, img_name, snap_name)
+
+    def __submit_job(self, operation, func, *args):
+        try:
+            engine = get_engine(self.config.job_workers)
+            return BMI.__return_success(engine.submit(operation, func, *args))
+        except DBException as e:
+            return BMI.__return_error(e)
+
+    # Returns the state of the job with the given id
+    def get_job(self, job_id):
+        try:
+            job = JobRepository().fetch_with_id(job_id)
+            if job is None:
+                raise db_exceptions.JobNotFoundException(job_id)
+            return BMI.__return_success(job)
+        except DBException as e:
+            return BMI.__return_error(e)
+
+    # Returns the states of all the jobs with the given ids in one query
+    def list_jobs(self, job_ids):
+        try:
+            return BMI.__return_success(
+                JobRepository().fetch_with_ids(job_ids))
+        except DBException as e:
+            return BMI.__return_error(e)
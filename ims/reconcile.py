@@ -0,0 +1,115 @@
+import constants
+from ceph_wrapper import RBD
+from database import *
+from exception import *
+
+
+# Compares the images in the ceph pool with the image and clone tables
+# The pool listing is streamed and checked against the database a batch at a
+# time, and the rows of the database are streamed and looked up in the pool a
+# batch at a time, so only a batch is held in memory besides the report,
+# which lists every problem found.
+#
+# The report has
+#   ceph_orphans - numeric images in the pool with no image row, which are
+#                  not clones
+#   db_orphans - image rows ({id, name}) with no image in the pool
+#   untracked_clones - clones ({name, parent_name, parent_snap}) in the pool
+#                      which are not recorded in the clone table
+#   stale_clones - names of recorded clones which are not in the pool
+#   repaired - what was fixed, only filled when repairing
+#   errors - messages of the repairs that failed
+class Reconciler:
+    def __init__(self, fs_config,
+                 batch_size=constants.RECONCILE_DEFAULT_BATCH_SIZE):
+        self.fs_config = fs_config
+        self.batch_size = batch_size
+
+    # Builds the report and repairs the database and/or the pool if asked
+    # Every orphan is checked again right before it is repaired so that
+    # images created while the scan was running are left alone
+    def run(self, repair_db=False, repair_ceph=False):
+        report = {'ceph_orphans': [], 'db_orphans': [],
+                  'untracked_clones': [], 'stale_clones': [],
+                  'repaired': {'db_orphans': 0, 'ceph_orphans': 0,
+                               'untracked_clones': 0, 'stale_clones': 0},
+                  'errors': []}
+        imgr = ImageRepository()
+        cloner = CloneRepository()
+
+        with RBD(self.fs_config) as fs:
+            self.__scan_pool(fs, imgr, cloner, report)
+
+            for img_id, name in imgr.iter_ids(self.batch_size):
+                if not fs.image_exists(str(img_id)):
+                    report['db_orphans'].append({'id': img_id, 'name': name})
+            for name in cloner.iter_names(self.batch_size):
+                if not fs.image_exists(name):
+                    report['stale_clones'].append(name)
+
+            if repair_db:
+                self.__repair_db(fs, imgr, cloner, report)
+            if repair_ceph:
+                self.__repair_ceph(fs, imgr, cloner, report)
+        return report
+
+    # Streams the pool listing in batches and reports the images which are
+    # neither registered nor recorded clones
+    def __scan_pool(self, fs, imgr, cloner, report):
+        for names in chunked(fs.iter_images(), self.batch_size):
+            tracked = cloner.fetch_existing_names(names)
+            # images registered in BMI are stored in ceph with their id, the
+            # clones of nodes with their name which can be a number as well
+            ids = [int(name) for name in names
+                   if name.isdigit() and name not in tracked]
+            known = imgr.fetch_existing_ids(ids) if ids else set()
+
+            for name in names:
+                if name in tracked or name.isdigit() and int(name) in known:
+                    continue
+                try:
+                    parent = fs.parent_info(name)
+                except FileSystemException:
+                    # removed while we were scanning
+                    continue
+                if parent is not None:
+                    report['untracked_clones'].append(
+                        {'name': name, 'parent_name': parent[1],
+                         'parent_snap': parent[2]})
+                elif name.isdigit():
+                    report['ceph_orphans'].append(name)
+
+    @staticmethod
+    def __repair_db(fs, imgr, cloner, report):
+        orphans = [orphan['id'] for orphan in report['db_orphans']
+                   if not fs.image_exists(str(orphan['id']))]
+        report['repaired']['db_orphans'] = imgr.delete_with_ids(orphans)
+
+        stale = [name for name in report['stale_clones']
+                 if not fs.image_exists(name)]
+        report['repaired']['stale_clones'] = cloner.delete_with_names(stale)
+
+        for clone in report['untracked_clones']:
+            try:
+                cloner.insert(clone['name'], clone['parent_name'],
+                              clone['parent_snap'])
+                report['repaired']['untracked_clones'] += 1
+            except DBException as e:
+                report['errors'].append(str(e))
+
+    # An orphan which was registered or recorded as a clone since the scan
+    # is left alone
+    @staticmethod
+    def __repair_ceph(fs, imgr, cloner, report):
+        ids = [int(img_id) for img_id in report['ceph_orphans']]
+        registered = imgr.fetch_existing_ids(ids) if ids else set()
+        clones = cloner.fetch_existing_names(report['ceph_orphans']) \
+            if ids else set()
+        for img_id in ids:
+            if img_id in registered or str(img_id) in clones:
+                continue
+            try:
+                fs.remove(str(img_id))
+                report['repaired']['ceph_orphans'] += 1
+            except FileSystemException as e:
+                report['errors'].append(str(e))
@@ -0,0 +1,77 @@
+from database import SagaRepository
+from exception import *
+
+# recorded as <step><STARTED> before the action of a step runs
+STARTED = ':started'
+
+
+# An operation made of steps whose completion is kept in the database
+# A step which was completed by an earlier attempt is skipped, so retrying an
+# operation which was cut off half way picks up where it stopped. Every step
+# can have a compensation which undoes it, compensate runs them newest first
+# for the steps completed so far, in this attempt or an earlier one.
+# The start of a step is recorded before its action runs. An action which
+# finds its work already there can ask started_before whether an attempt of
+# this saga which was cut off did it, and only then take it as its own.
+# completed can be given when the steps of many sagas were fetched at once
+class Saga:
+    def __init__(self, name, completed=None):
+        self.name = name
+        self.repository = SagaRepository()
+        self.completed = set(completed) if completed is not None else \
+            self.repository.fetch_steps(name)
+        self.compensations = []
+
+    def is_done(self, step):
+        return step in self.completed
+
+    # Returns whether an earlier attempt of the saga started step
+    def started_before(self, step):
+        return step + STARTED in self.completed
+
+    # Records that step is about to run, for steps run outside of step
+    def start(self, step):
+        if not self.started_before(step):
+            self.repository.insert(self.name, step + STARTED)
+
+    # Runs action unless the step was completed before and records it
+    # compensate is called with no arguments to undo the step
+    def step(self, step, action, compensate=None):
+        if not self.is_done(step):
+            self.start(step)
+            action()
+        self.complete(step, compensate)
+
+    # Records a step which was run outside of step, like as part of a batch
+    def complete(self, step, compensate=None):
+        if not self.is_done(step):
+            self.repository.insert(self.name, step)
+            self.completed.add(step)
+        self.compensations.append((step, compensate))
+
+    # Undoes the completed steps newest first
+    # A compensation which fails stops the ones before it from running, as
+    # they usually depend on it, and its step stays recorded so that the next
+    # attempt starts from there
+    # Returns the exception of the failed compensation or None
+    def compensate(self):
+        while self.compensations:
+            step, compensate = self.compensations[-1]
+            try:
+                if compensate is not None:
+                    compensate()
+                self.repository.delete_step(self.name, step)
+                self.repository.delete_step(self.name, step + STARTED)
+            except (HaaSException, ISCSIException, FileSystemException,
+                    DBException) as e:
+                return e
+            self.completed.discard(step)
+            self.completed.discard(step + STARTED)
+            self.compensations.pop()
+        return None
+
+    # Forgets the steps once the operation is through
+    def finish(self):
+        self.repository.delete_with_sagas([self.name])
+        self.completed.clear()
+        self.compensations = []
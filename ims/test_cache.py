@@ -0,0 +1,66 @@
+import unittest
+
+from cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_expiry(self):
+        clock = FakeClock()
+        cache = TTLCache(10, 30, clock=clock)
+
+        cache.put("project", ["cisco-27"])
+        cache.put("bad_project", None, ttl=5)
+        self.assertEqual(cache.lookup("project"), (True, ["cisco-27"]))
+        # None is a valid value and has to be told apart from a miss
+        self.assertEqual(cache.lookup("bad_project"), (True, None))
+
+        clock.now = 10
+        self.assertEqual(cache.lookup("bad_project"), (False, None))
+        self.assertEqual(cache.lookup("project"), (True, ["cisco-27"]))
+
+        clock.now = 30
+        self.assertEqual(cache.lookup("project"), (False, None))
+
+        # a ttl of 0 disables caching
+        cache.put("project", ["cisco-27"], ttl=0)
+        self.assertEqual(cache.lookup("project"), (False, None))
+
+    def test_lru_eviction(self):
+        cache = TTLCache(2, 30, clock=FakeClock())
+        cache.put("a", 1)
+        cache.put("b", 2)
+        # a becomes the most recently used, so b is evicted
+        cache.lookup("a")
+        cache.put("c", 3)
+        self.assertEqual(cache.lookup("b"), (False, None))
+        self.assertEqual(cache.lookup("a"), (True, 1))
+        self.assertEqual(cache.lookup("c"), (True, 3))
+
+        cache.resize(1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.lookup("c"), (True, 3))
+
+    def test_invalidation(self):
+        cache = TTLCache(10, 30, clock=FakeClock())
+        cache.put(("usr", "project 1"), ["cisco-27"])
+        cache.put(("usr", "project 2"), ["cisco-28"])
+        cache.put(("usr", "project 3"), ["cisco-29"])
+
+        cache.invalidate(("usr", "project 1"))
+        self.assertEqual(cache.lookup(("usr", "project 1")), (False, None))
+
+        cache.invalidate_if(lambda key, value: "cisco-28" in value)
+        self.assertEqual(cache.lookup(("usr", "project 2")), (False, None))
+        self.assertEqual(cache.lookup(("usr", "project 3")),
+                         (True, ["cisco-29"]))
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
@@ -0,0 +1,38 @@
+import time
+import unittest
+
+from ims.benchmark import fake_rbd
+from ims.benchmark.run import install_fake_ceph
+
+
+class TestIdleReaper(unittest.TestCase):
+    def setUp(self):
+        self.uninstall = install_fake_ceph()
+        fake_rbd.reset()
+
+    def tearDown(self):
+        self.uninstall()
+
+    def test_reaper(self):
+        from ims import ceph_pool
+        pool = ceph_pool.CephConnectionPool()
+        connection = pool.acquire('bench', 'ceph.conf', 'bench',
+                                  idle_timeout=0.05, image_idle_timeout=0.05)
+        fake_rbd.RBD().create(connection.context, 'golden', 4096)
+        connection.images.release(connection.images.borrow('golden'))
+        pool.release(connection)
+        self.assertEqual(len(pool.connections), 1)
+        self.assertEqual(len(connection.images), 1)
+
+        # nothing else uses the pool, the reaper closes what is left
+        reaper = ceph_pool.IdleReaper(pool, 0.01)
+        reaper.start()
+        try:
+            deadline = time.time() + 5
+            while pool.connections and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            reaper.stop()
+        self.assertEqual(pool.connections, {})
+        self.assertEqual(len(connection.images), 0)
+        self.assertEqual(connection.cluster.state, 'shutdown')
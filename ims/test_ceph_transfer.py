@@ -0,0 +1,168 @@
+import io
+import os
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+import ceph_diff
+import ceph_transfer
+
+
+class Completion:
+    def __init__(self, ret):
+        self.ret = ret
+
+    def get_return_value(self):
+        return self.ret
+
+
+# Just enough of rbd.Image for the transfers, completions are run inline
+class MemoryImage:
+    def __init__(self, size=0):
+        self.data = bytearray(size)
+        self.writes = 0
+
+    def size(self):
+        return len(self.data)
+
+    def resize(self, size):
+        del self.data[size:]
+        self.data.extend(bytearray(size - len(self.data)))
+
+    def aio_write(self, data, offset, oncomplete):
+        self.writes += 1
+        self.data[offset:offset + len(data)] = data
+        oncomplete(Completion(0))
+
+    def aio_read(self, offset, length, oncomplete):
+        oncomplete(Completion(0), bytes(self.data[offset:offset + length]))
+
+    def flush(self):
+        pass
+
+
+class TestCephTransfer(unittest.TestCase):
+    data = os.urandom(5000) + '\0' * 12288 + os.urandom(100)
+
+    def test_import_skips_zeros(self):
+        # a stream of unknown size grows the image as it is read
+        image = MemoryImage()
+        progress = []
+        stats = ceph_transfer.write_image(
+            image, ceph_transfer.Source(io.BytesIO(self.data)), 4096, 2,
+            lambda done, total: progress.append((done, total)))
+        self.assertEqual(bytes(image.data), self.data)
+        self.assertEqual(stats, {'size': len(self.data), 'skipped': 8192,
+                                 'written': len(self.data) - 8192})
+        self.assertEqual(image.writes, 3)
+        self.assertEqual(progress[-1], (len(self.data), None))
+
+    def test_memory_mapped_round_trip(self):
+        source = tempfile.NamedTemporaryFile()
+        source.write(self.data)
+        source.flush()
+        image = MemoryImage(len(self.data))
+        src = ceph_transfer.Source(source.name)
+        try:
+            self.assertIsNotNone(src.map)
+            ceph_transfer.write_image(image, src, 4096, 3)
+        finally:
+            src.close()
+
+        # zero chunks become holes in a regular file
+        dest = tempfile.TemporaryFile()
+        stats = ceph_transfer.read_image(image, dest, 4096, 3)
+        self.assertEqual(stats['skipped'], 8192)
+        dest.seek(0)
+        self.assertEqual(dest.read(), self.data)
+
+        dest = io.BytesIO()
+        stats = ceph_transfer.read_image(image, dest, 4096, 3)
+        self.assertEqual(stats['skipped'], 0)
+        self.assertEqual(dest.getvalue(), self.data)
+
+    def test_errors(self):
+        image = MemoryImage(8192)
+        image.aio_read = lambda offset, length, oncomplete: oncomplete(
+            Completion(-5), None)
+        self.assertRaises(IOError, ceph_transfer.read_image, image,
+                          io.BytesIO(), 4096, 2)
+
+    def test_failed_transfer_waits(self):
+        # the writes complete late, after the source broke off
+        image = MemoryImage(16384)
+        late = []
+
+        def aio_write(data, offset, oncomplete):
+            def complete():
+                time.sleep(0.05)
+                late.append(offset)
+                oncomplete(Completion(0))
+            threading.Thread(target=complete).start()
+        image.aio_write = aio_write
+
+        class Broken:
+            def chunks(self, chunk_size):
+                yield 0, os.urandom(chunk_size)
+                yield chunk_size, os.urandom(chunk_size)
+                raise IOError('connection reset')
+
+        self.assertRaises(IOError, ceph_transfer.write_image, image, Broken(),
+                          4096, 4)
+        self.assertEqual(sorted(late), [0, 4096])
+
+        # so do the writes of a diff which is cut off
+        stream = io.BytesIO()
+        ceph_diff.write_diff(MemoryImage(8192), [(0, 8192, True)], stream,
+                             4096, 2)
+        del late[:]
+        self.assertRaises(ceph_diff.DiffFormatError, ceph_diff.apply_diff,
+                          image, io.BytesIO(stream.getvalue()[:-1]), 4096, 4)
+        self.assertEqual(sorted(late), [0, 4096])
+
+    def test_diff_round_trip(self):
+        image = MemoryImage()
+        image.data = bytearray(self.data)
+        stream = io.BytesIO()
+        ceph_diff.write_header(stream, len(self.data), 4096, 'v1', 'v2')
+        # the second extent was discarded, the third is zeros now
+        extents = [(0, 4096, True), (4096, 4096, False), (8192, 8192, True)]
+        stats = ceph_diff.write_diff(image, extents, stream, 4096, 2)
+        self.assertEqual(stats, {'data': 4096, 'zeros': 12288, 'records': 4})
+
+        target = MemoryImage()
+        target.data = bytearray('\1' * len(self.data))
+        stream.seek(0)
+        self.assertEqual(ceph_diff.read_header(stream),
+                         (len(self.data), 4096, 'v1', 'v2'))
+        ceph_diff.apply_diff(target, stream, 4096, 2)
+        self.assertEqual(bytes(target.data[:16384]),
+                         self.data[:4096] + '\0' * 12288)
+        self.assertEqual(bytes(target.data[16384:]),
+                         '\1' * (len(self.data) - 16384))
+
+        # a flipped bit or a cut stream is refused
+        corrupt = bytearray(stream.getvalue())
+        corrupt[100] ^= 1
+        source = io.BytesIO(bytes(corrupt))
+        ceph_diff.read_header(source)
+        self.assertRaises(ceph_diff.DiffFormatError, ceph_diff.apply_diff,
+                          MemoryImage(len(self.data)), source, 4096, 2)
+        source = io.BytesIO(stream.getvalue()[:-1])
+        ceph_diff.read_header(source)
+        self.assertRaises(ceph_diff.DiffFormatError, ceph_diff.apply_diff,
+                          MemoryImage(len(self.data)), source, 4096, 2)
+
+        # as is a data record longer than a block
+        source = io.BytesIO()
+        ceph_diff.write_header(source, len(self.data), 4096, None, 'v1')
+        source.write(ceph_diff.DATA + struct.pack(
+            '>QII', 0, 8192, ceph_diff.crc32(self.data[:8192])))
+        source.write(self.data[:8192])
+        source.write(ceph_diff.END + struct.pack('>Q', 1))
+        source.seek(0)
+        ceph_diff.read_header(source)
+        self.assertRaises(ceph_diff.DiffFormatError, ceph_diff.apply_diff,
+                          MemoryImage(len(self.data)), source, 4096, 2)
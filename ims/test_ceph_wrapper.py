@@ -0,0 +1,123 @@
+import io
+import os
+import tempfile
+import unittest
+
+from ims.benchmark.run import install_fake_ceph
+from ims.exception import file_system_exceptions
+
+
+# The features and layout of new images, which need no cluster
+class TestImageFeatures(unittest.TestCase):
+    def setUp(self):
+        self.uninstall = install_fake_ceph()
+        from ims.ceph_wrapper import RBD
+        self.conf_file = tempfile.NamedTemporaryFile()
+        self.fs = RBD({'id': 'bench', 'pool': 'bench',
+                       'conf_file': self.conf_file.name})
+        self.parse = RBD._RBD__parse_features
+
+    def tearDown(self):
+        from ims import ceph_pool
+        self.fs.tear_down()
+        ceph_pool.connections.close_all()
+        self.conf_file.close()
+        self.uninstall()
+
+    def test_parse_features(self):
+        self.assertIsNone(self.parse(None, False))
+        self.assertEqual(self.parse('layering, exclusive-lock', False), 5)
+        self.assertEqual(self.parse('layering exclusive-lock', False), 5)
+        self.assertEqual(self.parse(' 5 ', False), 5)
+        self.assertEqual(self.parse(5, False), 5)
+        self.assertEqual(self.parse('layering', True), 1)
+
+        invalid = file_system_exceptions.InvalidFeaturesException
+        # unknown names and bits
+        self.assertRaises(invalid, self.parse, 'layering,turbo', False)
+        self.assertRaises(invalid, self.parse, '128', False)
+        # features without the ones they need
+        self.assertRaises(invalid, self.parse, 'layering,object-map', False)
+        self.assertRaises(invalid, self.parse,
+                          'exclusive-lock,fast-diff', False)
+        self.assertRaises(invalid, self.parse, 'journaling', False)
+        self.assertEqual(self.parse(
+            'exclusive-lock,object-map,fast-diff', False), 28)
+        # clones without layering
+        self.assertRaises(invalid, self.parse, 'exclusive-lock', True)
+
+    def test_creation_args(self):
+        args = self.fs._RBD__creation_args
+        # the librbd defaults
+        self.assertEqual(args(None, None, False, {'order': None}), {})
+        self.assertEqual(args('layering', None, False, {'order': 20}),
+                         {'order': 20, 'old_format': False, 'features': 1})
+        # the default features of clones, which have no format
+        self.assertEqual(args(None, 1, True, {}), {'features': 1})
+
+        # one stripe of the object size is no striping
+        self.assertEqual(args('layering', None, False,
+                              {'order': 20, 'stripe_unit': 1 << 20,
+                               'stripe_count': 1})['features'], 1)
+        striped = {'stripe_unit': 65536, 'stripe_count': 4}
+        self.assertRaises(file_system_exceptions.InvalidFeaturesException,
+                          args, 'layering', None, False, striped)
+        self.assertEqual(args('layering,striping', None, False, striped),
+                         {'stripe_unit': 65536, 'stripe_count': 4,
+                          'old_format': False, 'features': 3})
+
+
+# Moving the changes between snapshots with diffs
+class TestSnapshotDiff(unittest.TestCase):
+    def setUp(self):
+        self.uninstall = install_fake_ceph()
+        from ims.ceph_wrapper import RBD
+        self.conf_file = tempfile.NamedTemporaryFile()
+        self.fs = RBD({'id': 'bench', 'pool': 'bench',
+                       'conf_file': self.conf_file.name})
+
+    def tearDown(self):
+        from ims import ceph_pool
+        self.fs.tear_down()
+        ceph_pool.connections.close_all()
+        self.conf_file.close()
+        self.uninstall()
+
+    def __read(self, img_id):
+        dest = io.BytesIO()
+        self.fs.export_image(img_id, dest)
+        return dest.getvalue()
+
+    def test_failed_snapshot(self):
+        first = os.urandom(8192)
+        self.fs.import_image('src', io.BytesIO(first))
+        self.fs.snap_image('src', 'v1')
+        whole = io.BytesIO()
+        self.fs.export_diff('src', 'v1', whole)
+        whole.seek(0)
+        self.fs.import_diff('dest', whole)
+
+        from ims.benchmark import fake_rbd
+        with fake_rbd.Image(self.fs.context, 'src') as img:
+            img.write(os.urandom(4096), 4096)
+        self.fs.snap_image('src', 'v2')
+        changes = io.BytesIO()
+        self.fs.export_diff('src', 'v2', changes, from_snap='v1')
+
+        # the applied changes are rolled back if the snapshot they end at
+        # cannot be created
+        snap_image = self.fs.snap_image
+
+        def fail(img_id, name):
+            raise file_system_exceptions.ImageExistsException(name)
+        self.fs.snap_image = fail
+        changes.seek(0)
+        self.assertRaises(file_system_exceptions.ImageExistsException,
+                          self.fs.import_diff, 'dest', changes)
+        self.assertEqual(self.__read('dest'), first)
+
+        self.fs.snap_image = snap_image
+        changes.seek(0)
+        self.fs.import_diff('dest', changes)
+        self.assertEqual(self.__read('dest'), self.__read('src'))
+        self.assertEqual(self.fs.list_snapshots('dest'), ['v1', 'v2'])
@@ -0,0 +1,117 @@
+import datetime
+from unittest import TestCase
+
+from ims.benchmark.run import Benchmark, CHANNEL, NETWORK, NIC, SNAPSHOT, \
+    install_fake_ceph
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+
+# flatten needs ceph to be importable
+class TestThrottle(TestCase):
+    def setUp(self):
+        self.uninstall = install_fake_ceph()
+
+    def tearDown(self):
+        self.uninstall()
+
+    def test_pacing(self):
+        from ims.flatten import Throttle
+        clock = FakeClock()
+        throttle = Throttle(100, clock=clock, sleep=clock.sleep)
+        # the first caller goes right away and reserves a second
+        throttle.acquire(100)
+        self.assertEqual(clock.sleeps, [])
+        # the next ones wait for the reservations before them
+        throttle.acquire(50)
+        throttle.acquire(50)
+        self.assertEqual(clock.sleeps, [1.0, 1.5])
+
+        # time which went by unused is not saved up
+        clock.now = 10.0
+        throttle.acquire(100)
+        self.assertEqual(clock.sleeps, [1.0, 1.5])
+
+    def test_no_limit(self):
+        from ims.flatten import Throttle
+        clock = FakeClock()
+        throttle = Throttle(0, clock=clock, sleep=clock.sleep)
+        for _ in range(3):
+            throttle.acquire(10 ** 9)
+        self.assertEqual(clock.sleeps, [])
+
+
+class TestFlattenScheduler(TestCase):
+    def setUp(self):
+        self.benchmark = Benchmark(nodes=3, concurrency=1)
+        self.benchmark.setup()
+        self.bmi = self.benchmark.bmi
+        self.nodes = self.benchmark.nodes
+        results = self.bmi.provision_many(
+            [(node, NIC) for node in self.nodes], self.benchmark.image_id,
+            SNAPSHOT, NETWORK, CHANNEL)
+        self.assertEqual([results[node]['status_code'] for node in self.nodes],
+                         [200] * 3)
+
+    def tearDown(self):
+        self.benchmark.close()
+
+    def test_run(self):
+        from ims.database import CloneRepository
+        from ims.flatten import FlattenScheduler
+        # the oldest clone, whose image is gone
+        CloneRepository().insert('gone', self.benchmark.image_id, SNAPSHOT,
+                                 datetime.datetime(2000, 1, 1))
+        scheduler = FlattenScheduler(
+            self.bmi.config.fs['ceph'],
+            {'min_age': '0', 'batch_size': '2', 'max_bytes_per_second': '0'})
+
+        report = scheduler.run()
+        self.assertEqual(sorted(report['failed']), ['gone'])
+        self.assertEqual(len(report['flattened']), 1)
+        self.assertEqual(report['removable_snapshots'], [])
+
+        # the failed clone waits a pass and does not take up the batch
+        report = scheduler.run()
+        self.assertEqual(report['failed'], {})
+        self.assertEqual(len(report['flattened']), 2)
+        self.assertEqual(report['removable_snapshots'],
+                         [self.benchmark.image_id + '@' + SNAPSHOT])
+        flattened = CloneRepository().fetch_unflattened_before(
+            datetime.datetime.utcnow() + datetime.timedelta(days=1))
+        self.assertEqual([clone['name'] for clone in flattened], ['gone'])
+
+        # then twice as long after every failure in a row
+        self.assertEqual(sorted(scheduler.run()['failed']), ['gone'])
+        self.assertEqual(scheduler.run()['failed'], {})
+        self.assertEqual(scheduler.run()['failed'], {})
+        self.assertEqual(sorted(scheduler.run()['failed']), ['gone'])
+
+        # a removed clone is forgotten once it is up again
+        CloneRepository().delete_with_names(['gone'])
+        for _ in range(5):
+            scheduler.run()
+        self.assertEqual(scheduler.failures, {})
+
+    def test_get_scheduler(self):
+        from ims.flatten import get_scheduler
+        fs_config = self.bmi.config.fs['ceph']
+        settings = {'interval': '0', 'workers': '1'}
+        scheduler = get_scheduler(fs_config, settings)
+        self.assertIs(get_scheduler(fs_config, dict(settings)), scheduler)
+        # other settings or another cluster get a scheduler of their own
+        other = get_scheduler(fs_config, {'interval': '0', 'workers': '2'})
+        self.assertIsNot(other, scheduler)
+        self.assertEqual((scheduler.workers, other.workers), (1, 2))
+        self.assertIsNot(get_scheduler(dict(fs_config, pool='other'),
+                                       settings), scheduler)
@@ -0,0 +1,80 @@
+import threading
+from unittest import TestCase
+
+from ims.benchmark.fake_haas import FakeHaaS
+from ims.exception import haas_exceptions
+from ims.haas_wrapper import HaaS
+
+
+# The HaaS client against the fake HaaS of the benchmark
+class TestHaaS(TestCase):
+    def setUp(self):
+        self.fake = FakeHaaS().start()
+        self.fake.add_nodes('project', ['node'])
+        self.haas = HaaS(self.fake.url, 'usr', 'passwd')
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_networks(self):
+        self.haas.attach_node_to_project_network('node', 'network',
+                                                 'vlan/native', 'eth0')
+        self.assertEqual(self.fake.networks,
+                         {('node', 'eth0'): ('vlan/native', 'network')})
+        self.assertTrue(self.haas.is_node_on_network('node', 'network',
+                                                     'eth0'))
+        self.assertFalse(self.haas.is_node_on_network('node', 'other',
+                                                      'eth0'))
+
+        # only the network the nic is on can be detached
+        self.assertRaises(haas_exceptions.UnknownException,
+                          self.haas.detach_node_from_project_network,
+                          'node', 'other', 'eth0')
+        self.haas.detach_node_from_project_network('node', 'network', 'eth0')
+        self.assertEqual(self.fake.networks, {})
+        self.assertFalse(self.haas.is_node_on_network('node', 'network',
+                                                      'eth0'))
+
+    def test_project_nodes(self):
+        self.haas.detach_node_from_project('project', 'node')
+        self.assertEqual(self.fake.free, {'node'})
+        self.haas.attach_node_haas_project('project', 'node')
+        self.assertEqual(self.fake.projects, {'project': {'node'}})
+
+    def test_links(self):
+        link = HaaS._HaaS__link
+        # apis with and without a leading / stay under the path of the url
+        for base_url in ['http://haas/api', 'http://haas/api/']:
+            self.assertEqual(link(base_url, '/node/node'),
+                             'http://haas/api/node/node')
+            self.assertEqual(link(base_url, 'node/node'),
+                             'http://haas/api/node/node')
+        self.assertEqual(link('http://haas', '/free_nodes'),
+                         link('http://haas', 'free_nodes'))
+
+    def test_max_concurrency(self):
+        self.fake.latency = 0.05
+        haas = HaaS(self.fake.url, 'usr', 'passwd', max_concurrency=2)
+        lock = threading.Lock()
+        in_flight = [0, 0]
+        answer = self.fake.answer
+
+        def counting_answer(*args):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            try:
+                return answer(*args)
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+        self.fake.answer = counting_answer
+
+        threads = [threading.Thread(target=haas.show_node, args=('node',))
+                   for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.fake.requests, 6)
+        self.assertEqual(in_flight[1], 2)
@@ -87,6 +87,32 @@ class TestOperations(unittest.TestCase):
         print output
         self.assertEqual(output[constants.STATUS_CODE_KEY], 500)
 
+    def test_provision_many(self):
+        good_bmi = BMI(CORRECT_HAAS_USERNAME, CORRECT_HAAS_PASSWORD)
+
+        output = good_bmi.provision_many([(NODE_NAME, NIC)],
+                                         NOT_EXIST_IMG_NAME, EXIST_SNAP_NAME,
+                                         NETWORK, CHANNEL)
+        print output
+        self.assertEqual(output[NODE_NAME][constants.STATUS_CODE_KEY], 404)
+
+        time.sleep(30)
+
+        output = good_bmi.detach_node(NODE_NAME, NETWORK, NIC)
+        print output
+        self.assertEqual(output[constants.STATUS_CODE_KEY], 500)
+
+        time.sleep(30)
+
+        output = good_bmi.provision_many([(NODE_NAME, NIC)], EXIST_IMG_NAME,
+                                         EXIST_SNAP_NAME, NETWORK, CHANNEL)
+        print output
+        self.assertEqual(output[NODE_NAME][constants.STATUS_CODE_KEY], 200)
+
+        output = good_bmi.detach_node(NODE_NAME, NETWORK, NIC)
+        print output
+        self.assertEqual(output[constants.STATUS_CODE_KEY], 200)
+
     def test_create_snapshot(self):
         good_bmi = BMI(CORRECT_HAAS_USERNAME, CORRECT_HAAS_PASSWORD)
         bad_bmi = BMI(CORRECT_HAAS_USERNAME, INCORRECT_HAAS_PASSWORD)
@@ -0,0 +1,77 @@
+import json
+import logging
+import unittest
+from multiprocessing.pool import ThreadPool
+
+from ims import metrics
+
+
+class RecordHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        histogram = metrics.Histogram('test_seconds', 'Latency of tests',
+                                      ('endpoint',), buckets=(0.1, 1.0,
+                                                              float('inf')))
+        histogram.observe(0.05, endpoint='a"b')
+        histogram.observe(0.5, endpoint='a"b')
+        histogram.observe(5, endpoint='a"b')
+        with self.assertRaises(ValueError):
+            with histogram.time(endpoint='c'):
+                raise ValueError()
+        self.assertEqual(histogram.summary(endpoint='a"b'), (3, 5.55))
+        self.assertEqual(histogram.errors.value(endpoint='c'), 1)
+
+        lines = histogram.render()
+        self.assertEqual(lines[:5], [
+            '# HELP test_seconds Latency of tests',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{endpoint="a\\"b",le="0.1"} 1',
+            'test_seconds_bucket{endpoint="a\\"b",le="1.0"} 2',
+            'test_seconds_bucket{endpoint="a\\"b",le="+Inf"} 3'])
+        self.assertIn('test_seconds_count{endpoint="c"} 1', lines)
+        self.assertIn('# TYPE test_errors_total counter', lines)
+        self.assertEqual(lines[-1], 'test_errors_total{endpoint="c"} 1.0')
+
+    def test_operation_record(self):
+        handler = RecordHandler()
+        metrics.logger.addHandler(handler)
+        metrics.logger.setLevel(logging.INFO)
+        try:
+            @metrics.CEPH_SECONDS.time(operation='clone')
+            def clone(name):
+                return name
+
+            @metrics.operation('test_provision')
+            def provision():
+                clone('n1')
+                # phases on worker threads count when the worker is bound
+                pool = ThreadPool(2)
+                try:
+                    pool.map(metrics.bind(clone), ['n2', 'n3'])
+                    pool.map(clone, ['n4'])
+                finally:
+                    pool.close()
+                    pool.join()
+                return {'status_code': 404}
+
+            self.assertEqual(provision(), {'status_code': 404})
+        finally:
+            metrics.logger.removeHandler(handler)
+
+        record = handler.records[-1].bmi_operation
+        self.assertEqual(json.loads(handler.records[-1].getMessage()), record)
+        self.assertEqual(record['operation'], 'test_provision')
+        self.assertEqual(record['status'], '404')
+        self.assertEqual(record['phases']['ceph:clone']['count'], 3)
+        self.assertEqual(metrics.OPERATION_SECONDS.summary(
+            operation='test_provision', status='404')[0], 1)
+        self.assertIn('bmi_operation_seconds_count{operation="test_provision",'
+                      'status="404"} 1', metrics.render())
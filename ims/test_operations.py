@@ -0,0 +1,240 @@
+import io
+import os
+import time
+from unittest import TestCase
+
+from ims.benchmark import fake_rbd
+from ims.benchmark.run import Benchmark, CHANNEL, IMAGE, NETWORK, NIC, \
+    PROJECT, SNAPSHOT
+
+
+# Tests for the bulk operations of BMI on the fakes of HaaS, ceph and iscsi
+class TestBulkDetach(TestCase):
+    def setUp(self):
+        self.benchmark = Benchmark(nodes=4, concurrency=2)
+        self.benchmark.setup()
+        self.bmi = self.benchmark.bmi
+        self.nodes = self.benchmark.nodes
+        results = self.bmi.provision_many(
+            [(node, NIC) for node in self.nodes], self.benchmark.image_id,
+            SNAPSHOT, NETWORK, CHANNEL)
+        self.assertEqual([results[node]['status_code'] for node in self.nodes],
+                         [200] * 4)
+
+    def tearDown(self):
+        self.benchmark.close()
+
+    def __devices(self):
+        return os.listdir(os.path.join(self.bmi.config.iscsi_rbd_sysfs_dir,
+                                       'devices'))
+
+    def test_detach_many(self):
+        # the clone of the first node can not be removed
+        held = self.nodes[0]
+        fake_rbd.pools['bench'][held].snaps['held'] = ''
+        results = self.bmi.detach_many([(node, NIC) for node in self.nodes],
+                                       NETWORK, max_workers=4)
+        self.assertNotEqual(results[held]['status_code'], 200)
+        for node in self.nodes[1:]:
+            self.assertEqual(results[node]['status_code'], 200)
+            self.assertNotIn(node, fake_rbd.pools['bench'])
+        # every target was removed and its device unmapped
+        self.assertEqual(self.bmi.iscsi.fetch_targeted(self.nodes), set())
+        self.assertEqual(self.__devices(), [])
+        self.assertEqual(self.benchmark.haas.networks, {})
+
+        del fake_rbd.pools['bench'][held].snaps['held']
+        results = self.bmi.detach_many([(held, NIC)], NETWORK)
+        self.assertEqual(results[held]['status_code'], 200)
+        self.assertNotIn(held, fake_rbd.pools['bench'])
+
+    def test_detach_project(self):
+        from ims.database import CloneRepository
+        # provisioned before clones were recorded
+        CloneRepository().delete_with_names([self.nodes[0]])
+        # not provisioned by BMI
+        self.benchmark.haas.add_nodes(PROJECT, ['other-node'])
+
+        results = self.bmi.detach_project(PROJECT, NETWORK, NIC)
+        self.assertEqual(sorted(results), sorted(self.nodes + ['other-node']))
+        for node in self.nodes:
+            self.assertEqual(results[node]['status_code'], 200)
+        self.assertEqual(results['other-node']['msg'],
+                         'Node Already Unmapped')
+        self.assertEqual(self.__devices(), [])
+        self.assertEqual(sorted(fake_rbd.pools['bench']),
+                         [self.benchmark.image_id])
+
+
+# Tests for retrying provisions, which must never hand a node what is left
+# of its last use
+class TestProvisionSaga(TestCase):
+    def setUp(self):
+        self.benchmark = Benchmark(nodes=2, concurrency=1)
+        self.benchmark.setup()
+        self.bmi = self.benchmark.bmi
+        self.haas = self.benchmark.haas
+        self.node = self.benchmark.nodes[0]
+
+    def tearDown(self):
+        self.benchmark.close()
+
+    def __provision(self):
+        return self.bmi.provision(self.node, self.benchmark.image_id,
+                                  SNAPSHOT, NETWORK, CHANNEL, NIC)
+
+    def test_unfinished_detach(self):
+        from ims.database import SagaRepository
+        SagaRepository().insert('detach:' + self.node, 'detach_network')
+        self.assertEqual(self.__provision()['status_code'], 409)
+        results = self.bmi.provision_many(
+            [(node, NIC) for node in self.benchmark.nodes],
+            self.benchmark.image_id, SNAPSHOT, NETWORK, CHANNEL)
+        self.assertEqual(results[self.node]['status_code'], 409)
+        self.assertEqual(results[self.benchmark.nodes[1]]['status_code'], 200)
+        self.assertNotIn(self.node, fake_rbd.pools['bench'])
+        self.assertEqual(self.haas.networks.keys(),
+                         [(self.benchmark.nodes[1], NIC)])
+
+        # the detach is finished by a retry, which forgets both sagas
+        self.assertEqual(self.bmi.detach_node(self.node, NETWORK, NIC)[
+            'status_code'], 200)
+        self.assertEqual(SagaRepository().fetch_steps('detach:' + self.node),
+                         set())
+        self.assertEqual(self.__provision()['status_code'], 200)
+
+    def test_leftover_clone(self):
+        self.assertEqual(self.__provision()['status_code'], 200)
+        # the clone of the last use is left behind without its target and
+        # network, no saga of this provision made it
+        self.bmi.iscsi.remove_target(self.node).check()
+        self.haas.networks.clear()
+        self.assertNotEqual(self.__provision()['status_code'], 200)
+        self.assertEqual(self.haas.networks, {})
+        self.assertIn(self.node, fake_rbd.pools['bench'])
+
+    def test_adopt_started(self):
+        from ims.database import SagaRepository
+        # attached already by an attempt which was cut off
+        self.bmi.haas.attach_node_to_project_network(self.node, NETWORK,
+                                                     CHANNEL, NIC)
+        self.assertNotEqual(self.__provision()['status_code'], 200)
+        self.assertIn((self.node, NIC), self.haas.networks)
+        SagaRepository().insert('provision:' + self.node,
+                                'attach_network:started')
+        self.assertEqual(self.__provision()['status_code'], 200)
+        self.assertEqual(SagaRepository().fetch_steps(
+            'provision:' + self.node), set())
+
+
+# Tests for moving snapshots between sites with diffs
+class TestSnapshotDiff(TestCase):
+    def setUp(self):
+        self.benchmark = Benchmark(nodes=1, concurrency=1)
+        self.benchmark.setup()
+        self.bmi = self.benchmark.bmi
+
+    def tearDown(self):
+        self.benchmark.close()
+
+    def test_whole_snapshot(self):
+        diff = io.BytesIO()
+        self.assertEqual(self.bmi.export_snapshot_diff(
+            PROJECT, IMAGE, SNAPSHOT, diff)['status_code'], 200)
+
+        # a whole snapshot is not written over an image
+        data = os.urandom(8192)
+        self.assertEqual(self.bmi.import_image(
+            PROJECT, 'other', io.BytesIO(data))['status_code'], 200)
+        diff.seek(0)
+        self.assertEqual(self.bmi.import_snapshot_diff(
+            PROJECT, 'other', diff)['status_code'], 471)
+        self.assertEqual(self.bmi.list_snaps(PROJECT, 'other')['retval'], [])
+        dest = io.BytesIO()
+        self.bmi.export_image(PROJECT, 'other', dest)
+        self.assertEqual(dest.getvalue(), data)
+
+        diff.seek(0)
+        self.assertEqual(self.bmi.import_snapshot_diff(
+            PROJECT, 'copy', diff)['status_code'], 200)
+        self.assertEqual(self.bmi.list_snaps(PROJECT, 'copy')['retval'],
+                         [SNAPSHOT])
+
+
+# Tests for comparing the pool with the database
+class TestReconcile(TestCase):
+    def setUp(self):
+        self.benchmark = Benchmark(nodes=1, concurrency=1)
+        self.benchmark.setup()
+        self.bmi = self.benchmark.bmi
+
+    def tearDown(self):
+        self.benchmark.close()
+
+    def test_numeric_names(self):
+        from ims.ceph_wrapper import RBD
+        from ims.database import CloneRepository
+        # nodes can be named like the ids of images
+        self.benchmark.haas.add_nodes(PROJECT, ['42', '43'])
+        for node in ('42', '43'):
+            self.assertEqual(self.bmi.provision(
+                node, self.benchmark.image_id, SNAPSHOT, NETWORK, CHANNEL,
+                NIC)['status_code'], 200)
+        CloneRepository().delete_with_names(['43'])
+        CloneRepository().insert('gone', self.benchmark.image_id, SNAPSHOT)
+        # not registered
+        with RBD(self.bmi.config.fs['ceph']) as fs:
+            fs.create_image('999', 4096)
+
+        report = self.bmi.reconcile(repair_ceph=True)['retval']
+        self.assertEqual(report['ceph_orphans'], ['999'])
+        self.assertEqual([clone['name'] for clone in
+                          report['untracked_clones']], ['43'])
+        self.assertEqual(report['repaired']['ceph_orphans'], 1)
+        self.assertEqual(report['stale_clones'], ['gone'])
+        self.assertEqual(report['db_orphans'], [])
+        self.assertEqual(sorted(fake_rbd.pools['bench']),
+                         sorted(['42', '43', self.benchmark.image_id]))
+
+
+# Tests for provisioning from the clones kept ready by a warm pool
+class TestWarmPool(TestCase):
+    def setUp(self):
+        self.benchmark = Benchmark(nodes=1, concurrency=1)
+        self.benchmark.setup()
+        self.bmi = self.benchmark.bmi
+        self.fs_config = self.bmi.config.fs['ceph']
+        self.pools = {(self.benchmark.image_id, SNAPSHOT): {
+            'size': 2, 'refill_workers': 1, 'metrics': True}}
+
+    def tearDown(self):
+        self.benchmark.close()
+
+    def __ready(self, warm_pool, count):
+        name = self.benchmark.image_id + '@' + SNAPSHOT
+        deadline = time.time() + 5
+        while warm_pool.stats()[name]['ready'] < count and \
+                time.time() < deadline:
+            time.sleep(0.01)
+        return warm_pool.stats()[name]
+
+    def test_claim(self):
+        from ims.warm_pool import get_warm_pool
+        warm_pool = get_warm_pool(self.fs_config, self.pools)
+        try:
+            # one pool for every config, which is only filled when asked
+            self.assertIs(get_warm_pool(self.fs_config, self.pools),
+                          warm_pool)
+            self.assertIsNot(self.bmi.warm_pool, warm_pool)
+            self.assertEqual(self.__ready(warm_pool, 0)['ready'], 0)
+
+            self.bmi.warm_pool = warm_pool
+            self.assertEqual(self.bmi.fill_warm_pools()['status_code'], 200)
+            self.assertEqual(self.__ready(warm_pool, 2)['ready'], 2)
+            self.assertEqual(self.bmi.provision(
+                self.benchmark.nodes[0], self.benchmark.image_id, SNAPSHOT,
+                NETWORK, CHANNEL, NIC)['status_code'], 200)
+            stats = self.__ready(warm_pool, 2)
+            self.assertEqual((stats['hits'], stats['ready']), (1, 2))
+        finally:
+            warm_pool.close()
@@ -0,0 +1,155 @@
+import threading
+import uuid
+from multiprocessing.pool import ThreadPool
+
+import constants
+from ceph_wrapper import RBD
+from database import CloneRepository
+from exception import *
+
+
+# Keeps ready made clones of popular image snapshots so that provisioning only
+# has to rename one into place instead of cloning on the request path
+# The clones are recorded in the clone table under placeholder names, which
+# makes them visible to every BMI process and to the reconciler. A rename in
+# ceph only succeeds once, so two processes never get the same clone.
+# Refills run in the background with at most refill_workers clones of a pool
+# being made at a time by this process
+class WarmPool:
+    def __init__(self, fs_config, pools):
+        self.fs_config = fs_config
+        self.pools = pools
+        self.lock = threading.Lock()
+        self.refilling = dict((key, 0) for key in pools)
+        self.counters = dict(
+            (key, {'hits': 0, 'misses': 0, 'refilled': 0, 'errors': 0})
+            for key in pools)
+        workers = sum(settings[constants.WARM_POOL_REFILL_WORKERS_KEY]
+                      for settings in pools.values())
+        self.pool = ThreadPool(workers) if workers else None
+
+    def __count(self, key, counter):
+        with self.lock:
+            self.counters[key][counter] += 1
+
+    # Moves a ready clone of img_name@snap_name to clone_name and starts a
+    # refill of the pool
+    # Returns True if a clone was taken, False if the caller has to clone
+    def claim(self, img_name, snap_name, clone_name):
+        key = (img_name, snap_name)
+        if key not in self.pools:
+            return False
+        cloner = CloneRepository()
+        claimed = False
+        try:
+            with RBD(self.fs_config) as fs:
+                for name in cloner.fetch_names_with_parent(
+                        img_name, snap_name, constants.WARM_POOL_CLONE_PREFIX):
+                    try:
+                        fs.rename(name, clone_name)
+                    except file_system_exceptions.ImageNotFoundException:
+                        # taken by another process or lost, lost ones would
+                        # keep the pool from being refilled
+                        if not fs.image_exists(name):
+                            cloner.delete_with_names([name])
+                        continue
+                    # the record is gone if it was just taken for lost
+                    if not cloner.rename(name, clone_name):
+                        cloner.insert(clone_name, img_name, snap_name)
+                    claimed = True
+                    break
+        finally:
+            self.__count(key, 'hits' if claimed else 'misses')
+            self.refill(img_name, snap_name)
+        return claimed
+
+    # Starts making clones in the background until the pool of
+    # img_name@snap_name is full again
+    def refill(self, img_name, snap_name):
+        key = (img_name, snap_name)
+        if key not in self.pools or self.pool is None:
+            return
+        settings = self.pools[key]
+        try:
+            ready = len(CloneRepository().fetch_names_with_parent(
+                img_name, snap_name, constants.WARM_POOL_CLONE_PREFIX))
+        except DBException:
+            self.__count(key, 'errors')
+            return
+        with self.lock:
+            in_flight = self.refilling[key]
+            start = min(settings[constants.WARM_POOL_SIZE_KEY] - ready,
+                        settings[constants.WARM_POOL_REFILL_WORKERS_KEY]) - \
+                    in_flight
+            start = max(start, 0)
+            self.refilling[key] += start
+        for _ in range(start):
+            self.pool.apply_async(self.__make_clone, (key,))
+
+    def refill_all(self):
+        for img_name, snap_name in self.pools:
+            self.refill(img_name, snap_name)
+
+    # Makes one placeholder clone and carries on with the refill
+    # A failure stops the refill until the next claim
+    def __make_clone(self, key):
+        name = constants.WARM_POOL_CLONE_PREFIX + uuid.uuid4().hex
+        made = False
+        try:
+            with RBD(self.fs_config) as fs:
+                fs.clone(key[0], key[1], name)
+                try:
+                    CloneRepository().insert(name, key[0], key[1])
+                except DBException:
+                    fs.remove(name)
+                    raise
+            made = True
+            self.__count(key, 'refilled')
+        except (FileSystemException, DBException):
+            self.__count(key, 'errors')
+        finally:
+            with self.lock:
+                self.refilling[key] -= 1
+        if made:
+            self.refill(*key)
+
+    # Returns {<image>@<snapshot> : counters} for the pools with metrics on
+    # along with their size and the number of ready clones
+    def stats(self):
+        cloner = CloneRepository()
+        stats = {}
+        for key, settings in self.pools.items():
+            if not settings[constants.WARM_POOL_METRICS_KEY]:
+                continue
+            with self.lock:
+                pool_stats = dict(self.counters[key])
+            pool_stats['size'] = settings[constants.WARM_POOL_SIZE_KEY]
+            pool_stats['ready'] = len(cloner.fetch_names_with_parent(
+                key[0], key[1], constants.WARM_POOL_CLONE_PREFIX))
+            stats[key[0] + '@' + key[1]] = pool_stats
+        return stats
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+
+_warm_pools = {}
+_warm_pools_lock = threading.Lock()
+
+
+# Returns the warm pool of this process for the ceph config and the pools,
+# every config gets its own
+# Nothing is cloned until refill_all or the first claim from a pool, so that
+# making a BMI does not start cloning in the background
+def get_warm_pool(fs_config, pools):
+    key = (tuple(sorted(fs_config.items())),
+           tuple(sorted((pool, tuple(sorted(settings.items())))
+                        for pool, settings in pools.items())))
+    with _warm_pools_lock:
+        warm_pool = _warm_pools.get(key)
+        if warm_pool is None:
+            warm_pool = WarmPool(fs_config, pools)
+            _warm_pools[key] = warm_pool
+        return warm_pool
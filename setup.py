@@ -4,7 +4,12 @@ setup(
     name='ims',
     version='0.2',
     install_requires=["sqlalchemy>=1.0.13", 'requests'],
-    packages=['ims', 'ims.database', 'ims.exception'],
+    extras_require={'postgres': ['psycopg2']},
+    entry_points={
+        'console_scripts': ['bmi-db-upgrade = ims.database.schema:main',
+                            'bmi-benchmark = ims.benchmark.run:main']},
+    packages=['ims', 'ims.benchmark', 'ims.database', 'ims.exception',
+              'ims.iscsi'],
     url='',
     license='',
     author='chemistry_sourabh',